@@ -1,4 +1,10 @@
-import subprocess, time, os, hashlib, re, argparse, sys, threading, json
+import subprocess, time, os, hashlib, re, argparse, sys, threading, json, struct, io
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
 
 def run(cmd, capture=False, check=True):
     if capture:
@@ -46,8 +52,84 @@ def get_screen_size(serial=None):
 
 def screencap_to_file(path, serial=None):
     raw = adb_cmd(["exec-out","screencap","-p"], serial, capture=True)
-    with open(path, "wb") as f:
+    # Ghi file tạm rồi thay thế: không ghi đè vào inode có thể đang là hardlink của kho blob
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
         f.write(raw)
+    os.replace(tmp_path, path)
+
+# Định dạng pixel của `screencap` raw: mã -> (số byte/pixel, raw mode cho Pillow, mode ảnh)
+RAW_PIXEL_FORMATS = {
+    1: (4, "RGBA", "RGBA"),  # RGBA_8888
+    2: (4, "RGBX", "RGB"),   # RGBX_8888
+    3: (3, "RGB", "RGB"),    # RGB_888
+}
+
+def screencap_raw(serial=None):
+    """
+    Chụp màn hình dạng raw (chưa mã hóa PNG).
+    Trả về: (width, height, format, memoryview các điểm ảnh)
+    """
+    raw = adb_cmd(["exec-out","screencap"], serial, capture=True)
+    if len(raw) < 12:
+        raise RuntimeError("Dữ liệu screencap raw không hợp lệ")
+    w, h, fmt = struct.unpack_from("<III", raw, 0)
+    if fmt not in RAW_PIXEL_FORMATS:
+        raise RuntimeError(f"Không hỗ trợ định dạng pixel {fmt}")
+    # Header 12 byte, Android 9+ thêm 4 byte colorspace
+    header = len(raw) - w * h * RAW_PIXEL_FORMATS[fmt][0]
+    if header not in (12, 16):
+        raise RuntimeError("Kích thước dữ liệu screencap raw không khớp")
+    return w, h, fmt, memoryview(raw)[header:]
+
+def crop_rows(pixels, width, bytes_per_pixel, top, bottom):
+    """Lấy các hàng [top, bottom) - là một đoạn liên tục trong buffer nên không cần copy"""
+    stride = width * bytes_per_pixel
+    return pixels[top * stride:bottom * stride]
+
+def resolve_crop_region(height, crop=None, padding_top=None, padding_bottom=None):
+    """
+    Tính vùng nội dung (top, bottom) theo pixel.
+    crop: {"top": tỉ lệ, "bottom": tỉ lệ} cấu hình theo kênh; nếu không có thì
+    suy ra từ padding vuốt (vùng giữa 2 điểm vuốt).
+    """
+    if crop:
+        top_ratio, bottom_ratio = crop.get("top", 0.0), crop.get("bottom", 0.0)
+    elif padding_top is not None and padding_bottom is not None:
+        top_ratio, bottom_ratio = padding_top, padding_bottom
+    else:
+        return None
+    top = max(0, int(height * top_ratio))
+    bottom = min(height, int(height * (1 - bottom_ratio)))
+    if bottom <= top:
+        return None
+    return top, bottom
+
+def screencap_region_to_file(path, region, serial=None):
+    """
+    Chụp, cắt vùng nội dung trên buffer raw rồi mới mã hóa PNG.
+    Trả về sha256 của phần điểm ảnh đã cắt (dùng để so trùng khung).
+    """
+    if not PIL_AVAILABLE:
+        raise RuntimeError("Cần cài Pillow để cắt vùng ảnh: pip install Pillow")
+    top, bottom = region
+    try:
+        w, h, fmt, pixels = screencap_raw(serial)
+        bpp, raw_mode, mode = RAW_PIXEL_FORMATS[fmt]
+        bottom = min(bottom, h)
+        view = crop_rows(pixels, w, bpp, top, bottom)
+        digest = hashlib.sha256(view).hexdigest()
+        image = Image.frombuffer(mode, (w, bottom - top), view, "raw", raw_mode, 0, 1)
+    except RuntimeError:
+        # Thiết bị không hỗ trợ raw -> giải mã PNG rồi cắt
+        png = adb_cmd(["exec-out","screencap","-p"], serial, capture=True)
+        full = Image.open(io.BytesIO(png))
+        image = full.crop((0, top, full.width, min(bottom, full.height)))
+        digest = hashlib.sha256(image.tobytes()).hexdigest()
+    tmp_path = path + ".tmp"
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+    return digest
 
 def swipe(x1,y1,x2,y2,duration_ms, serial=None):
     adb_cmd(["shell","input","swipe",str(x1),str(y1),str(x2),str(y2),str(duration_ms)], serial)
@@ -198,6 +280,22 @@ class ChannelManager:
     def get_branch_name(self, channel_key, branch_code):
         return self.channels.get(channel_key, {}).get("branches", {}).get(branch_code, branch_code)
     
+    def get_crop_region(self, channel_key):
+        """Vùng nội dung cần lưu của kênh: {"top": tỉ lệ, "bottom": tỉ lệ} hoặc None"""
+        return self.channels.get(channel_key, {}).get("crop")
+    
+    def set_crop_region(self, channel_key, top, bottom):
+        """Đặt tỉ lệ cắt bỏ phía trên (status bar, header) và phía dưới (thanh điều hướng)"""
+        if channel_key not in self.channels:
+            print(f"Kênh '{channel_key}' không tồn tại!")
+            return False
+        if top is None and bottom is None:
+            self.channels[channel_key].pop("crop", None)
+        else:
+            self.channels[channel_key]["crop"] = {"top": top or 0.0, "bottom": bottom or 0.0}
+        self.save_config()
+        return True
+    
     def validate_selection(self, channel_key, branch_code):
         if channel_key not in self.channels:
             return False, f"Kênh '{channel_key}' không tồn tại"
@@ -299,16 +397,36 @@ class Stopper:
     def should_stop(self):
         return self._evt.is_set()
 
+# Định dạng ảnh được lưu: PNG gốc từ screencap hoặc bản đã nén (xem image_transcoder.py)
+IMAGE_EXTENSIONS = (".png", ".webp", ".avif")
+
+def image_file_pattern(branch_code, channel_short):
+    """Regex nhận diện file ảnh: SốThứTự_MãChiNhánh_Kênh.(png|webp|avif)"""
+    exts = "|".join(re.escape(ext[1:]) for ext in IMAGE_EXTENSIONS)
+    return re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.({exts})$", re.IGNORECASE)
+
+# Thư mục con giữ dấu vết (thumbnail hoặc file rỗng) của ảnh đã dọn khỏi ổ đĩa sau khi upload
+EVICTED_DIR = ".evicted"
+
+def list_image_filenames(output_dir):
+    """Liệt kê tên file trong thư mục, kể cả ảnh đã dọn. Trả về: [(tên file, đã dọn)]"""
+    entries = [(filename, False) for filename in os.listdir(output_dir)]
+    evicted_dir = os.path.join(output_dir, EVICTED_DIR)
+    if os.path.isdir(evicted_dir):
+        entries += [(filename, True) for filename in os.listdir(evicted_dir)]
+    return entries
+
 def get_next_image_number(output_dir, branch_code, channel_short):
     """Tìm số ảnh tiếp theo dựa trên file có sẵn trong thư mục"""
     if not os.path.exists(output_dir):
         return 1
     
     max_num = 0
-    pattern = re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.png$", re.IGNORECASE)
+    pattern = image_file_pattern(branch_code, channel_short)
     
     try:
-        for filename in os.listdir(output_dir):
+        # Ảnh đã dọn vẫn giữ số thứ tự để không bị ghi trùng tên trên Drive
+        for filename, _ in list_image_filenames(output_dir):
             match = pattern.match(filename)
             if match:
                 num = int(match.group(1))
@@ -326,45 +444,50 @@ def auto_sort_files(output_dir, branch_code, channel_short, log_callback=None):
     if not os.path.exists(output_dir):
         return 0, 0
 
-    # Pattern để tìm file: số_branch_channel.png
-    pattern = re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.png$", re.IGNORECASE)
+    # Pattern để tìm file: số_branch_channel.(png|webp|avif)
+    pattern = image_file_pattern(branch_code, channel_short)
 
-    # Tìm tất cả file phù hợp
-    files_info = []
+    # Tìm tất cả file phù hợp, gom các định dạng của cùng một số thứ tự
+    groups = {}
     try:
-        for filename in os.listdir(output_dir):
+        for filename, evicted in list_image_filenames(output_dir):
             match = pattern.match(filename)
             if match:
                 num = int(match.group(1))
-                files_info.append((num, filename))
+                groups.setdefault(num, []).append((filename, evicted))
     except Exception as e:
         if log_callback:
             log_callback(f"Lỗi khi đọc thư mục {output_dir}: {e}")
         return 0, 0
 
-    if not files_info:
+    if not groups:
         return 0, 0
 
     # Sắp xếp theo số thứ tự hiện tại
-    files_info.sort(key=lambda x: x[0])
-
-    # Kiểm tra xem có cần sắp xếp lại không
-    needs_sorting = False
-    for i, (current_num, _) in enumerate(files_info):
-        expected_num = i + 1
-        if current_num != expected_num:
-            needs_sorting = True
-            break
-
-    if not needs_sorting:
+    files_info = sorted(groups.items(), key=lambda x: x[0])
+
+    # Số mới cho từng nhóm, giữ thứ tự chụp. Số có ảnh đã dọn (.evicted/) giữ nguyên: tên đó gắn với
+    # bản trên Drive (sổ upload, drive_name), đổi tên thì không tìm lại được bản trên Drive
+    renames = []
+    next_num = 1
+    for current_num, filenames in files_info:
+        if any(evicted for _, evicted in filenames):
+            next_num = current_num + 1
+            continue
+        if current_num != next_num:
+            renames.append((current_num, next_num, filenames))
+        next_num += 1
+
+    if not renames:
         return 0, len(files_info)
 
-    # Sắp xếp lại tên file
+    # Sắp xếp lại tên file (giữ nguyên phần mở rộng của từng định dạng).
+    # Số mới luôn nhỏ hơn số cũ và các số nhỏ hơn đã được xử lý trước nên không đè file khác
     sorted_count = 0
-    for i, (old_num, old_filename) in enumerate(files_info):
-        new_num = i + 1
-        if old_num != new_num:
-            new_filename = f"{new_num:02d}_{branch_code}_{channel_short}.png"
+    for old_num, new_num, old_filenames in renames:
+        for old_filename, _ in old_filenames:
+            ext = os.path.splitext(old_filename)[1].lower()
+            new_filename = f"{new_num:02d}_{branch_code}_{channel_short}{ext}"
             old_path = os.path.join(output_dir, old_filename)
             new_path = os.path.join(output_dir, new_filename)
 
@@ -387,23 +510,21 @@ def get_folder_stats(output_dir, branch_code, channel_short):
     if not os.path.exists(output_dir):
         return 0, 0, 0
 
-    pattern = re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.png$", re.IGNORECASE)
+    pattern = image_file_pattern(branch_code, channel_short)
 
     numbers_found = set()
     total_size = 0
-    file_count = 0
 
     try:
-        for filename in os.listdir(output_dir):
+        for filename, evicted in list_image_filenames(output_dir):
             match = pattern.match(filename)
             if match:
                 num = int(match.group(1))
                 numbers_found.add(num)
-                file_count += 1
 
-                # Tính kích thước file
+                # Tính kích thước file (ảnh đã dọn không còn chiếm ổ đĩa)
                 filepath = os.path.join(output_dir, filename)
-                if os.path.isfile(filepath):
+                if not evicted and os.path.isfile(filepath):
                     total_size += os.path.getsize(filepath)
     except Exception:
         pass
@@ -416,6 +537,9 @@ def get_folder_stats(output_dir, branch_code, channel_short):
     else:
         missing_count = 0
 
+    # Mỗi số thứ tự tính là một ảnh dù có nhiều định dạng
+    file_count = len(numbers_found)
+
     # Chuyển kích thước sang MB
     size_mb = total_size / (1024 * 1024)
 
@@ -434,6 +558,13 @@ def main():
     ap.add_argument("--tune", action="store_true", help="Tối ưu emulator (tắt animation, kéo dài timeout)")
     ap.add_argument("--continue-numbering", action="store_true", default=True, help="Tự động tiếp số ảnh từ file có sẵn (mặc định: bật)")
     ap.add_argument("--reset-numbering", action="store_true", help="Bắt đầu lại từ số 1 (ghi đè --continue-numbering)")
+    ap.add_argument("--transcode", choices=["png", "webp_lossless", "webp", "avif"], default=None,
+                    help="Nén ảnh nền ngay sau khi chụp (png tối ưu / webp_lossless / webp / avif)")
+    ap.add_argument("--quality", type=int, default=80, help="Chất lượng nén cho webp/avif (1-100)")
+    ap.add_argument("--dedup-store", action="store_true",
+                    help="Lưu ảnh vào kho theo nội dung (<out>/.store), ảnh trùng chỉ chiếm dung lượng một lần")
+    ap.add_argument("--crop", action="store_true",
+                    help="Chỉ lưu vùng nội dung (theo cấu hình 'crop' của kênh, hoặc suy ra từ padding)")
     
     # Tham số mới cho kênh và chi nhánh
     ap.add_argument("--channel", help="Kênh (vd: shopeefood, grabfood)")
@@ -498,6 +629,12 @@ def main():
     print(f"Swipe: ({x},{y_start}) -> ({x},{y_end}) in {args.swipe_ms}ms")
     print(f"Lưu ảnh vào: {output_dir}")
 
+    region = None
+    if args.crop:
+        region = resolve_crop_region(h, manager.get_crop_region(channel_key), args.padding_top, args.padding_bottom)
+        if region:
+            print(f"✂️ Chỉ lưu vùng nội dung: y={region[0]}..{region[1]}")
+
     # Xác định số bắt đầu cho ảnh
     channel_short = channel_name.replace("Food", "")
     if args.reset_numbering:
@@ -515,6 +652,20 @@ def main():
 
     stopper = Stopper(enabled=args.interactive_stop)
 
+    store = None
+    if args.dedup_store:
+        from blob_store import BlobStore
+        store = BlobStore(args.out)
+        if not store.hardlinks:
+            store.close()
+            store = None
+
+    transcoder = None
+    if args.transcode:
+        from image_transcoder import ImageTranscoder
+        transcoder = ImageTranscoder(mode=args.transcode, quality=args.quality)
+        print(f"🗜️ Nén ảnh nền: {args.transcode} ({transcoder.max_workers} process)")
+
     last_hash, stuck, taken = None, 0, 0
 
     try:
@@ -527,8 +678,11 @@ def main():
             # Chuyển đổi tên kênh: ShopeeFood -> Shopee, GrabFood -> Grab
             filename = f"{i:02d}_{branch_code}_{channel_short}.png"
             path = os.path.join(output_dir, filename)
-            screencap_to_file(path, serial=serial)
-            digest = sha256(path)
+            if region:
+                digest = screencap_region_to_file(path, region, serial=serial)
+            else:
+                screencap_to_file(path, serial=serial)
+                digest = sha256(path)
 
             if digest == last_hash:
                 stuck += 1
@@ -541,12 +695,24 @@ def main():
                 taken += 1
                 print(f"+ Đã chụp: {filename}")
 
+            if transcoder:
+                # Đưa vào kho sau khi nén để blob là bản cuối cùng
+                transcoder.submit(path, callback=(lambda result: store.ingest(result['dst'])) if store else None)
+            elif store:
+                store.ingest(path)
+
             swipe(x, y_start, x, y_end, args.swipe_ms, serial=serial)
             time.sleep(args.delay)
             last_hash = digest
     except KeyboardInterrupt:
         print("\n>> Dừng do Ctrl+C")
     finally:
+        if transcoder:
+            transcoder.shutdown(wait=True)
+            transcoder.log_message(transcoder.format_stats())
+        if store:
+            store.report()
+            store.close()
         print(f"Hoàn tất: {taken} ảnh trong '{output_dir}'.")
 
 if __name__ == "__main__":
@@ -8,10 +8,22 @@ import re
 from Autoscreen import (
     ChannelManager, ensure_device, get_screen_size, maybe_tune_device,
     screencap_to_file, swipe, sha256, get_next_image_number,
-    auto_sort_files, get_folder_stats
+    auto_sort_files, get_folder_stats, image_file_pattern,
+    resolve_crop_region, screencap_region_to_file, list_image_filenames, EVICTED_DIR
 )
+from image_transcoder import ImageTranscoder, TRANSCODE_MODES, smallest_variant
+from blob_store import BlobStore
+from retention_manager import RetentionManager
+from upload_queue import LANE_LIVE, LANE_BACKFILL
+from perf_monitor import (
+    PerfMonitor, METRIC_SHOTS, METRIC_SCREENCAP, METRIC_HASH, METRIC_SWIPE, METRIC_SETTLE,
+    METRIC_DUPLICATES, METRIC_STUCK_STOPS, GAUGE_CAPTURE_RUNNING, GAUGE_SESSION_SHOTS
+)
+from perf_dashboard import PerfDashboard
+from metrics_exporter import MetricsExporter
 import time
 import json
+import multiprocessing
 from PIL import Image, ImageTk
 import subprocess
 
@@ -86,15 +98,34 @@ class AutoscreenGUI:
             self.drive_uploader.set_callbacks(
                 log_callback=self.log_message,
                 progress_callback=self.on_drive_upload_progress,
-                completion_callback=self.on_drive_upload_complete
+                completion_callback=self.on_drive_upload_complete,
+                chunk_callback=self.on_drive_upload_chunk
             )
             self.drive_uploader.load_config()
+            # Upload tiếp các file còn trong hàng đợi từ lần chạy trước
+            threading.Thread(target=self.drive_uploader.resume_pending_uploads, daemon=True).start()
+        
+        # Số liệu hiệu năng (luồng chụp và upload cùng ghi, tab Hiệu năng đọc)
+        self.perf_monitor = self.drive_uploader.metrics if self.drive_uploader else PerfMonitor()
+        
+        # Dọn ổ đĩa: chỉ xóa ảnh đã xác nhận trên Drive (dùng chung sổ ghi upload)
+        self.retention_manager = None
+        if self.drive_uploader:
+            self.retention_manager = RetentionManager(ledger=self.drive_uploader.ledger,
+                                                      log_callback=self.log_message)
+            self.retention_manager.load_config()
+        
+        # Endpoint /metrics cho Prometheus (tắt mặc định, bật bằng metrics_port trong gui_settings.json)
+        self.metrics_port = 0
+        self.metrics_host = "127.0.0.1"
+        self.metrics_exporter = None
         
         # Setup GUI
         self.setup_gui()
         
         # Load settings
         self.load_settings()
+        self.start_metrics_exporter()
         
         # Start log processor
         self.process_log_queue()
@@ -253,6 +284,18 @@ class AutoscreenGUI:
         overswipe_spin = ttk.Spinbox(settings_grid, from_=1, to=10, textvariable=self.overswipe_var, width=8)
         overswipe_spin.grid(row=1, column=5, sticky=tk.W, pady=2)
         
+        # Row 3: Nén ảnh sau khi chụp
+        ttk.Label(settings_grid, text="Nén ảnh:").grid(row=2, column=0, sticky=tk.W, padx=(0, 5), pady=2)
+        self.transcode_mode_var = tk.StringVar(value="none")
+        transcode_combo = ttk.Combobox(settings_grid, textvariable=self.transcode_mode_var, state="readonly",
+                                       values=["none"] + list(TRANSCODE_MODES), width=14)
+        transcode_combo.grid(row=2, column=1, sticky=tk.W, padx=(0, 10), pady=2)
+        
+        ttk.Label(settings_grid, text="Chất lượng:").grid(row=2, column=2, sticky=tk.W, padx=(0, 5), pady=2)
+        self.transcode_quality_var = tk.IntVar(value=80)
+        quality_spin = ttk.Spinbox(settings_grid, from_=1, to=100, textvariable=self.transcode_quality_var, width=8)
+        quality_spin.grid(row=2, column=3, sticky=tk.W, padx=(0, 10), pady=2)
+        
         # Row 3: Checkboxes
         checkbox_frame = ttk.Frame(settings_frame)
         checkbox_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -265,7 +308,18 @@ class AutoscreenGUI:
         self.continue_numbering_var = tk.BooleanVar(value=True)
         continue_check = ttk.Checkbutton(checkbox_frame, text="Tiếp số ảnh", 
                                        variable=self.continue_numbering_var)
-        continue_check.pack(side=tk.LEFT)
+        continue_check.pack(side=tk.LEFT, padx=(0, 20))
+        
+        self.crop_var = tk.BooleanVar(value=False)
+        # Lưu ngay khi đổi để lần mở app sau vẫn giữ lựa chọn (kể cả khi chưa chụp)
+        crop_check = ttk.Checkbutton(checkbox_frame, text="Chỉ lưu vùng nội dung", 
+                                    variable=self.crop_var, command=self.save_settings)
+        crop_check.pack(side=tk.LEFT, padx=(0, 20))
+        
+        self.dedup_store_var = tk.BooleanVar(value=False)
+        dedup_check = ttk.Checkbutton(checkbox_frame, text="Kho chống trùng", 
+                                     variable=self.dedup_store_var, command=self.save_settings)
+        dedup_check.pack(side=tk.LEFT)
         
         # Preset buttons with custom styling
         preset_frame = ttk.Frame(settings_frame)
@@ -440,6 +494,15 @@ class AutoscreenGUI:
             drive_tab.rowconfigure(0, weight=1)
             self.setup_drive_tab(drive_tab)
 
+        # Performance dashboard tab
+        perf_tab = ttk.Frame(main_notebook)
+        main_notebook.add(perf_tab, text="📈 Hiệu năng")
+        perf_tab.columnconfigure(0, weight=1)
+        perf_tab.rowconfigure(0, weight=1)
+        self.perf_dashboard = PerfDashboard(perf_tab, self.root, self.perf_monitor, self.drive_uploader,
+                                            is_visible=lambda: main_notebook.select() == str(perf_tab))
+        self.perf_dashboard.start()
+
         # Image Management tab
         image_mgmt_tab = ttk.Frame(main_notebook)
         main_notebook.add(image_mgmt_tab, text="📁 Files")
@@ -471,6 +534,11 @@ class AutoscreenGUI:
                  relief='raised', bd=1, padx=8, pady=4,
                  activebackground='#5a6268', activeforeground='white').pack(side=tk.LEFT, padx=2)
 
+        tk.Button(list_controls, text="🗜️ Nén thư mục", command=self.transcode_current_folder,
+                 bg='#17a2b8', fg='white', font=('Segoe UI', 8, 'bold'),
+                 relief='raised', bd=1, padx=8, pady=4,
+                 activebackground='#138496', activeforeground='white').pack(side=tk.LEFT, padx=2)
+
         # File listbox with scrollbar
         list_frame = ttk.Frame(file_list_frame)
         list_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -534,6 +602,14 @@ class AutoscreenGUI:
         self.drive_queue_var = tk.StringVar(value="0 file")
         ttk.Label(status_frame, textvariable=self.drive_queue_var).grid(row=2, column=1, sticky=tk.W, padx=5)
         
+        ttk.Label(status_frame, text="Tốc độ:").grid(row=3, column=0, sticky=tk.W, padx=2)
+        self.drive_speed_var = tk.StringVar(value="-")
+        ttk.Label(status_frame, textvariable=self.drive_speed_var).grid(row=3, column=1, sticky=tk.W, padx=5)
+        
+        ttk.Label(status_frame, text="Đang upload:").grid(row=4, column=0, sticky=tk.W, padx=2)
+        self.drive_current_var = tk.StringVar(value="-")
+        ttk.Label(status_frame, textvariable=self.drive_current_var).grid(row=4, column=1, sticky=tk.W, padx=5)
+        
         # Configuration frame
         config_frame = ttk.LabelFrame(main_frame, text="⚙️ Cấu hình Upload", style="Card.TLabelframe", padding="10")
         config_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -586,9 +662,15 @@ class AutoscreenGUI:
                        variable=self.drive_use_root_folder_id_var,
                        command=self.on_drive_config_change).grid(row=0, column=1, sticky=tk.W)
         
+        # Số luồng upload song song
+        ttk.Label(config_frame, text="Số luồng upload:").grid(row=6, column=0, sticky=tk.W, padx=2)
+        self.drive_workers_var = tk.IntVar(value=4)
+        ttk.Spinbox(config_frame, from_=1, to=16, textvariable=self.drive_workers_var, width=5,
+                    command=self.on_drive_config_change).grid(row=6, column=1, sticky=tk.W, padx=5, pady=2)
+        
         # Action buttons frame
         action_frame = ttk.Frame(config_frame)
-        action_frame.grid(row=6, column=0, columnspan=2, pady=10)
+        action_frame.grid(row=7, column=0, columnspan=2, pady=10)
         
         # Authentication button
         self.drive_auth_btn = tk.Button(action_frame, text="🔐 Xác thực Google Drive", 
@@ -652,6 +734,61 @@ class AutoscreenGUI:
                                         state="disabled")
         self.drive_reset_btn.pack(side=tk.LEFT, padx=5)
         
+        # Retry failed uploads button
+        self.drive_retry_btn = tk.Button(action_frame, text="♻️ Thử lại", 
+                                        command=self.retry_failed_uploads,
+                                        bg='#20c997', fg='white', font=('Segoe UI', 9, 'bold'),
+                                        relief='raised', bd=2, padx=12, pady=6,
+                                        activebackground='#1aa179', activeforeground='white',
+                                        state="disabled")
+        self.drive_retry_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Verify uploaded files button
+        self.drive_verify_btn = tk.Button(action_frame, text="🔍 Kiểm tra", 
+                                         command=self.verify_drive_uploads,
+                                         bg='#6610f2', fg='white', font=('Segoe UI', 9, 'bold'),
+                                         relief='raised', bd=2, padx=12, pady=6,
+                                         activebackground='#520dc2', activeforeground='white',
+                                         state="disabled")
+        self.drive_verify_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Retention frame: dọn ảnh đã upload khi đầy ổ đĩa
+        retention_frame = ttk.LabelFrame(main_frame, text="🧹 Dọn dẹp ổ đĩa", style="Card.TLabelframe", padding="10")
+        retention_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        retention_frame.columnconfigure(1, weight=1)
+        
+        self.retention_enabled_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(retention_frame, text="Tự động xóa ảnh local đã xác nhận trên Drive",
+                       variable=self.retention_enabled_var,
+                       command=self.on_retention_config_change).grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        ttk.Label(retention_frame, text="Quota (GB):").grid(row=1, column=0, sticky=tk.W, padx=2)
+        self.retention_quota_var = tk.StringVar(value="20")
+        quota_entry = ttk.Entry(retention_frame, textvariable=self.retention_quota_var, width=8)
+        quota_entry.grid(row=1, column=1, sticky=tk.W, padx=5, pady=2)
+        quota_entry.bind('<FocusOut>', self.on_retention_config_change)
+        
+        ttk.Label(retention_frame, text="Giữ tối đa (ngày):").grid(row=2, column=0, sticky=tk.W, padx=2)
+        self.retention_days_var = tk.StringVar(value="0")
+        days_entry = ttk.Entry(retention_frame, textvariable=self.retention_days_var, width=8)
+        days_entry.grid(row=2, column=1, sticky=tk.W, padx=5, pady=2)
+        days_entry.bind('<FocusOut>', self.on_retention_config_change)
+        
+        self.retention_thumbnail_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(retention_frame, text="Giữ thumbnail của ảnh đã xóa",
+                       variable=self.retention_thumbnail_var,
+                       command=self.on_retention_config_change).grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        self.retention_status_var = tk.StringVar(value="Chưa bật")
+        ttk.Label(retention_frame, textvariable=self.retention_status_var).grid(row=4, column=0, columnspan=2, sticky=tk.W, padx=2)
+        
+        self.retention_run_btn = tk.Button(retention_frame, text="🧹 Dọn ngay",
+                                          command=self.run_retention_now,
+                                          bg='#6f42c1', fg='white', font=('Segoe UI', 9, 'bold'),
+                                          relief='raised', bd=2, padx=12, pady=6,
+                                          activebackground='#5a32a3', activeforeground='white')
+        self.retention_run_btn.grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
         # Load initial config
         self.load_drive_config()
         self.update_drive_status()
@@ -668,6 +805,58 @@ class AutoscreenGUI:
         self.drive_use_custom_mapping_var.set(self.drive_uploader.use_custom_mapping)
         self.drive_use_root_folder_id_var.set(self.drive_uploader.use_root_folder_id)
         self.drive_root_folder_var.set(self.drive_uploader.root_folder_name)
+        self.drive_workers_var.set(self.drive_uploader.upload_workers)
+        
+        if self.retention_manager:
+            self.retention_enabled_var.set(self.retention_manager.enabled)
+            self.retention_quota_var.set(str(self.retention_manager.quota_gb))
+            self.retention_days_var.set(str(self.retention_manager.max_age_days))
+            self.retention_thumbnail_var.set(self.retention_manager.keep_thumbnail)
+            self.apply_retention_settings()
+    
+    def on_retention_config_change(self, event=None):
+        """Xử lý khi thay đổi cấu hình dọn dẹp"""
+        if not self.retention_manager:
+            return
+        
+        try:
+            self.retention_manager.quota_gb = max(0.0, float(self.retention_quota_var.get()))
+            self.retention_manager.max_age_days = max(0, int(self.retention_days_var.get()))
+        except ValueError:
+            messagebox.showerror("Lỗi", "Quota và số ngày phải là số!")
+            return
+        self.retention_manager.enabled = self.retention_enabled_var.get()
+        self.retention_manager.keep_thumbnail = self.retention_thumbnail_var.get()
+        self.retention_manager.save_config()
+        self.apply_retention_settings()
+    
+    def apply_retention_settings(self):
+        """Bật/tắt luồng dọn dẹp nền theo cấu hình"""
+        manager = self.retention_manager
+        manager.base_dir = os.path.abspath(self.output_var.get())
+        if manager.enabled:
+            manager.start()
+            self.retention_status_var.set(f"Đang bật (quota {manager.quota_gb} GB, "
+                                          f"tối đa {manager.max_age_days or '∞'} ngày)")
+        else:
+            manager.stop()
+            self.retention_status_var.set("Chưa bật")
+    
+    def run_retention_now(self):
+        """Chạy một lượt dọn dẹp ngay (trong luồng nền)"""
+        if not self.retention_manager:
+            messagebox.showerror("Lỗi", "Cần cài đặt Google Drive API để xác nhận ảnh đã upload!")
+            return
+        
+        def retention_worker():
+            evicted, freed = self.retention_manager.run_once()
+            if not evicted:
+                self.log_message("🧹 Không có ảnh nào cần dọn")
+            self.root.after(0, self.refresh_file_list)
+            self.root.after(0, self.refresh_stats)
+        
+        self.retention_manager.base_dir = os.path.abspath(self.output_var.get())
+        threading.Thread(target=retention_worker, daemon=True).start()
     
     def on_drive_config_change(self, event=None):
         """Xử lý khi thay đổi cấu hình Google Drive"""
@@ -681,7 +870,8 @@ class AutoscreenGUI:
             create_branch_folders=self.drive_branch_folders_var.get(),
             use_custom_mapping=self.drive_use_custom_mapping_var.get(),
             use_root_folder_id=self.drive_use_root_folder_id_var.get(),
-            root_folder_name=self.drive_root_folder_var.get()
+            root_folder_name=self.drive_root_folder_var.get(),
+            upload_workers=self.drive_workers_var.get()
         )
         self.drive_uploader.save_config()
     
@@ -700,6 +890,7 @@ class AutoscreenGUI:
                         self.update_drive_status(),
                         messagebox.showinfo("Thành công", "Đã xác thực Google Drive thành công!")
                     ])
+                    self.drive_uploader.resume_pending_uploads()
                 else:
                     self.root.after(0, lambda: messagebox.showerror("Lỗi", "Xác thực Google Drive thất bại!"))
             except Exception as e:
@@ -729,11 +920,39 @@ class AutoscreenGUI:
         
         # Pattern để lọc file
         channel_short = channel_name.replace("Food", "")
-        import re
-        pattern = re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.png$", re.IGNORECASE)
+        pattern = image_file_pattern(branch_code, channel_short)
+        
+        # So sánh với folder trên Drive trước (dry-run, dùng branch_code thay vì branch_name) trong luồng nền:
+        # tìm folder, cập nhật index và hash file có thể mất nhiều giây
+        def plan_worker():
+            try:
+                plan = self.drive_uploader.plan_folder_sync(output_dir, channel_name, branch_code, pattern)
+            except Exception as e:
+                self.root.after(0, lambda error=e: [
+                    self.drive_upload_folder_btn.config(state="normal"),
+                    messagebox.showerror("Lỗi", f"Không thể so sánh với Google Drive: {error}")
+                ])
+                return
+            self.root.after(0, lambda: self._confirm_folder_sync(plan, output_dir, channel_name, branch_code, pattern))
+        
+        self.drive_upload_folder_btn.config(state="disabled")
+        self.log_message(f"🔍 Đang so sánh {output_dir} với Google Drive...")
+        threading.Thread(target=plan_worker, daemon=True).start()
+    
+    def _confirm_folder_sync(self, plan, output_dir, channel_name, branch_code, pattern):
+        """Hỏi người dùng rồi đưa các file mới/đã đổi vào hàng đợi (chạy trên luồng GUI sau khi so sánh xong)"""
+        self.drive_upload_folder_btn.config(state="normal")
+        if plan is None:
+            return
+        self.log_message(plan.summary())
+        
+        if not plan.to_upload:
+            messagebox.showinfo("Thông báo", "Tất cả file đã có trên Google Drive!")
+            return
+        if not messagebox.askyesno("Đồng bộ Google Drive", f"{plan.summary()}\n\nBắt đầu upload?"):
+            return
         
-        # Upload folder với branch_code thay vì branch_name
-        files_added = self.drive_uploader.upload_folder_contents(output_dir, channel_name, branch_code, pattern)
+        files_added = self.drive_uploader.upload_folder_contents(output_dir, channel_name, branch_code, pattern, plan=plan)
         
         if files_added > 0:
             self.drive_uploader.start_upload_worker()
@@ -761,6 +980,12 @@ class AutoscreenGUI:
         
         self.root.after(0, self.update_drive_status)
     
+    def on_drive_upload_chunk(self, file_path, uploaded, total):
+        """Callback sau mỗi chunk upload (gọi từ luồng upload)"""
+        percent = uploaded / total * 100 if total else 100
+        text = f"{os.path.basename(file_path)} {percent:.0f}% ({uploaded / (1024 * 1024):.1f}/{total / (1024 * 1024):.1f} MB)"
+        self.root.after(0, lambda: self.drive_current_var.set(text))
+    
     def on_drive_upload_complete(self, stats):
         """Callback khi hoàn thành upload"""
         # Reset current session sau khi upload xong
@@ -778,6 +1003,56 @@ class AutoscreenGUI:
                               f"Tổng cộng: {stats['total_uploaded']} file")
         ])
     
+    def retry_failed_uploads(self):
+        """Upload lại các file đã thất bại sau nhiều lần thử"""
+        if not self.drive_uploader:
+            return
+        
+        count = self.drive_uploader.retry_failed_uploads()
+        if count:
+            self.drive_stop_btn.config(state="normal")
+            self.drive_upload_folder_btn.config(state="disabled")
+        else:
+            self.log_message("📤 Không có file upload lỗi cần thử lại")
+        self.update_drive_status()
+    
+    def verify_drive_uploads(self, reupload_missing=False):
+        """
+        Kiểm tra các file đã upload với md5Checksum trên Drive (trong luồng nền), upload lại file hỏng/đã sửa.
+        File mất trên Drive chỉ được upload lại khi người dùng đồng ý
+        """
+        if not self.drive_uploader or not self.drive_uploader.service:
+            messagebox.showerror("Lỗi", "Vui lòng xác thực Google Drive trước!")
+            return
+        
+        def verify_worker():
+            try:
+                report = self.drive_uploader.verify_uploads(os.path.abspath(self.output_var.get()),
+                                                            reupload_missing=reupload_missing)
+            except Exception as e:
+                self.log_message(f"❌ Lỗi kiểm tra file đã upload: {e}")
+                return
+            finally:
+                self.root.after(0, lambda: self.drive_verify_btn.config(state="normal"))
+            if report.requeued:
+                self.root.after(0, lambda: [
+                    self.drive_stop_btn.config(state="normal"),
+                    self.drive_upload_folder_btn.config(state="disabled")
+                ])
+            if report.missing:
+                self.root.after(0, lambda: self._confirm_reupload_missing(len(report.missing)))
+            self.root.after(0, self.update_drive_status)
+        
+        self.drive_verify_btn.config(state="disabled")
+        threading.Thread(target=verify_worker, daemon=True).start()
+    
+    def _confirm_reupload_missing(self, count):
+        """Hỏi có upload lại các file đã mất trên Drive không (có thể đã bị xóa cố ý)"""
+        if messagebox.askyesno("File mất trên Drive",
+                               f"{count} file đã upload không còn trên Drive (đã bị xóa hoặc vào thùng rác).\n"
+                               f"Upload lại các file này?"):
+            self.verify_drive_uploads(reupload_missing=True)
+    
     def setup_custom_mapping(self):
         """Mở dialog để cấu hình custom folder mapping"""
         if not self.drive_uploader or not self.drive_uploader.service:
@@ -807,6 +1082,8 @@ class AutoscreenGUI:
             self.drive_debug_btn.config(state="normal")
             self.drive_scan_btn.config(state="normal")
             self.drive_reset_btn.config(state="normal")
+            self.drive_retry_btn.config(state="normal")
+            self.drive_verify_btn.config(state="normal")
         else:
             self.drive_status_var.set("❌ Chưa xác thực")
             self.drive_upload_folder_btn.config(state="disabled")
@@ -814,12 +1091,34 @@ class AutoscreenGUI:
             self.drive_debug_btn.config(state="disabled")
             self.drive_scan_btn.config(state="disabled")
             self.drive_reset_btn.config(state="disabled")
+            self.drive_retry_btn.config(state="disabled")
+            self.drive_verify_btn.config(state="disabled")
         
         status = self.drive_uploader.get_upload_status()
         stats = status['stats']
         
         self.drive_uploaded_var.set(f"{stats['total_uploaded']} file")
-        self.drive_queue_var.set(f"{status['queue_size']} file")
+        queue_text = f"{status['queue_size']} file"
+        lanes = status['lanes']
+        if lanes[LANE_BACKFILL]['pending'] + lanes[LANE_BACKFILL]['in_flight']:
+            # Đang upload bù thư mục: hiện riêng hàng đợi ảnh vừa chụp và upload bù
+            queue_text += " (" + ", ".join(
+                f"{label}: {lanes[lane]['pending'] + lanes[lane]['in_flight']}, chờ {lanes[lane]['oldest_wait']:.0f}s"
+                for lane, label in ((LANE_LIVE, "vừa chụp"), (LANE_BACKFILL, "upload bù"))) + ")"
+        if status['failed_count']:
+            queue_text += f" ({status['failed_count']} file lỗi, bấm ♻️ để thử lại)"
+        self.drive_queue_var.set(queue_text)
+        if status['is_uploading']:
+            scheduler = status['scheduler']
+            speed_text = (f"{status['files_per_second']:.2f} file/s, {status['mb_per_second']:.2f} MB/s "
+                          f"({scheduler['in_flight']}/{int(scheduler['limit'])} luồng)")
+            if scheduler['backoff_remaining'] > 0:
+                speed_text += f" | ⏳ Drive giới hạn tốc độ, chờ {scheduler['backoff_remaining']:.0f}s"
+            if len(status['backends']) > 1:
+                # Gửi tới nhiều nơi lưu: số file đã lưu của từng nơi
+                speed_text += " | " + ", ".join(f"{name}: {backend['stored'] + backend['skipped']}"
+                                                for name, backend in status['backends'].items())
+            self.drive_speed_var.set(speed_text)
         
         if status['is_uploading']:
             self.drive_stop_btn.config(state="normal")
@@ -1056,8 +1355,28 @@ class AutoscreenGUI:
                     self.tune_var.set(settings.get('tune', False))
                     self.continue_numbering_var.set(settings.get('continue_numbering', True))
                     self.output_var.set(settings.get('output_dir', 'shots'))
+                    self.crop_var.set(settings.get('crop', False))
+                    self.dedup_store_var.set(settings.get('dedup_store', False))
+                    self.transcode_mode_var.set(settings.get('transcode_mode', 'none'))
+                    self.transcode_quality_var.set(settings.get('transcode_quality', 80))
+                    self.metrics_port = settings.get('metrics_port', 0)
+                    self.metrics_host = settings.get('metrics_host', "127.0.0.1")
         except Exception as e:
             self.log_message(f"Không thể tải settings: {e}")
+        # Thư mục lưu ảnh có thể vừa đổi theo settings: nạp lại kênh/chi nhánh và danh sách file
+        self.refresh_data()
+    
+    def start_metrics_exporter(self):
+        """Mở endpoint /metrics nếu metrics_port được cấu hình (máy giám sát scrape qua mạng LAN)"""
+        if not self.metrics_port:
+            return
+        self.metrics_exporter = MetricsExporter(self.perf_monitor, self.drive_uploader,
+                                                host=self.metrics_host, port=int(self.metrics_port),
+                                                disk_path=os.path.abspath(self.output_var.get()),
+                                                retention_manager=self.retention_manager,
+                                                log_callback=self.log_message)
+        if not self.metrics_exporter.start():
+            self.metrics_exporter = None
     
     def save_settings(self):
         """Save current GUI settings to file"""
@@ -1071,7 +1390,13 @@ class AutoscreenGUI:
                 'overswipe': self.overswipe_var.get(),
                 'tune': self.tune_var.get(),
                 'continue_numbering': self.continue_numbering_var.get(),
-                'output_dir': self.output_var.get()
+                'output_dir': self.output_var.get(),
+                'crop': self.crop_var.get(),
+                'dedup_store': self.dedup_store_var.get(),
+                'transcode_mode': self.transcode_mode_var.get(),
+                'transcode_quality': self.transcode_quality_var.get(),
+                'metrics_port': self.metrics_port,
+                'metrics_host': self.metrics_host
             }
             with open(self.settings_file, 'w', encoding='utf-8') as f:
                 json.dump(settings, f, indent=2)
@@ -1151,6 +1476,9 @@ class AutoscreenGUI:
     def update_preview(self, image_path):
         """Update image preview with smooth transition"""
         try:
+            # Ảnh có thể vừa được nén sang định dạng khác
+            if not os.path.exists(image_path):
+                image_path = smallest_variant(image_path)
             self.last_image_path = image_path
             # Load and resize image
             image = Image.open(image_path)
@@ -1257,15 +1585,15 @@ class AutoscreenGUI:
 
         # Lấy danh sách file
         channel_short = channel_name.replace("Food", "")
-        pattern = re.compile(rf"(\d+)_{re.escape(branch_code)}_{re.escape(channel_short)}\.png$", re.IGNORECASE)
+        pattern = image_file_pattern(branch_code, channel_short)
 
         files_info = []
         try:
-            for filename in os.listdir(output_dir):
+            for filename, evicted in list_image_filenames(output_dir):
                 match = pattern.match(filename)
                 if match:
                     num = int(match.group(1))
-                    files_info.append((num, filename))
+                    files_info.append((num, filename, evicted))
         except Exception:
             pass
 
@@ -1273,11 +1601,15 @@ class AutoscreenGUI:
         files_info.sort(key=lambda x: x[0])
 
         self.file_listbox.delete(0, tk.END)
-        for num, filename in files_info:
-            file_path = os.path.join(output_dir, filename)
-            file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
-            size_kb = file_size / 1024
-            display_text = f"{num:02d}: {filename} ({size_kb:.1f}KB)"
+        for num, filename, evicted in files_info:
+            if evicted:
+                # Ảnh đã được dọn khỏi ổ đĩa sau khi upload
+                display_text = f"{num:02d}: {filename} (☁️ chỉ còn trên Drive)"
+            else:
+                file_path = os.path.join(output_dir, filename)
+                file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+                size_kb = file_size / 1024
+                display_text = f"{num:02d}: {filename} ({size_kb:.1f}KB)"
             self.file_listbox.insert(tk.END, display_text)
 
         # Cập nhật tổng số file
@@ -1303,7 +1635,7 @@ class AutoscreenGUI:
         channel_name = self.manager.get_channel_name(channel_key)
         branch_name = self.manager.get_branch_name(channel_key, branch_code)
         output_dir = os.path.join(self.output_var.get(), channel_name, branch_name)
-        file_path = os.path.join(output_dir, filename)
+        file_path = self.resolve_image_path(output_dir, filename)
 
         if not os.path.exists(file_path):
             messagebox.showerror("Lỗi", "File không tồn tại!")
@@ -1345,11 +1677,19 @@ class AutoscreenGUI:
             channel_name = self.manager.get_channel_name(channel_key)
             branch_name = self.manager.get_branch_name(channel_key, branch_code)
             output_dir = os.path.join(self.output_var.get(), channel_name, branch_name)
-            file_path = os.path.join(output_dir, filename)
+            file_path = self.resolve_image_path(output_dir, filename)
 
             if os.path.exists(file_path):
                 self.update_preview(file_path)
 
+    def resolve_image_path(self, output_dir, filename):
+        """Đường dẫn ảnh, hoặc thumbnail trong .evicted/ nếu ảnh đã được dọn khỏi ổ đĩa"""
+        file_path = os.path.join(output_dir, filename)
+        evicted_path = os.path.join(output_dir, EVICTED_DIR, filename)
+        if not os.path.exists(file_path) and os.path.exists(evicted_path):
+            return evicted_path
+        return file_path
+
     def open_result_folder(self):
         """Open result folder in file explorer"""
         if self.last_image_path and os.path.exists(self.last_image_path):
@@ -1410,6 +1750,41 @@ class AutoscreenGUI:
         # Cập nhật thống kê
         self.update_folder_stats(channel_key, branch_code)
 
+    def transcode_current_folder(self):
+        """Nén hàng loạt ảnh trong thư mục kênh/chi nhánh hiện tại"""
+        channel_key, branch_code = self.get_selected_channel_branch()
+
+        if not channel_key or not branch_code:
+            messagebox.showerror("Lỗi", "Vui lòng chọn kênh và chi nhánh!")
+            return
+
+        mode = self.transcode_mode_var.get()
+        if mode not in TRANSCODE_MODES:
+            messagebox.showwarning("Cảnh báo", "Vui lòng chọn chế độ nén trong Cài đặt nâng cao!")
+            return
+
+        channel_name = self.manager.get_channel_name(channel_key)
+        branch_name = self.manager.get_branch_name(channel_key, branch_code)
+        output_dir = os.path.join(self.output_var.get(), channel_name, branch_name)
+
+        if not os.path.exists(output_dir):
+            messagebox.showwarning("Cảnh báo", f"Thư mục {output_dir} không tồn tại!")
+            return
+
+        channel_short = channel_name.replace("Food", "")
+        pattern = image_file_pattern(branch_code, channel_short)
+
+        def transcode_worker():
+            transcoder = ImageTranscoder(mode=mode, quality=self.transcode_quality_var.get(),
+                                         log_callback=self.log_message)
+            try:
+                transcoder.transcode_folder(output_dir, file_pattern=pattern)
+            finally:
+                transcoder.shutdown()
+            self.root.after(0, self.refresh_stats)
+
+        threading.Thread(target=transcode_worker, daemon=True).start()
+
     def update_folder_stats(self, channel_key, branch_code):
         """Cập nhật thống kê thư mục ảnh"""
         channel_name = self.manager.get_channel_name(channel_key)
@@ -1558,6 +1933,11 @@ class AutoscreenGUI:
     
     def capture_worker(self, channel_key, branch_code):
         """Worker thread cho việc chụp ảnh"""
+        if self.drive_uploader:
+            # Upload vẫn chạy nhưng bị giới hạn băng thông để không làm chậm nhịp chụp
+            self.drive_uploader.set_capture_active(True)
+        self.perf_monitor.set_gauge(GAUGE_CAPTURE_RUNNING, 1)
+        self.perf_monitor.set_gauge(GAUGE_SESSION_SHOTS, 0)
         try:
             # Get device
             serial = ensure_device(None)
@@ -1575,6 +1955,8 @@ class AutoscreenGUI:
             branch_name = self.manager.get_branch_name(channel_key, branch_code)
             output_dir = os.path.join(self.output_var.get(), channel_name, branch_name)
             os.makedirs(output_dir, exist_ok=True)
+            if self.metrics_exporter:
+                self.metrics_exporter.disk_path = os.path.abspath(self.output_var.get())
             
             self.log_message(f"Kênh: {channel_name} | Chi nhánh: {branch_name}")
             self.log_message(f"Lưu ảnh vào: {output_dir}")
@@ -1602,6 +1984,37 @@ class AutoscreenGUI:
             
             self.log_message(f"Tọa độ vuốt: ({x},{y_start}) -> ({x},{y_end})")
             
+            # Vùng nội dung cần lưu (bỏ status bar, header, thanh điều hướng)
+            region = None
+            if self.crop_var.get():
+                region = resolve_crop_region(h, self.manager.get_crop_region(channel_key),
+                                             self.padding_top_var.get(), self.padding_bottom_var.get())
+                if region:
+                    self.log_message(f"✂️ Chỉ lưu vùng nội dung: y={region[0]}..{region[1]}")
+            
+            # Kho ảnh theo nội dung (dùng chung cho mọi kênh/chi nhánh)
+            store = BlobStore(self.output_var.get(), log_callback=self.log_message) if self.dedup_store_var.get() else None
+            if store and not store.hardlinks:
+                store.close()  # Ổ không hỗ trợ hardlink: chụp bình thường, không dùng kho
+                store = None
+            
+            # Nén ảnh nền sau khi chụp nếu được bật
+            transcoder = None
+            if self.transcode_mode_var.get() in TRANSCODE_MODES:
+                transcoder = ImageTranscoder(mode=self.transcode_mode_var.get(),
+                                             quality=self.transcode_quality_var.get(),
+                                             log_callback=self.log_message)
+                self.log_message(f"🗜️ Nén ảnh nền: {transcoder.mode} ({transcoder.max_workers} process)")
+            
+            # Chi nhánh đóng gói cả phiên: gom ảnh lại, upload một archive khi phiên kết thúc
+            archive_frames = None
+            if (self.drive_uploader and
+                self.drive_uploader.auto_upload and
+                self.drive_uploader.service and
+                self.drive_uploader.is_archive_branch(branch_code)):
+                archive_frames = []
+                self.log_message(f"📦 Upload cả phiên thành file {self.drive_uploader.archive_format}")
+            
             # Xác định số bắt đầu cho ảnh
             if self.continue_numbering_var.get():
                 start_num = get_next_image_number(output_dir, branch_code, channel_short)
@@ -1627,18 +2040,34 @@ class AutoscreenGUI:
                 filename = f"{i:02d}_{branch_code}_{channel_short}.png"
                 path = os.path.join(output_dir, filename)
                 
-                screencap_to_file(path, serial=serial)
-                digest = sha256(path)
+                if region:
+                    # Hash tính ngay trên buffer lúc cắt nên nằm trong thời gian chụp
+                    with self.perf_monitor.timed(METRIC_SCREENCAP):
+                        digest = screencap_region_to_file(path, region, serial=serial)
+                else:
+                    with self.perf_monitor.timed(METRIC_SCREENCAP):
+                        screencap_to_file(path, serial=serial)
+                    with self.perf_monitor.timed(METRIC_HASH):
+                        digest = sha256(path)
                 
                 if digest == last_hash:
                     stuck += 1
+                    self.perf_monitor.count(METRIC_DUPLICATES)
                     self.log_message(f"Ảnh {i:02d}: trùng với khung trước ({stuck}/{overswipe_limit})")
+                    if transcoder:
+                        # Khung trùng vẫn được lưu nên cũng nén luôn
+                        transcoder.submit(path, callback=lambda result: self.on_frame_transcoded(result, store=store))
+                    elif store:
+                        store.ingest(path)
                     if stuck >= overswipe_limit:
+                        self.perf_monitor.count(METRIC_STUCK_STOPS)
                         self.log_message(f"Hết nội dung (trùng {stuck} lần). Dừng tại {i}.")
                         break
                 else:
                     stuck = 0
                     taken += 1
+                    self.perf_monitor.count(METRIC_SHOTS)
+                    self.perf_monitor.set_gauge(GAUGE_SESSION_SHOTS, taken)
                     self.log_message(f"Đã chụp: {filename}")
                     
                     # Update preview and stats
@@ -1647,20 +2076,27 @@ class AutoscreenGUI:
                     self.root.after(0, self.refresh_file_list)
                     
                     # Auto upload to Google Drive if enabled
-                    if (self.drive_uploader and 
+                    if archive_frames is not None:
+                        archive_frames.append(path)
+                        if transcoder:
+                            transcoder.submit(path, callback=lambda result: self.on_frame_transcoded(result, store=store))
+                        elif store:
+                            store.ingest(path)
+                    elif (self.drive_uploader and 
                         self.drive_uploader.auto_upload and 
-                        self.drive_uploader.service):
-                        # Sử dụng branch_code thay vì branch_name cho custom mapping
-                        self.drive_uploader.add_to_upload_queue(
-                            path, channel_name, branch_code, filename
-                        )
-                        # Start upload worker if not already running
-                        if not self.drive_uploader.is_uploading:
-                            self.drive_uploader.start_upload_worker()
-                            self.root.after(0, lambda: [
-                                self.drive_stop_btn.config(state="normal"),
-                                self.drive_upload_folder_btn.config(state="disabled")
-                            ])
+                        self.drive_uploader.can_upload()):
+                        if transcoder:
+                            # Đợi nén xong rồi mới đưa bản nhỏ hơn vào hàng đợi upload
+                            transcoder.submit(path, callback=lambda result, n=filename:
+                                              self.on_frame_transcoded(result, channel_name, branch_code, n, store))
+                        else:
+                            if store:
+                                store.ingest(path)
+                            self.queue_drive_upload(path, channel_name, branch_code, filename)
+                    elif transcoder:
+                        transcoder.submit(path, callback=lambda result: self.on_frame_transcoded(result, store=store))
+                    elif store:
+                        store.ingest(path)
                     
                     # Calculate speed
                     if self.start_time:
@@ -1670,8 +2106,10 @@ class AutoscreenGUI:
                             self.root.after(0, lambda s=speed: self.speed_var.set(f"{s:.1f} ảnh/phút"))
                 
                 # Swipe
-                swipe(x, y_start, x, y_end, swipe_ms, serial=serial)
-                time.sleep(delay)
+                with self.perf_monitor.timed(METRIC_SWIPE):
+                    swipe(x, y_start, x, y_end, swipe_ms, serial=serial)
+                with self.perf_monitor.timed(METRIC_SETTLE):
+                    time.sleep(delay)
                 last_hash = digest
                 
         except Exception as e:
@@ -1682,13 +2120,28 @@ class AutoscreenGUI:
             self.is_running = False
             final_taken = taken if 'taken' in locals() else 0
             
+            # Đợi các ảnh còn lại nén xong rồi báo cáo
+            if locals().get('transcoder'):
+                transcoder.shutdown(wait=True)
+                self.log_message(f"🗜️ {transcoder.format_stats()}")
+            if locals().get('store'):
+                store.report()
+                store.close()
+            self.perf_monitor.set_gauge(GAUGE_CAPTURE_RUNNING, 0)
+            if self.drive_uploader:
+                self.drive_uploader.set_capture_active(False)
+            if locals().get('archive_frames'):
+                # Ảnh đã nén xong -> đóng gói bản nhỏ nhất của từng ảnh (upload qua hàng đợi như ảnh thường)
+                self.drive_uploader.queue_session_archive(
+                    [smallest_variant(frame) for frame in archive_frames], channel_name, branch_code)
+            
             # Show completion message with upload info
             completion_msg = f"Hoàn tất: {final_taken} ảnh"
             if (self.drive_uploader and 
                 self.drive_uploader.auto_upload and 
-                self.drive_uploader.service and
+                self.drive_uploader.can_upload() and
                 final_taken > 0):
-                queue_size = self.drive_uploader.upload_queue.qsize()
+                queue_size = self.drive_uploader.get_upload_status()['queue_size']
                 completion_msg += f" | {queue_size} file đang upload"
             
             self.root.after(0, lambda: [
@@ -1699,6 +2152,24 @@ class AutoscreenGUI:
                 self.update_drive_status() if self.drive_uploader else None
             ])
     
+    def queue_drive_upload(self, path, channel_name, branch_code, filename):
+        """Đưa ảnh vừa chụp vào hàng đợi upload (Drive và các nơi lưu khác, không chặn luồng chụp)"""
+        # Sử dụng branch_code thay vì branch_name cho custom mapping
+        # Worker upload được bật từ luồng nền của bộ đệm khi cần
+        self.drive_uploader.queue_capture_upload(path, channel_name, branch_code, filename)
+    
+    def on_frame_transcoded(self, result, channel_name=None, branch_code=None, filename=None, store=None):
+        """Callback khi một ảnh đã nén xong (chạy trong thread của process pool)"""
+        dst = result['dst']
+        if dst != result['src'] and self.last_image_path == result['src']:
+            self.last_image_path = dst
+        if store:
+            store.ingest(dst)
+        if filename:
+            # Tên trên Drive theo định dạng sau khi nén (NN_BR_X.png -> NN_BR_X.webp)
+            filename = os.path.splitext(filename)[0] + os.path.splitext(dst)[1]
+            self.queue_drive_upload(dst, channel_name, branch_code, filename)
+    
     def refresh_data(self):
         """Làm mới dữ liệu kênh và chi nhánh"""
         self.manager.load_config()
@@ -1720,11 +2191,6 @@ class AutoscreenGUI:
             self.update_drive_status()
         self.log_message("🔄 Đã làm mới dữ liệu")
     
-    def load_settings(self):
-        """Load cài đặt ban đầu - simplified version"""
-        # Just refresh data to populate combos
-        self.refresh_data()
-    
     def open_management(self):
         """Mở cửa sổ quản lý kênh và chi nhánh"""
         ManagementWindow(self.root, self.manager, self.refresh_data)
@@ -1882,19 +2348,26 @@ thay vì tạo cấu trúc folder mới. Điều này hữu ích khi bạn đã
                 if branch_code not in all_branches:
                     all_branches[branch_code] = branch_name
         
+        # Get all folder names in one batch request
+        mapping = self.drive_uploader.custom_folder_mapping
+        try:
+            folders = self.drive_uploader.get_folders_info(
+                [mapping[code] for code in all_branches if mapping.get(code)])
+        except Exception:
+            folders = {}
+        
         # Add branches to tree
         for branch_code, branch_name in all_branches.items():
-            folder_id = self.drive_uploader.custom_folder_mapping.get(branch_code, "")
+            folder_id = mapping.get(branch_code, "")
             folder_name = ""
             status = "Chưa cấu hình"
             
             if folder_id:
-                # Try to get folder name
-                try:
-                    folder_info = self.drive_uploader.service.files().get(fileId=folder_id, fields="name").execute()
+                folder_info, _ = folders.get(folder_id, (None, None))
+                if folder_info:
                     folder_name = folder_info.get('name', 'Unknown')
                     status = "✅ OK"
-                except:
+                else:
                     folder_name = "Lỗi"
                     status = "❌ Không hợp lệ"
             
@@ -1963,14 +2436,21 @@ thay vì tạo cấu trúc folder mới. Điều này hữu ích khi bạn đã
             messagebox.showwarning("Cảnh báo", "Chưa có mapping nào để test!")
             return
         
+        # Kiểm tra tất cả folder trong một batch request
+        try:
+            folders = self.drive_uploader.get_folders_info(self.drive_uploader.custom_folder_mapping.values())
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Không thể kiểm tra mapping: {e}")
+            return
+        
         results = []
         for branch_code, folder_id in self.drive_uploader.custom_folder_mapping.items():
-            try:
-                folder_info = self.drive_uploader.service.files().get(fileId=folder_id, fields="name").execute()
+            folder_info, error = folders.get(folder_id, (None, "Folder ID trống"))
+            if folder_info:
                 folder_name = folder_info.get('name', 'Unknown')
                 results.append(f"✅ {branch_code}: {folder_name} (ID: {folder_id})")
-            except Exception as e:
-                results.append(f"❌ {branch_code}: Lỗi - {str(e)}")
+            else:
+                results.append(f"❌ {branch_code}: Lỗi - {error}")
         
         result_text = "Kết quả test mapping:\n\n" + "\n".join(results)
         messagebox.showinfo("Kết quả Test", result_text)
@@ -2695,6 +3175,8 @@ Chi tiết theo kênh:"""
         self.window.destroy()
 
 def main():
+    # Cần cho process pool nén ảnh khi đóng gói bằng PyInstaller trên Windows
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = AutoscreenGUI(root)
     root.mainloop()
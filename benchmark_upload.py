@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+import urllib.request
+
+from google_drive_uploader import GoogleDriveUploader
+
+try:
+    from google.auth.credentials import AnonymousCredentials
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+
+class FakeDriveProcess:
+    """Chạy fake_drive_server.py trong process riêng để số đo bộ nhớ chỉ tính phía uploader"""
+
+    def __init__(self, port, latency=0.0, error_rate=0.0, rate_limit=0.0, throttle_status=403):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_drive_server.py")
+        self.url = f"http://127.0.0.1:{port}/"
+        self.process = subprocess.Popen(
+            [sys.executable, script, "--port", str(port), "--latency", str(latency),
+             "--error-rate", str(error_rate), "--rate-limit", str(rate_limit),
+             "--throttle-status", str(throttle_status)],
+            stdout=subprocess.DEVNULL)
+        deadline = time.time() + 10
+        while True:
+            try:
+                self.stats()
+                break
+            except OSError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError("Không khởi động được fake Drive server")
+                time.sleep(0.1)
+
+    def _control(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else b''
+        request = urllib.request.Request(self.url + path, data=data, method='POST' if payload is not None else 'GET')
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._control("__stats__")
+
+    def reset(self):
+        return self._control("__reset__", {})
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=5)
+
+def generate_files(folder, count, size_kb):
+    """Tạo file ảnh giả (nội dung ngẫu nhiên, không nén được) theo mẫu tên của app"""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(1, count + 1):
+        path = os.path.join(folder, f"{index:02d}_BR_Bench.png")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size_kb * 1024))
+        paths.append(path)
+    return paths
+
+def make_uploader(server_url, workers, chunk_mb, threshold_mb, requests_per_second=None, verbose=False):
+    """Uploader trỏ tới fake server (không cần đăng nhập)"""
+    uploader = GoogleDriveUploader()
+    uploader.api_root_url = server_url
+    uploader._credentials = AnonymousCredentials()
+    uploader.service = uploader._build_service(uploader._credentials)
+    if not verbose:
+        uploader.log_callback = lambda message: None
+    uploader.root_folder_name = "AutoScreen Benchmark"
+    uploader.upload_workers = workers
+    uploader.chunk_size_mb = chunk_mb
+    uploader.multipart_threshold_mb = threshold_mb
+    if requests_per_second:
+        uploader.scheduler.requests_per_second = requests_per_second
+    # Lỗi giả lập: thử lại nhanh để không làm sai số đo thời gian
+    uploader.upload_queue.base_delay = 0.1
+    uploader.scheduler.base_backoff = 0.1
+    return uploader
+
+def close_uploader(uploader):
+    uploader.stop_upload_worker()
+    uploader.upload_queue.close()
+    uploader.ledger.close()
+    uploader.drive_index.close()
+    uploader.archive_index.close()
+    uploader.handoff.close()
+    uploader.credential_manager.close()
+    if uploader._delta_sync is not None:
+        uploader._delta_sync.close()
+
+def run_pass(uploader, server, files):
+    """Upload một lượt. Trả về (giây, số lời gọi API, số HTTP request, số lần bị giới hạn, số lỗi giả lập)"""
+    before = server.stats()
+    started = time.perf_counter()
+    for path in files:
+        uploader.add_to_upload_queue(path, "Bench", "BR")
+    uploader.start_upload_worker()
+    for thread in list(uploader.upload_threads):
+        thread.join()
+    elapsed = time.perf_counter() - started
+    after = server.stats()
+    return (elapsed,
+            after['api_calls'] - before['api_calls'],
+            after['http_requests'] - before['http_requests'] - 1,  # Bỏ lần đọc thống kê sau
+            after['throttled'] - before['throttled'],
+            after['injected_errors'] - before['injected_errors'])
+
+def run_case(server, files, workers, chunk_mb, threshold_mb, mode, requests_per_second=None, verbose=False):
+    """
+    Đo một cấu hình. mode:
+    - cold: sổ upload, cache folder, index trống (lần upload đầu tiên)
+    - warm: upload lại đúng các file đó với cache từ lượt trước (đường kiểm tra trùng)
+    """
+    work_dir = tempfile.mkdtemp(prefix="autoscreen_bench_")
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)  # Các file db/cache của uploader nằm trong thư mục tạm
+    server.reset()
+    try:
+        if mode == 'warm':
+            uploader = make_uploader(server.url, workers, chunk_mb, threshold_mb, requests_per_second, verbose)
+            run_pass(uploader, server, files)
+            close_uploader(uploader)
+
+        tracemalloc.start()
+        uploader = make_uploader(server.url, workers, chunk_mb, threshold_mb, requests_per_second, verbose)
+        elapsed, api_calls, http_requests, throttled, errors = run_pass(uploader, server, files)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        failed = len(uploader.upload_queue.failed_items())
+        close_uploader(uploader)
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_mb = sum(os.path.getsize(path) for path in files) / (1024 * 1024)
+    return {
+        'workers': workers,
+        'chunk_mb': chunk_mb,
+        'mode': mode,
+        'files': len(files),
+        'failed': failed,
+        'seconds': elapsed,
+        'files_per_second': len(files) / elapsed if elapsed else 0,
+        'mb_per_second': total_mb / elapsed if elapsed else 0,
+        'api_calls_per_file': api_calls / len(files),
+        'http_requests_per_file': http_requests / len(files),
+        'throttled': throttled,
+        'injected_errors': errors,
+        'peak_memory_mb': peak / (1024 * 1024),
+    }
+
+def print_results(results):
+    header = (f"{'workers':>7} {'chunk':>6} {'mode':>5} {'files':>6} {'fail':>5} {'giây':>7} "
+              f"{'file/s':>7} {'MB/s':>7} {'API/file':>9} {'HTTP/file':>10} {'429/403':>8} {'5xx':>5} {'RAM MB':>7}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['workers']:>7} {r['chunk_mb']:>6g} {r['mode']:>5} {r['files']:>6} {r['failed']:>5} "
+              f"{r['seconds']:>7.2f} {r['files_per_second']:>7.1f} {r['mb_per_second']:>7.2f} "
+              f"{r['api_calls_per_file']:>9.2f} {r['http_requests_per_file']:>10.2f} {r['throttled']:>8} {r['injected_errors']:>5} "
+              f"{r['peak_memory_mb']:>7.1f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark GoogleDriveUploader với fake Drive server (không tốn quota thật)")
+    ap.add_argument("--files", type=int, default=100, help="Số file mỗi lượt")
+    ap.add_argument("--size-kb", type=int, default=300, help="Kích thước mỗi file (KB)")
+    ap.add_argument("--workers", default="1,4,8", help="Danh sách số worker, ví dụ 1,4,8")
+    ap.add_argument("--chunk-mb", default="8", help="Danh sách kích thước chunk resumable (MB), ví dụ 1,8")
+    ap.add_argument("--threshold-mb", type=float, default=5, help="File lớn hơn ngưỡng này dùng resumable upload")
+    ap.add_argument("--modes", default="cold,warm", help="cold: cache trống, warm: upload lại với cache")
+    ap.add_argument("--latency", type=float, default=0.02, help="Độ trễ giả lập mỗi request (giây)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ lỗi 503 giả lập (0..1)")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="Quota giả lập: request/giây (0 = không giới hạn)")
+    ap.add_argument("--throttle-status", type=int, choices=(403, 429), default=403)
+    ap.add_argument("--requests-per-second", type=float, default=None,
+                    help="Giới hạn request/giây phía uploader (mặc định theo cấu hình app)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--json", help="Ghi kết quả ra file JSON")
+    ap.add_argument("--verbose", action="store_true", help="In log của uploader")
+    args = ap.parse_args()
+
+    if not GOOGLE_AUTH_AVAILABLE:
+        print("Cần cài google-auth và google-api-python-client để chạy benchmark")
+        return
+
+    data_dir = tempfile.mkdtemp(prefix="autoscreen_bench_data_")
+    server = FakeDriveProcess(args.port, args.latency, args.error_rate, args.rate_limit, args.throttle_status)
+    results = []
+    try:
+        files = generate_files(data_dir, args.files, args.size_kb)
+        for workers in [int(value) for value in args.workers.split(',')]:
+            for chunk_mb in [float(value) for value in args.chunk_mb.split(',')]:
+                for mode in args.modes.split(','):
+                    result = run_case(server, files, workers, chunk_mb, args.threshold_mb, mode.strip(),
+                                      args.requests_per_second, args.verbose)
+                    results.append(result)
+                    print(f"✅ {workers} worker, chunk {chunk_mb:g} MB, {mode}: "
+                          f"{result['files_per_second']:.1f} file/s", flush=True)
+    finally:
+        server.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print()
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
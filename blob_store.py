@@ -0,0 +1,253 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+
+from Autoscreen import IMAGE_EXTENSIONS
+from fingerprint_cache import FingerprintCache, DEDUP_ALGORITHM, HASH_ALGORITHMS
+
+class BlobStore:
+    """
+    Kho lưu ảnh theo nội dung (content-addressed), dùng chung cho mọi kênh/chi nhánh/phiên chụp.
+    Nội dung thật nằm ở objects/<2 ký tự đầu hash>/<hash>; file NN_BR_Kênh.png trong thư mục
+    chi nhánh là hardlink tới blob, nên ảnh trùng chỉ chiếm dung lượng một lần.
+    Ổ không hỗ trợ hardlink (FAT32, ổ mạng SMB/NAS): hardlinks = False và kho không nhận file
+    (bản copy trong objects/ chỉ làm tốn gấp đôi dung lượng), người gọi tắt kho.
+    """
+
+    STORE_DIR = ".store"
+
+    def __init__(self, base_dir="shots", log_callback=None, fingerprints=None):
+        self.base_dir = os.path.abspath(base_dir)
+        self.root = os.path.join(self.base_dir, self.STORE_DIR)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.log_callback = log_callback
+        self.fingerprints = fingerprints or FingerprintCache()
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.hardlinks = self._probe_hardlinks()
+        if not self.hardlinks:
+            self.log_message(f"⚠️ Ổ chứa {self.base_dir} không hỗ trợ hardlink (FAT32, ổ mạng...), "
+                             f"không bật kho chống trùng")
+        self._db = sqlite3.connect(os.path.join(self.root, "manifest.db"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " path TEXT PRIMARY KEY,"   # Đường dẫn tương đối so với base_dir
+            " hash TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " linked INTEGER NOT NULL,"  # 1 = hardlink tới blob, 0 = bản copy riêng (kho cũ, không còn tạo)
+            " added_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_hash ON entries(hash)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        self.algorithm = self._load_algorithm()
+
+    def _load_algorithm(self):
+        """Thuật toán hash của kho, cố định từ lúc tạo kho"""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'algorithm'").fetchone()
+        if row:
+            if row[0] not in HASH_ALGORITHMS:
+                # Ví dụ kho tạo trên máy có xxhash, mở trên máy chưa cài: hash khác thì không chống trùng được
+                raise RuntimeError(f"Kho ảnh {self.root} dùng hash '{row[0]}' nhưng máy này không hỗ trợ "
+                                   f"(cần cài: pip install xxhash)")
+            return row[0]
+        self._db.execute("INSERT INTO meta (key, value) VALUES ('algorithm', ?)", (DEDUP_ALGORITHM,))
+        self._db.commit()
+        return DEDUP_ALGORITHM
+
+    def _probe_hardlinks(self):
+        """Thử tạo hardlink từ thư mục kho sang objects/ (cùng ổ với thư mục ảnh)"""
+        probe = os.path.join(self.root, f".probe-{os.getpid()}-{threading.get_ident()}")
+        link = os.path.join(self.objects_dir, os.path.basename(probe))
+        try:
+            with open(probe, 'wb'):
+                pass
+            os.link(probe, link)
+            return True
+        except OSError:
+            return False
+        finally:
+            for path in (link, probe):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(f"🧱 {message}")
+        else:
+            print(f"Blob store: {message}")
+
+    def hash_file(self, file_path):
+        """Tính hash nội dung file (qua cache, file không đổi sẽ không bị hash lại)"""
+        return self.fingerprints.digest(file_path, self.algorithm)
+
+    def blob_path(self, digest):
+        """Đường dẫn blob trong objects/"""
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _relpath(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.base_dir)
+
+    def ingest(self, file_path, digest=None):
+        """
+        Đưa một file vào kho. Nếu đã có blob cùng nội dung thì thay file bằng hardlink tới blob.
+        Trả về: (hash, số byte tiết kiệm được). OSError nếu không tạo được hardlink (file giữ nguyên)
+        """
+        if not self.hardlinks:
+            raise OSError(f"Ổ chứa {self.base_dir} không hỗ trợ hardlink")
+        digest = digest or self.hash_file(file_path)
+        size = os.path.getsize(file_path)
+        blob = self.blob_path(digest)
+        saved = 0
+
+        with self._lock:
+            if os.path.exists(blob):
+                if not os.path.samefile(blob, file_path):
+                    # Trùng nội dung -> trỏ tên file về blob có sẵn
+                    tmp_path = file_path + ".link"
+                    if os.path.lexists(tmp_path):
+                        os.remove(tmp_path)  # Còn lại từ lần trước bị tắt ngang
+                    os.link(blob, tmp_path)
+                    os.replace(tmp_path, file_path)
+                    saved = size
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(file_path, blob)
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (path, hash, size, linked, added_at) VALUES (?, ?, ?, ?, ?)",
+                (self._relpath(file_path), digest, size, 1, time.time()))
+            self._db.commit()
+        if saved:
+            # File giờ là hardlink mới (inode khác) -> ghi nhớ hash để không phải tính lại
+            self.fingerprints.remember(file_path, self.algorithm, digest)
+        return digest, saved
+
+    def ingest_tree(self, folder_path=None):
+        """Đưa toàn bộ ảnh trong thư mục (mặc định: base_dir) vào kho"""
+        if not self.hardlinks:
+            return 0, 0
+        folder_path = folder_path or self.base_dir
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(folder_path):
+            # Bỏ qua chính thư mục kho
+            dirnames[:] = [d for d in dirnames if d != self.STORE_DIR]
+            paths.extend(os.path.join(dirpath, filename) for filename in filenames
+                         if filename.lower().endswith(IMAGE_EXTENSIONS))
+
+        # Hash song song (chỉ các file chưa có trong cache)
+        digests = self.fingerprints.digest_many(paths, self.algorithm)
+
+        files, saved = 0, 0
+        for path, digest in digests.items():
+            try:
+                _, file_saved = self.ingest(path, digest)
+                files += 1
+                saved += file_saved
+            except OSError as e:
+                self.log_message(f"❌ Lỗi đưa vào kho {os.path.basename(path)}: {e}")
+        self.log_message(f"Đã đưa {files} file vào kho, tiết kiệm {saved / (1024 * 1024):.1f} MB")
+        return files, saved
+
+    def refcount(self, digest):
+        """
+        Số tên file đang trỏ tới blob (hardlink). Bản copy riêng của kho cũ (linked = 0) không dùng blob
+        nên không được tính, GC xóa được blob đó
+        """
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            return 0
+        # st_nlink tính cả chính blob trong objects/
+        return os.stat(blob).st_nlink - 1
+
+    def prune(self):
+        """Xóa các mục manifest mà file không còn tồn tại (đã xóa, đổi tên, nén sang định dạng khác)"""
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM entries").fetchall()
+            missing = [(path,) for (path,) in rows if not os.path.exists(os.path.join(self.base_dir, path))]
+            self._db.executemany("DELETE FROM entries WHERE path = ?", missing)
+            self._db.commit()
+        return len(missing)
+
+    def gc(self):
+        """Thu gom rác: xóa blob không còn file nào trỏ tới. Trả về (số blob đã xóa, số byte giải phóng)"""
+        self.prune()
+        removed, freed = 0, 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                if self.refcount(digest) > 0:
+                    continue
+                blob = os.path.join(prefix_dir, digest)
+                size = os.path.getsize(blob)
+                try:
+                    os.remove(blob)
+                    removed += 1
+                    freed += size
+                except OSError as e:
+                    self.log_message(f"❌ Lỗi xóa blob {digest}: {e}")
+            if not os.listdir(prefix_dir):
+                os.rmdir(prefix_dir)
+        self.log_message(f"GC: đã xóa {removed} blob, giải phóng {freed / (1024 * 1024):.1f} MB")
+        return removed, freed
+
+    def report(self):
+        """Báo cáo tiết kiệm: dung lượng logic (tổng các tên file) so với dung lượng thật (các blob)"""
+        self.prune()
+        with self._lock:
+            entries, logical_bytes, unique_hashes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(DISTINCT hash) FROM entries").fetchone()
+            # Bản copy riêng (kho cũ) chiếm dung lượng thật như một blob
+            copy_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE linked = 0").fetchone()[0]
+        physical_bytes, blobs = copy_bytes, 0
+        for dirpath, dirnames, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                physical_bytes += os.path.getsize(os.path.join(dirpath, filename))
+                blobs += 1
+        saved = logical_bytes - physical_bytes
+        report = {
+            'entries': entries,
+            'unique_hashes': unique_hashes,
+            'blobs': blobs,
+            'logical_bytes': logical_bytes,
+            'physical_bytes': physical_bytes,
+            'saved_bytes': saved,
+            'dedup_ratio': (logical_bytes / physical_bytes) if physical_bytes else 1.0,
+        }
+        self.log_message(f"{entries} file -> {blobs} blob | Logic {logical_bytes / (1024 * 1024):.1f} MB, "
+                         f"thực tế {physical_bytes / (1024 * 1024):.1f} MB | "
+                         f"Tiết kiệm {saved / (1024 * 1024):.1f} MB (x{report['dedup_ratio']:.2f})")
+        return report
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        self.fingerprints.close()
+
+def main():
+    ap = argparse.ArgumentParser(description="Kho ảnh theo nội dung: chống trùng ảnh giữa các phiên và chi nhánh")
+    ap.add_argument("command", choices=["ingest", "gc", "report"], help="ingest: đưa ảnh vào kho | gc: thu gom blob thừa | report: báo cáo tiết kiệm")
+    ap.add_argument("--out", default="shots", help="Thư mục gốc lưu ảnh")
+    args = ap.parse_args()
+
+    store = BlobStore(args.out)
+    try:
+        if args.command == "ingest":
+            store.ingest_tree()
+            store.report()
+        elif args.command == "gc":
+            store.gc()
+        else:
+            store.report()
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+try:
+    from google.auth.transport.requests import Request
+    from google.auth.exceptions import RefreshError
+    from google.oauth2.credentials import Credentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import build_http
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+
+class CredentialManager:
+    """
+    Credentials OAuth dùng chung cho mọi upload worker:
+    - token.json chỉ đọc một lần, ghi lại an toàn (file tạm + os.replace, không bao giờ để file ghi dở)
+    - Access token được làm mới trong luồng nền trước khi hết hạn refresh_margin giây,
+      worker không phải dừng giữa chừng để refresh
+    - Pool kết nối HTTP đã xác thực (keep-alive): worker mới lấy lại kết nối TLS của worker trước
+    """
+
+    def __init__(self, token_file="token.json", scopes=None, refresh_margin=300, pool_size=8, log_callback=None):
+        self.token_file = token_file
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin  # Giây trước khi hết hạn thì làm mới
+        self.pool_size = pool_size  # Số kết nối rảnh giữ lại tối đa
+        self.log_callback = log_callback
+        self.credentials = None
+        self._loaded = False
+        self._refresh_lock = threading.Lock()
+        self._auth_request = None  # Dùng lại session HTTP tới máy chủ OAuth giữa các lần refresh
+        self._last_failure_at = 0.0
+        self._pool = []  # Kết nối rảnh, lấy từ cuối (kết nối vừa dùng, còn sống nhất)
+        self._pool_lock = threading.Lock()
+        self._generation = 0  # Tăng khi đổi credentials, kết nối của credentials cũ bị bỏ
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {'refreshes': 0, 'refresh_failures': 0, 'connections_created': 0, 'connections_reused': 0}
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            print(f"Credentials: {message}")
+
+    # ----- Token -----
+
+    def load(self):
+        """Đọc token.json (một lần). Trả về credentials hoặc None"""
+        if self._loaded:
+            return self.credentials
+        self._loaded = True
+        if os.path.exists(self.token_file):
+            try:
+                self.credentials = Credentials.from_authorized_user_file(self.token_file, self.scopes)
+            except Exception as e:
+                self.log_message(f"Lỗi đọc token: {e}")
+        return self.credentials
+
+    def save(self):
+        """Ghi token.json an toàn: ghi file tạm cùng thư mục rồi đổi tên (app tắt giữa chừng không làm hỏng token)"""
+        creds = self.credentials
+        if creds is None or not hasattr(creds, 'to_json'):
+            return
+        folder = os.path.dirname(os.path.abspath(self.token_file))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".token-", suffix=".tmp")  # Quyền 0600
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(creds.to_json())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.token_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def set_credentials(self, credentials, save=True):
+        """Dùng credentials mới (vừa đăng nhập/đọc từ token), bỏ các kết nối cũ và bật làm mới nền"""
+        with self._pool_lock:
+            self.credentials = credentials
+            self._loaded = True
+            self._generation += 1
+            idle, self._pool = self._pool, []
+        for http in idle:
+            self._close(http)
+        if save:
+            self.save()
+        self.start()
+
+    def _seconds_until_refresh(self):
+        """Số giây tới lúc cần làm mới, None nếu credentials không hết hạn/không tự làm mới được"""
+        creds = self.credentials
+        if creds is None or getattr(creds, 'expiry', None) is None or not getattr(creds, 'refresh_token', None):
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # expiry của google-auth là UTC không múi giờ
+        return (creds.expiry - now).total_seconds() - self.refresh_margin
+
+    def ensure_fresh(self):
+        """Làm mới ngay nếu token đã/sắp hết hạn. Trả về True nếu credentials dùng được"""
+        creds = self.credentials
+        if creds is None:
+            return False
+        wait = self._seconds_until_refresh()
+        # Token vẫn còn hạn mà vừa làm mới lỗi (mất mạng): để luồng nền thử lại, không thử ở mọi worker
+        recently_failed = creds.valid and time.monotonic() - self._last_failure_at < 30
+        if wait is not None and wait <= 0 and not recently_failed:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log_message(f"Lỗi làm mới token: {e}")
+        return bool(creds.valid)
+
+    def refresh(self):
+        """Làm mới access token (một luồng tại một thời điểm) rồi lưu token.json"""
+        with self._refresh_lock:
+            wait = self._seconds_until_refresh()
+            if wait is not None and wait > 0:
+                return False  # Luồng khác vừa làm mới xong
+            started = time.perf_counter()
+            if self._auth_request is None:
+                self._auth_request = Request()
+            try:
+                self.credentials.refresh(self._auth_request)
+            except Exception:
+                self.stats['refresh_failures'] += 1
+                self._last_failure_at = time.monotonic()
+                raise
+            self.stats['refreshes'] += 1
+            self.save()
+        self.log_message(f"🔑 Đã làm mới token Google Drive ({(time.perf_counter() - started) * 1000:.0f} ms, "
+                         f"hết hạn lúc {self.credentials.expiry:%H:%M} UTC)")
+        return True
+
+    # ----- Làm mới nền -----
+
+    def start(self):
+        """Bật luồng nền làm mới token trước khi hết hạn (nếu credentials có refresh token)"""
+        if self._seconds_until_refresh() is None:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, stop_event):
+        failures = 0
+        while not stop_event.is_set():
+            wait = self._seconds_until_refresh()
+            if wait is None:
+                return
+            if wait > 0:
+                # Thức dậy định kỳ: máy ngủ/hibernate làm thời gian chờ không còn đúng
+                stop_event.wait(min(wait, 60))
+                continue
+            try:
+                self.refresh()
+                failures = 0
+            except RefreshError as e:
+                # Refresh token bị thu hồi/hết hạn: cần đăng nhập lại, thử tiếp cũng vô ích
+                self.log_message(f"❌ Token Google Drive không còn hiệu lực, cần xác thực lại: {e}")
+                return
+            except Exception as e:
+                # Mất mạng: thử lại với thời gian chờ tăng dần
+                failures += 1
+                self.log_message(f"⚠️ Chưa làm mới được token, thử lại sau: {e}")
+                stop_event.wait(min(30 * 2 ** (failures - 1), 600))
+
+    # ----- Pool kết nối -----
+
+    def authorized_http(self):
+        """Kết nối HTTP mới đã gắn credentials (giữ riêng, không trả về pool)"""
+        self.stats['connections_created'] += 1
+        return AuthorizedHttp(self.credentials, http=build_http())
+
+    def checkout(self):
+        """Lấy một kết nối đã xác thực cho worker (kết nối keep-alive còn rảnh nếu có)"""
+        self.ensure_fresh()
+        with self._pool_lock:
+            if self._pool:
+                self.stats['connections_reused'] += 1
+                return self._pool.pop()
+            generation = self._generation
+        http = self.authorized_http()
+        http.pool_generation = generation
+        return http
+
+    def checkin(self, http):
+        """Trả kết nối về pool khi worker dừng (đóng nếu pool đầy hoặc credentials đã đổi)"""
+        if http is None:
+            return
+        with self._pool_lock:
+            if getattr(http, 'pool_generation', None) == self._generation and len(self._pool) < self.pool_size:
+                self._pool.append(http)
+                return
+        self._close(http)
+
+    def prewarm(self, count, url):
+        """
+        Mở sẵn count kết nối (TLS + keep-alive) bằng một request nhẹ tới url, chạy trong luồng nền.
+        Gọi khi sắp có upload (bắt đầu chụp) để file đầu tiên không phải chờ bắt tay TLS
+        """
+        def warm():
+            connections = []
+            try:
+                self.ensure_fresh()
+                for _ in range(count):
+                    http = self.checkout()
+                    connections.append(http)
+                    http.request(url, 'GET')
+            except Exception as e:
+                self.log_message(f"⚠️ Không mở sẵn được kết nối Drive: {e}")
+            finally:
+                for http in connections:
+                    self.checkin(http)
+
+        if self.credentials is not None:
+            threading.Thread(target=warm, daemon=True).start()
+
+    def idle_connections(self):
+        with self._pool_lock:
+            return len(self._pool)
+
+    @staticmethod
+    def _close(http):
+        try:
+            http.http.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.stop()
+        with self._pool_lock:
+            idle, self._pool = self._pool, []
+        for http in idle:
+            self._close(http)
@@ -0,0 +1,167 @@
+import os
+import argparse
+
+from image_transcoder import smallest_variant
+from fingerprint_cache import FingerprintCache
+from upload_queue import LANE_BACKFILL
+
+class SyncPlan:
+    """Kết quả so sánh một thư mục local với folder trên Drive"""
+
+    def __init__(self, folder_path, folder_id):
+        self.folder_path = folder_path
+        self.folder_id = folder_id  # None: folder đích chưa có trên Drive
+        self.new = []        # [(đường dẫn, kích thước)] chưa có trên Drive
+        self.changed = []    # Trên Drive có file cùng tên nhưng khác nội dung
+        self.unchanged = []  # Đã có trên Drive (cùng tên, cùng MD5)
+        self.remote_only = 0 # Số file chỉ có trên Drive
+        self.hashed = 0      # Số file không có MD5 trong sổ upload (lấy từ cache fingerprint hoặc hash lại)
+
+    @property
+    def to_upload(self):
+        return self.new + self.changed
+
+    @staticmethod
+    def _total(files):
+        return sum(size for _, size in files)
+
+    def summary(self):
+        """Kế hoạch đồng bộ dạng text để hiển thị/in ra (dry-run)"""
+        mb = 1024 * 1024
+        lines = [
+            f"📂 {self.folder_path} -> {self.folder_id or '(folder mới trên Drive)'}",
+            f"  ➕ Mới: {len(self.new)} file ({self._total(self.new) / mb:.1f} MB)",
+            f"  ✏️ Đã thay đổi: {len(self.changed)} file ({self._total(self.changed) / mb:.1f} MB)",
+            f"  ✅ Đã có trên Drive: {len(self.unchanged)} file ({self._total(self.unchanged) / mb:.1f} MB)",
+            f"  ☁️ Chỉ có trên Drive: {self.remote_only} file",
+            f"  📤 Cần upload: {len(self.to_upload)} file ({self._total(self.to_upload) / mb:.1f} MB)",
+        ]
+        return "\n".join(lines)
+
+class DeltaSync:
+    """
+    Đồng bộ một thư mục chi nhánh lên Drive: tải danh sách file của folder đích một lần
+    (phân trang, kèm md5Checksum và size), so với file local rồi chỉ đưa vào hàng đợi file mới hoặc đã đổi.
+    Chỉ hash MD5 các file trùng tên và cùng kích thước với bản trên Drive; hash lấy từ sổ upload
+    hoặc cache fingerprint nếu file chưa đổi.
+    """
+
+    def __init__(self, uploader, fingerprints=None):
+        self.uploader = uploader
+        self.fingerprints = fingerprints or FingerprintCache()
+
+    def _local_files(self, folder_path, file_pattern=None):
+        """Ảnh local cần đồng bộ: {tên trên Drive: (đường dẫn, kích thước)}"""
+        files = {}
+        for filename in os.listdir(folder_path):
+            file_path = os.path.join(folder_path, filename)
+            if file_pattern and not file_pattern.match(filename):
+                continue
+            if not os.path.isfile(file_path) or not filename.lower().endswith(tuple(self.uploader.MIME_TYPES)):
+                continue
+            # Một ảnh có thể có nhiều định dạng -> chỉ upload bản nhỏ nhất
+            file_path = smallest_variant(file_path)
+            try:
+                files[self.uploader.upload_name(file_path)] = (file_path, os.path.getsize(file_path))
+            except OSError:
+                continue
+        return files
+
+    def _cached_md5(self, file_path):
+        """MD5 đã ghi trong sổ upload nếu file chưa đổi từ lúc upload"""
+        entry = self.uploader.ledger.get(file_path)
+        if not entry:
+            return None
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        if st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']:
+            return entry['md5']
+        return None
+
+    def plan(self, folder_path, channel_name, branch_name, file_pattern=None):
+        """So sánh local với Drive, không upload gì (dry-run). Trả về SyncPlan"""
+        folder_id = self.uploader.get_or_create_folder_structure(channel_name, branch_name, create=False)
+        plan = SyncPlan(folder_path, folder_id)
+        local = self._local_files(folder_path, file_pattern)
+        remote = self.uploader._get_remote_listing(folder_id, refresh=True) if folder_id else {}
+
+        # Chỉ file trùng tên và cùng kích thước mới cần so MD5
+        transcoded = self.uploader._get_upload_transcoder() is not None
+        candidates = {}
+        for name, (file_path, size) in local.items():
+            same_name = remote.get(name)
+            if not same_name:
+                plan.new.append((file_path, size))
+            elif transcoded:
+                # Trên Drive là bản nén lúc upload, không so MD5 với file gốc được -> có cùng tên là đủ
+                plan.unchanged.append((file_path, size))
+            elif any(item.get('size') is not None and int(item['size']) == size for item in same_name):
+                candidates[file_path] = (name, size)
+            else:
+                plan.changed.append((file_path, size))
+
+        hashes = {path: self._cached_md5(path) for path in candidates}
+        misses = [path for path, md5 in hashes.items() if not md5]
+        if misses:
+            hashes.update(self.fingerprints.digest_many(misses, 'md5'))
+        plan.hashed = len(misses)
+
+        for file_path, (name, size) in candidates.items():
+            match = next((item for item in remote[name] if item.get('md5Checksum') == hashes.get(file_path)), None)
+            if match:
+                plan.unchanged.append((file_path, size))
+                if not self.uploader.ledger.find_uploaded(file_path, match['md5Checksum'], folder_id, name):
+                    self.uploader.ledger.record_upload(file_path, match['md5Checksum'], match['id'],
+                                                       folder_id, match['md5Checksum'], name,
+                                                       channel_name, branch_name)
+            else:
+                plan.changed.append((file_path, size))
+
+        plan.remote_only = len(set(remote) - set(local))
+        return plan
+
+    def apply(self, plan, channel_name, branch_name):
+        """Đưa các file mới/đã đổi của kế hoạch vào làn backfill của hàng đợi upload. Trả về số file"""
+        for file_path, _ in plan.to_upload:
+            self.uploader.add_to_upload_queue(file_path, channel_name, branch_name, lane=LANE_BACKFILL)
+        return len(plan.to_upload)
+
+    def sync(self, folder_path, channel_name, branch_name, file_pattern=None, dry_run=False):
+        """Lập kế hoạch và (nếu không phải dry-run) đưa file cần upload vào hàng đợi. Trả về SyncPlan"""
+        plan = self.plan(folder_path, channel_name, branch_name, file_pattern)
+        self.uploader.log_message(plan.summary())
+        if not dry_run:
+            self.apply(plan, channel_name, branch_name)
+        return plan
+
+    def close(self):
+        self.fingerprints.close()
+
+def main():
+    from google_drive_uploader import GoogleDriveUploader
+
+    ap = argparse.ArgumentParser(description="Đồng bộ thư mục chi nhánh lên Google Drive (chỉ upload file còn thiếu)")
+    ap.add_argument("folder", help="Thư mục ảnh của chi nhánh, ví dụ shots/ShopeeFood/Chi nhánh 1")
+    ap.add_argument("--channel", required=True, help="Tên kênh (folder kênh trên Drive)")
+    ap.add_argument("--branch", required=True, help="Mã chi nhánh (folder chi nhánh / custom mapping trên Drive)")
+    ap.add_argument("--dry-run", action="store_true", help="Chỉ in kế hoạch, không upload")
+    args = ap.parse_args()
+
+    uploader = GoogleDriveUploader()
+    uploader.load_config()
+    if not uploader.authenticate():
+        return
+    syncer = DeltaSync(uploader)
+    try:
+        plan = syncer.sync(args.folder, args.channel, args.branch, dry_run=args.dry_run)
+        if not args.dry_run and plan.to_upload:
+            uploader.start_upload_worker()
+            for thread in uploader.upload_threads:
+                thread.join()
+    finally:
+        syncer.close()
+
+if __name__ == "__main__":
+    main()
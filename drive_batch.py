@@ -0,0 +1,89 @@
+import time
+
+from drive_scheduler import is_retryable, is_rate_limited, retry_after_seconds
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+def escape_query_value(value):
+    """Escape chuỗi để đặt trong dấu nháy đơn của query Drive (q=...)"""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+class DriveBatch:
+    """
+    Gom nhiều request metadata độc lập (files().get/list/create...) thành một HTTP batch request.
+    Mỗi batch tối đa 100 request theo giới hạn của Drive API; request lỗi tạm thời (rate limit, 5xx)
+    được gom lại và thử lại trong batch sau.
+    """
+
+    MAX_BATCH_SIZE = 100
+
+    def __init__(self, service, scheduler=None, max_retries=3):
+        self.service = service
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self._requests = []  # [(key, request factory, callback)]
+
+    def add(self, key, request_factory, callback=None):
+        """
+        Thêm request vào batch.
+        request_factory: hàm tạo request (cần tạo lại khi thử lại), ví dụ lambda: files().get(...)
+        callback(key, response, exception): gọi khi có kết quả cuối cùng của request
+        """
+        self._requests.append((key, request_factory, callback))
+        return key
+
+    def __len__(self):
+        return len(self._requests)
+
+    def execute(self):
+        """Gửi toàn bộ request. Trả về {key: (response, exception)}"""
+        results = {}
+        pending = self._requests
+        self._requests = []
+        attempt = 0
+
+        while pending:
+            retry, retry_after, throttled = [], None, False
+            for start in range(0, len(pending), self.MAX_BATCH_SIZE):
+                chunk = pending[start:start + self.MAX_BATCH_SIZE]
+                chunk_results = self._execute_chunk(chunk)
+                for key, request_factory, callback in chunk:
+                    response, exception = chunk_results.get(key, (None, None))
+                    if exception is not None and is_retryable(exception) and attempt < self.max_retries:
+                        retry.append((key, request_factory, callback))
+                        retry_after = max(retry_after or 0, retry_after_seconds(exception) or 0)
+                        throttled = throttled or is_rate_limited(exception) or \
+                            retry_after_seconds(exception) is not None
+                        continue
+                    results[key] = (response, exception)
+                    if callback:
+                        callback(key, response, exception)
+
+            pending = retry
+            if pending:
+                attempt += 1
+                delay = retry_after or min(32, 2 ** attempt)
+                if self.scheduler and throttled:
+                    # Bị giới hạn tốc độ (429/403 rate limit): giảm tốc cả hệ thống như RequestScheduler.call
+                    self.scheduler.on_throttle(delay)
+                else:
+                    # Chỉ lỗi 5xx: batch này chờ rồi gửi lại, không giảm giới hạn đồng thời
+                    time.sleep(delay)
+        return results
+
+    def _execute_chunk(self, chunk):
+        """Gửi một batch (tối đa MAX_BATCH_SIZE request)"""
+        chunk_results = {}
+
+        def on_response(request_id, response, exception):
+            chunk_results[request_id] = (response, exception)
+
+        batch = self.service.new_batch_http_request(callback=on_response)
+        for key, request_factory, _ in chunk:
+            batch.add(request_factory(), request_id=str(key))
+        if self.scheduler:
+            self.scheduler.call(batch.execute)
+        else:
+            batch.execute()
+        # request_id trong batch luôn là chuỗi -> đổi lại về key gốc
+        return {key: chunk_results.get(str(key), (None, None)) for key, _, _ in chunk}
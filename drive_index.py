@@ -0,0 +1,306 @@
+import time
+import sqlite3
+import threading
+
+from drive_batch import FOLDER_MIME_TYPE
+
+FILE_FIELDS = "id, name, mimeType, parents, trashed, md5Checksum, size"
+
+class DriveIndex:
+    """
+    Bản sao local (SQLite) của phần cây Drive app dùng: root folder, các folder custom mapping
+    và toàn bộ folder/file con. Tạo lần đầu bằng cách duyệt từng folder (phân trang), sau đó cập nhật
+    tăng dần bằng changes().list với startPageToken đã lưu, nên tìm folder, đồng bộ và debug
+    không phải liệt kê lại cả cây trên Drive.
+    """
+
+    def __init__(self, db_file="drive_index.db"):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " parent_id TEXT,"
+            " mime_type TEXT,"
+            " md5 TEXT,"
+            " size INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent_id, name)")
+        # Folder đã liệt kê đủ file con (danh sách con trong index là đầy đủ)
+        self._db.execute("CREATE TABLE IF NOT EXISTS crawled (folder_id TEXT PRIMARY KEY, root_id TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self.last_sync_at = 0.0
+        self.last_removed = []  # ID bị xóa/chuyển ra ngoài trong lần sync_changes gần nhất
+        self.stats = {'crawled_folders': 0, 'changes_applied': 0}
+
+    # ----- Đọc/ghi meta -----
+
+    def _get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def start_page_token(self):
+        with self._lock:
+            return self._get_meta('start_page_token')
+
+    @property
+    def account(self):
+        """permissionId của tài khoản Drive đã tạo index (None nếu chưa ghi)"""
+        with self._lock:
+            return self._get_meta('account')
+
+    @account.setter
+    def account(self, value):
+        with self._lock:
+            self._set_meta('account', value)
+            self._db.commit()
+
+    def roots(self):
+        """Các folder gốc đang được theo dõi"""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT root_id FROM crawled")]
+
+    # ----- Truy vấn (không gọi API) -----
+
+    def is_covered(self, folder_id):
+        """Index có danh sách con đầy đủ của folder này"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM crawled WHERE folder_id = ?", (folder_id,)).fetchone() is not None
+
+    def get(self, file_id):
+        """Thông tin file/folder trong index, hoặc None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, name, parent_id, mime_type, md5, size FROM files WHERE id = ?", (file_id,)).fetchone()
+        return self._row_to_file(row) if row else None
+
+    def find_child_folder(self, parent_id, name):
+        """
+        Tìm folder con theo tên.
+        Trả về: folder ID, None nếu chắc chắn không có, hoặc False nếu index không có dữ liệu của parent
+        """
+        with self._lock:
+            if not self.is_covered(parent_id):
+                return False
+            row = self._db.execute(
+                "SELECT id FROM files WHERE parent_id = ? AND name = ? AND mime_type = ? ORDER BY id LIMIT 1",
+                (parent_id, name, FOLDER_MIME_TYPE)).fetchone()
+        return row[0] if row else None
+
+    def children(self, parent_id, folders_only=False):
+        """Danh sách con của folder: [{id, name, mimeType, md5Checksum, size}]"""
+        query = "SELECT id, name, parent_id, mime_type, md5, size FROM files WHERE parent_id = ?"
+        params = [parent_id]
+        if folders_only:
+            query += " AND mime_type = ?"
+            params.append(FOLDER_MIME_TYPE)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY name", params).fetchall()
+        return [self._row_to_file(row) for row in rows]
+
+    def listing(self, folder_id):
+        """Danh sách file của folder gom theo tên (cùng dạng với danh sách tải từ Drive), None nếu chưa có"""
+        if not self.is_covered(folder_id):
+            return None
+        listing = {}
+        for item in self.children(folder_id):
+            if item['mimeType'] != FOLDER_MIME_TYPE:
+                listing.setdefault(item['name'], []).append(item)
+        return listing
+
+    @staticmethod
+    def _row_to_file(row):
+        return {'id': row[0], 'name': row[1], 'parent_id': row[2], 'mimeType': row[3],
+                'md5Checksum': row[4], 'size': row[5]}
+
+    # ----- Cập nhật -----
+
+    def add_file(self, file, parent_id):
+        """Ghi file vừa upload/tạo vào index (nếu parent đang được theo dõi)"""
+        with self._lock:
+            row = self._db.execute("SELECT root_id FROM crawled WHERE folder_id = ?", (parent_id,)).fetchone()
+            if not row:
+                return
+            self._upsert(file, parent_id)
+            if file.get('mimeType') == FOLDER_MIME_TYPE:
+                # Folder vừa tạo chưa có gì bên trong
+                self._db.execute("INSERT OR REPLACE INTO crawled (folder_id, root_id) VALUES (?, ?)",
+                                 (file['id'], row[0]))
+            self._db.commit()
+
+    def remove_file(self, file_id):
+        """Bỏ file vừa xóa/chuyển vào thùng rác khỏi index (không chờ Changes API)"""
+        with self._lock:
+            self._remove(file_id)
+            self._db.commit()
+
+    def _upsert(self, file, parent_id):
+        size = file.get('size')
+        self._db.execute(
+            "INSERT OR REPLACE INTO files (id, name, parent_id, mime_type, md5, size) VALUES (?, ?, ?, ?, ?, ?)",
+            (file['id'], file.get('name', ''), parent_id, file.get('mimeType'), file.get('md5Checksum'),
+             int(size) if size is not None else None))
+
+    def _remove(self, file_id):
+        """Xóa file/folder và toàn bộ con của nó khỏi index"""
+        pending = [file_id]
+        while pending:
+            current = pending.pop()
+            pending.extend(row[0] for row in self._db.execute(
+                "SELECT id FROM files WHERE parent_id = ?", (current,)))
+            self._db.execute("DELETE FROM files WHERE id = ?", (current,))
+            self._db.execute("DELETE FROM crawled WHERE folder_id = ?", (current,))
+
+    def crawl(self, service, folder_id, call=None, root_id=None):
+        """Duyệt toàn bộ cây dưới folder_id (phân trang 1000 mục/lần) và ghi vào index"""
+        call = call or (lambda func: func())
+        root_id = root_id or folder_id
+        pending = [folder_id]
+        while pending:
+            folder_id = pending.pop()
+            items, page_token = [], None
+            while True:
+                results = call(service.files().list(
+                    q=f"'{folder_id}' in parents and trashed=false",
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute)
+                items.extend(results.get('files', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+            with self._lock:
+                # Ghi cả folder một lần, thay danh sách cũ
+                self._db.execute("DELETE FROM files WHERE parent_id = ?", (folder_id,))
+                for item in items:
+                    self._upsert(item, folder_id)
+                    if item.get('mimeType') == FOLDER_MIME_TYPE:
+                        pending.append(item['id'])
+                self._db.execute("INSERT OR REPLACE INTO crawled (folder_id, root_id) VALUES (?, ?)",
+                                 (folder_id, root_id))
+                self._db.commit()
+            self.stats['crawled_folders'] += 1
+
+    def ensure_roots(self, service, root_ids, call=None):
+        """
+        Theo dõi đúng các folder gốc đã cho: duyệt folder gốc mới, bỏ folder gốc không còn dùng.
+        Lấy startPageToken trước khi duyệt để không sót thay đổi xảy ra trong lúc duyệt.
+        Trả về số folder gốc vừa duyệt
+        """
+        call = call or (lambda func: func())
+        root_ids = [root_id for root_id in dict.fromkeys(root_ids) if root_id]
+        current = set(self.roots())
+        with self._lock:
+            for root_id in current - set(root_ids):
+                for (folder_id,) in self._db.execute(
+                        "SELECT folder_id FROM crawled WHERE root_id = ?", (root_id,)).fetchall():
+                    self._db.execute("DELETE FROM files WHERE parent_id = ?", (folder_id,))
+                self._db.execute("DELETE FROM crawled WHERE root_id = ?", (root_id,))
+            self._db.commit()
+
+        new_roots = [root_id for root_id in root_ids if root_id not in current]
+        if new_roots and not self.start_page_token:
+            token = call(service.changes().getStartPageToken().execute).get('startPageToken')
+            with self._lock:
+                self._set_meta('start_page_token', token)
+                self._db.commit()
+        for root_id in new_roots:
+            # Ghi cả folder gốc (tên, parent) để tra cứu không cần gọi API
+            root = call(service.files().get(fileId=root_id, fields=FILE_FIELDS).execute)
+            if root.get('trashed'):
+                continue
+            with self._lock:
+                self._upsert(root, (root.get('parents') or [None])[0])
+                self._db.commit()
+            self.crawl(service, root_id, call)
+        if new_roots:
+            self.last_sync_at = time.time()
+        return len(new_roots)
+
+    def sync_changes(self, service, call=None):
+        """Áp dụng các thay đổi trên Drive từ startPageToken đã lưu. Trả về số thay đổi liên quan tới index"""
+        call = call or (lambda func: func())
+        page_token = self.start_page_token
+        if not page_token:
+            return 0
+        applied, new_folders, removed = 0, [], []
+        while page_token:
+            results = call(service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                includeRemoved=True,
+                pageSize=1000,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+            ).execute)
+            with self._lock:
+                for change in results.get('changes', []):
+                    applied += self._apply_change(change, new_folders, removed)
+                if results.get('newStartPageToken'):
+                    self._set_meta('start_page_token', results['newStartPageToken'])
+                self._db.commit()
+            page_token = results.get('nextPageToken')
+
+        # Folder mới chuyển vào cây có thể đã có sẵn file bên trong
+        for folder_id, root_id in new_folders:
+            self.crawl(service, folder_id, call, root_id)
+        self.stats['changes_applied'] += applied
+        self.last_removed = removed
+        self.last_sync_at = time.time()
+        return applied
+
+    def _apply_change(self, change, new_folders, removed):
+        file_id = change.get('fileId')
+        file = change.get('file') or {}
+        known = (self._db.execute("SELECT 1 FROM files WHERE id = ?", (file_id,)).fetchone() is not None
+                 or self.is_covered(file_id))
+        if change.get('removed') or file.get('trashed'):
+            if known:
+                self._remove(file_id)
+                removed.append(file_id)
+                return 1
+            return 0
+
+        # Folder gốc: luôn giữ, chỉ cập nhật tên/parent
+        if self._db.execute("SELECT 1 FROM crawled WHERE folder_id = ? AND root_id = ?",
+                            (file_id, file_id)).fetchone():
+            self._upsert(file, (file.get('parents') or [None])[0])
+            return 1
+
+        # Chỉ giữ file nằm trong folder đang theo dõi
+        parent = None
+        for parent_id in file.get('parents', []):
+            row = self._db.execute("SELECT root_id FROM crawled WHERE folder_id = ?", (parent_id,)).fetchone()
+            if row:
+                parent = (parent_id, row[0])
+                break
+        if parent is None:
+            if known:
+                self._remove(file_id)  # Đã chuyển ra ngoài cây
+                removed.append(file_id)
+                return 1
+            return 0
+
+        self._upsert(file, parent[0])
+        if file.get('mimeType') == FOLDER_MIME_TYPE and not self.is_covered(file_id):
+            new_folders.append((file_id, parent[1]))
+        return 1
+
+    def clear(self):
+        """Xóa toàn bộ index (đổi tài khoản Drive)"""
+        with self._lock:
+            for table in ('files', 'crawled', 'meta'):
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.commit()
+        self.last_sync_at = 0.0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,227 @@
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+from perf_monitor import METRIC_API_CALLS, METRIC_API_ERRORS
+
+# Lỗi 403 do vượt giới hạn tốc độ (thử lại được), khác với hết dung lượng/hết quota ngày
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class UploadCancelled(Exception):
+    """Upload bị dừng (giữa hai chunk hoặc lúc chờ suất upload); phiên resumable vẫn được giữ để upload tiếp"""
+
+def error_status(error):
+    """HTTP status của HttpError (None nếu không phải lỗi HTTP)"""
+    resp = getattr(error, 'resp', None)
+    try:
+        return int(resp.status) if resp is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def error_reason(error):
+    """Lý do lỗi Drive trả về (errors[0].reason), ví dụ 'userRateLimitExceeded'"""
+    content = getattr(error, 'content', None)
+    if not content:
+        return None
+    try:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        errors = json.loads(content).get('error', {}).get('errors', [])
+        return errors[0].get('reason') if errors else None
+    except (ValueError, AttributeError):
+        return None
+
+def retry_after_seconds(error):
+    """Giá trị header Retry-After (giây), None nếu không có"""
+    resp = getattr(error, 'resp', None)
+    if resp is None:
+        return None
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limited(error):
+    """Lỗi do gửi quá nhanh (429 hoặc 403 rate limit)"""
+    status = error_status(error)
+    return status == 429 or (status == 403 and error_reason(error) in RATE_LIMIT_REASONS)
+
+def is_retryable(error):
+    """Lỗi HTTP tạm thời, thử lại sau sẽ được"""
+    status = error_status(error)
+    return status in RETRYABLE_STATUSES or is_rate_limited(error)
+
+class RequestScheduler:
+    """
+    Điều phối request tới Drive API cho các upload worker:
+    - Token bucket giới hạn số request/giây
+    - Giới hạn số file upload đồng thời theo AIMD: tăng dần khi thành công, giảm một nửa khi bị giới hạn tốc độ
+    - Khi bị giới hạn tốc độ, mọi worker cùng tạm dừng theo Retry-After hoặc backoff tăng dần
+    - Giới hạn băng thông upload (byte/giây) tùy chọn, ví dụ trong lúc đang chụp màn hình
+    """
+
+    def __init__(self, max_concurrency=4, requests_per_second=10.0, burst=20, max_retries=5,
+                 base_backoff=1.0, max_backoff=64.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._slot_available = threading.Condition(self._lock)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._backoff_until = 0.0
+        self._last_decrease = 0.0
+        self._consecutive_throttles = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'retried': 0, 'decreases': 0}
+        self.bandwidth_limit = None  # Byte/giây, None = không giới hạn
+        self._bandwidth_free_at = 0.0  # Thời điểm băng thông đã giới hạn rảnh cho lượt gửi tiếp theo
+        self.metrics = None  # PerfMonitor (nếu có): đếm request và lỗi cho dashboard
+
+    def set_max_concurrency(self, max_concurrency):
+        """Đổi số worker tối đa (giới hạn hiện tại không vượt quá giá trị này)"""
+        with self._slot_available:
+            self.max_concurrency = max(1, max_concurrency)
+            self.limit = min(self.limit, self.max_concurrency)
+            self._slot_available.notify_all()
+
+    def set_bandwidth_limit(self, bytes_per_second):
+        """Đặt/bỏ giới hạn băng thông upload (None hoặc 0 = không giới hạn), áp dụng ngay cho worker đang chờ"""
+        with self._lock:
+            self.bandwidth_limit = float(bytes_per_second) if bytes_per_second else None
+            self._bandwidth_free_at = time.monotonic()
+
+    def throttle_bytes(self, size, stop_event=None):
+        """
+        Chờ tới lượt gửi size byte để tốc độ upload trung bình không vượt bandwidth_limit.
+        Các worker xếp lượt theo thứ tự gọi; bỏ giới hạn (set_bandwidth_limit(None)) thì worker đang chờ đi tiếp ngay
+        """
+        with self._lock:
+            if not self.bandwidth_limit:
+                return
+            start = max(time.monotonic(), self._bandwidth_free_at)
+            self._bandwidth_free_at = start + size / self.bandwidth_limit
+        while True:
+            with self._lock:
+                if not self.bandwidth_limit:
+                    return
+            wait = start - time.monotonic()
+            if wait <= 0 or (stop_event is not None and stop_event.is_set()):
+                return
+            time.sleep(min(wait, 0.5))
+
+    @contextmanager
+    def slot(self, stop_event=None):
+        """Giữ một suất upload đồng thời trong lúc upload một file (ném UploadCancelled nếu worker bị dừng khi đang chờ)"""
+        with self._slot_available:
+            while self.in_flight >= max(1, int(self.limit)):
+                if stop_event is not None and stop_event():
+                    raise UploadCancelled("Dừng trong lúc chờ suất upload")
+                self._slot_available.wait(0.5)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._slot_available:
+                self.in_flight -= 1
+                self._slot_available.notify()
+
+    def acquire(self):
+        """Chờ tới khi được gửi request: hết thời gian tạm dừng và còn token"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._backoff_until - now
+                if wait <= 0:
+                    elapsed = now - self._last_refill
+                    self._tokens = min(self.burst, self._tokens + elapsed * self.requests_per_second)
+                    self._last_refill = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.stats['requests'] += 1
+                        return
+                    wait = (1 - self._tokens) / self.requests_per_second
+            time.sleep(min(wait, 1.0))
+
+    def on_success(self):
+        """Request thành công: tăng giới hạn đồng thời thêm khoảng 1 sau mỗi vòng (additive increase)"""
+        with self._slot_available:
+            self._consecutive_throttles = 0
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                self._slot_available.notify_all()
+
+    def on_throttle(self, retry_after=None):
+        """Bị giới hạn tốc độ: giảm một nửa giới hạn đồng thời và tạm dừng mọi request"""
+        with self._lock:
+            now = time.monotonic()
+            self.stats['throttled'] += 1
+            self._consecutive_throttles += 1
+            # Nhiều worker cùng bị 429 trong một đợt chỉ tính là một lần giảm
+            if now >= self._backoff_until and now - self._last_decrease >= 1.0:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+                self.stats['decreases'] += 1
+            if retry_after is None:
+                retry_after = self.backoff_delay(self._consecutive_throttles)
+            self._backoff_until = max(self._backoff_until, now + retry_after)
+            return retry_after
+
+    def backoff_delay(self, attempt):
+        """Backoff tăng gấp đôi theo số lần, có nhiễu ngẫu nhiên để các worker không gửi cùng lúc"""
+        return min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1))) + random.uniform(0, 1)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Gọi một request Drive API qua scheduler, tự thử lại khi gặp lỗi tạm thời.
+        Hết số lần thử thì ném lại lỗi cuối cùng.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            if self.metrics is not None:
+                self.metrics.count(METRIC_API_CALLS)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.count(METRIC_API_ERRORS)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.stats['retried'] += 1
+                if is_rate_limited(e) or retry_after_seconds(e) is not None:
+                    self.on_throttle(retry_after_seconds(e))
+                else:
+                    # Lỗi 5xx: chỉ request này chờ, không giảm tốc cả hệ thống
+                    time.sleep(self.backoff_delay(attempt))
+                continue
+            self.on_success()
+            return result
+
+    def get_status(self):
+        """Trạng thái hiện tại để hiển thị"""
+        with self._lock:
+            backoff_remaining = max(0.0, self._backoff_until - time.monotonic())
+            return {
+                'limit': self.limit,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'requests_per_second': self.requests_per_second,
+                'tokens': self._tokens,
+                'backoff_remaining': backoff_remaining,
+                'throttled': self.stats['throttled'],
+                'retried': self.stats['retried'],
+                'requests': self.stats['requests'],
+                'bandwidth_limit': self.bandwidth_limit,
+            }
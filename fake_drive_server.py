@@ -0,0 +1,446 @@
+import re
+import json
+import time
+import uuid
+import socket
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+class FakeDriveError(Exception):
+    """Lỗi trả về cho client theo định dạng lỗi của Drive API"""
+
+    def __init__(self, status, reason, message=None, headers=None):
+        super().__init__(message or reason)
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+    def body(self):
+        return json.dumps({'error': {'code': self.status, 'message': str(self),
+                                     'errors': [{'reason': self.reason, 'message': str(self)}]}})
+
+class FakeDrive:
+    """
+    Drive v3 giả lập trong bộ nhớ: files.list/get/create/update, about, token OAuth, tải file (alt=media, Range), upload multipart và resumable,
+    changes, batch. Có độ trễ, lỗi ngẫu nhiên và giới hạn request/giây (quota) cấu hình được.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0.0, throttle_status=403):
+        self.latency = latency              # Giây trễ mỗi request API
+        self.error_rate = error_rate        # Tỉ lệ request bị lỗi 503 ngẫu nhiên (0..1)
+        self.rate_limit = rate_limit        # Số request/giây tối đa, 0 = không giới hạn
+        self.throttle_status = throttle_status  # 403 (userRateLimitExceeded) hoặc 429
+        self.account = "fake-user"          # permissionId trả về ở about.get (đổi để giả lập đổi tài khoản)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Xóa toàn bộ dữ liệu và thống kê"""
+        with self._lock:
+            self.files = {}
+            self.contents = {}  # file_id -> nội dung (để tải lại bằng alt=media)
+            self.sessions = {}  # upload_id -> {metadata, size, data}
+            self.changes = []   # [file_id] theo thứ tự thay đổi
+            self._tokens = self.rate_limit
+            self._last_refill = time.monotonic()
+            self.stats = {'http_requests': 0, 'connections': 0, 'token_refreshes': 0, 'api_calls': 0,
+                          'batches': 0, 'throttled': 0, 'injected_errors': 0, 'bytes_uploaded': 0, 'calls': {}}
+
+    def get_stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    # ----- Quota, lỗi, độ trễ -----
+
+    def _admit(self, operation):
+        """Ghi nhận một lời gọi API, ném FakeDriveError nếu bị giới hạn hoặc bị chọn để lỗi"""
+        with self._lock:
+            self.stats['api_calls'] += 1
+            self.stats['calls'][operation] = self.stats['calls'].get(operation, 0) + 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._last_refill) * self.rate_limit)
+                self._last_refill = now
+                if self._tokens < 1:
+                    self.stats['throttled'] += 1
+                    retry_after = (1 - self._tokens) / self.rate_limit
+                    if self.throttle_status == 429:
+                        raise FakeDriveError(429, 'rateLimitExceeded', 'Too Many Requests',
+                                             {'Retry-After': f"{retry_after:.2f}"})
+                    raise FakeDriveError(403, 'userRateLimitExceeded', 'User Rate Limit Exceeded')
+                self._tokens -= 1
+            if self.error_rate and random.random() < self.error_rate:
+                self.stats['injected_errors'] += 1
+                raise FakeDriveError(503, 'backendError', 'Backend Error')
+        if self.latency:
+            time.sleep(self.latency)
+
+    # ----- Dữ liệu -----
+
+    def _new_file(self, metadata, data=None):
+        file_id = uuid.uuid4().hex
+        file = {
+            'id': file_id,
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'parents': metadata.get('parents') or ['root'],
+            'trashed': False,
+        }
+        if data is not None:
+            file['md5Checksum'] = hashlib.md5(data).hexdigest()
+            file['size'] = str(len(data))
+        with self._lock:
+            self.files[file_id] = file
+            if data is not None:
+                self.contents[file_id] = data
+            self.changes.append(file_id)
+            if data is not None:
+                self.stats['bytes_uploaded'] += len(data)
+        return file
+
+    @staticmethod
+    def _unquote(value):
+        return value.replace("\\'", "'").replace('\\\\', '\\')
+
+    def _matches(self, file, query):
+        """Đánh giá q của files.list (các điều kiện nối bằng 'and' mà app dùng)"""
+        for clause in re.split(r"\s+and\s+(?=(?:[^']*'[^']*')*[^']*$)", query.strip()):
+            clause = clause.strip()
+            m = re.fullmatch(r"'((?:[^'\\]|\\.)*)' in parents|parents in '((?:[^'\\]|\\.)*)'", clause)
+            if m:
+                if self._unquote(m.group(1) or m.group(2)) not in file['parents']:
+                    return False
+                continue
+            m = re.fullmatch(r"(name|mimeType)\s*(=|!=)\s*'((?:[^'\\]|\\.)*)'", clause)
+            if m:
+                equal = file[m.group(1)] == self._unquote(m.group(3))
+                if equal != (m.group(2) == '='):
+                    return False
+                continue
+            m = re.fullmatch(r"trashed\s*=\s*(true|false)", clause)
+            if m:
+                if file['trashed'] != (m.group(1) == 'true'):
+                    return False
+                continue
+            raise FakeDriveError(400, 'invalidQuery', f"Unsupported query: {clause}")
+        return True
+
+    # ----- Xử lý request -----
+
+    def dispatch(self, method, path, params, headers, body):
+        """Xử lý một request API. Trả về (status, headers, body bytes)"""
+        try:
+            return self._route(method, path, params, headers, body)
+        except FakeDriveError as e:
+            return e.status, dict(e.headers, **{'Content-Type': 'application/json'}), e.body().encode()
+
+    @staticmethod
+    def _json(payload, status=200, headers=None):
+        return status, dict(headers or {}, **{'Content-Type': 'application/json'}), json.dumps(payload).encode()
+
+    def _route(self, method, path, params, headers, body):
+        if path == '/drive/v3/files' and method == 'GET':
+            self._admit('files.list')
+            return self._json(self._list(params))
+        if path == '/drive/v3/files' and method == 'POST':
+            self._admit('files.create')
+            return self._json(self._new_file(json.loads(body or b'{}')))
+        m = re.fullmatch(r'/drive/v3/files/([^/]+)', path)
+        if m and method == 'GET':
+            self._admit('files.get')
+            with self._lock:
+                file = self.files.get(m.group(1))
+            if not file:
+                raise FakeDriveError(404, 'notFound', f"File not found: {m.group(1)}")
+            if params.get('alt') == 'media':
+                return self._media(m.group(1), headers)
+            return self._json(file)
+        if m and method == 'PATCH':
+            self._admit('files.update')
+            updates = json.loads(body or b'{}')
+            with self._lock:
+                file = self.files.get(m.group(1))
+                if not file:
+                    raise FakeDriveError(404, 'notFound', f"File not found: {m.group(1)}")
+                for key in ('name', 'trashed'):
+                    if key in updates:
+                        file[key] = updates[key]
+                self.changes.append(file['id'])
+            return self._json(file)
+        if path == '/upload/drive/v3/files':
+            return self._upload(method, params, headers, body)
+        if path == '/drive/v3/changes/startPageToken' and method == 'GET':
+            self._admit('changes.getStartPageToken')
+            with self._lock:
+                return self._json({'startPageToken': str(len(self.changes))})
+        if path == '/drive/v3/changes' and method == 'GET':
+            self._admit('changes.list')
+            return self._json(self._changes(params))
+        if path == '/drive/v3/about' and method == 'GET':
+            self._admit('about.get')
+            return self._json({'kind': 'drive#about',
+                               'user': {'permissionId': self.account, 'emailAddress': f"{self.account}@example.com"}})
+        if path == '/token' and method == 'POST':
+            # Endpoint OAuth (token_uri trỏ về server này): cấp access token mới cho refresh token
+            with self._lock:
+                self.stats['token_refreshes'] += 1
+            return self._json({'access_token': f"fake-{uuid.uuid4().hex}", 'expires_in': 3600,
+                               'token_type': 'Bearer'})
+        raise FakeDriveError(404, 'notFound', f"Unknown endpoint: {method} {path}")
+
+    def _media(self, file_id, headers):
+        """Tải nội dung file, hỗ trợ header Range (bytes=start-end)"""
+        with self._lock:
+            data = self.contents.get(file_id)
+        if data is None:
+            raise FakeDriveError(403, 'fileNotDownloadable', 'Only files with binary content can be downloaded')
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+        if not m:
+            return 200, {'Content-Type': 'application/octet-stream'}, data
+        start = int(m.group(1))
+        end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+        if start > end:
+            raise FakeDriveError(416, 'requestedRangeNotSatisfiable', 'Range not satisfiable')
+        return 206, {'Content-Type': 'application/octet-stream',
+                     'Content-Range': f"bytes {start}-{end}/{len(data)}"}, data[start:end + 1]
+
+    def _list(self, params):
+        query = params.get('q', '')
+        page_size = int(params.get('pageSize', 100))
+        offset = int(params.get('pageToken') or 0)
+        with self._lock:
+            files = [file for file in self.files.values() if not query or self._matches(file, query)]
+        page = files[offset:offset + page_size]
+        result = {'files': page}
+        if offset + page_size < len(files):
+            result['nextPageToken'] = str(offset + page_size)
+        return result
+
+    def _changes(self, params):
+        start = int(params.get('pageToken', 0))
+        page_size = int(params.get('pageSize', 100))
+        with self._lock:
+            ids = self.changes[start:start + page_size]
+            changes = [{'fileId': file_id, 'removed': False, 'file': self.files[file_id]} for file_id in ids]
+            end = start + len(ids)
+            result = {'changes': changes}
+            if end < len(self.changes):
+                result['nextPageToken'] = str(end)
+            else:
+                result['newStartPageToken'] = str(end)
+        return result
+
+    def _upload(self, method, params, headers, body):
+        upload_type = params.get('uploadType')
+        if method == 'POST' and upload_type == 'multipart':
+            self._admit('files.create.multipart')
+            metadata, data = self._parse_multipart(headers.get('content-type', ''), body)
+            return self._json(self._new_file(metadata, data))
+        if method == 'POST' and upload_type == 'media':
+            self._admit('files.create.media')
+            return self._json(self._new_file({}, body))
+        if method == 'POST' and upload_type == 'resumable':
+            self._admit('files.create.resumable')
+            upload_id = uuid.uuid4().hex
+            with self._lock:
+                self.sessions[upload_id] = {
+                    'metadata': json.loads(body or b'{}'),
+                    'size': int(headers.get('x-upload-content-length', 0) or 0),
+                    'data': bytearray(),
+                }
+            location = f"{headers.get('x-fake-base', '')}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+            return 200, {'Location': location, 'Content-Length': '0'}, b''
+        if method == 'PUT' and params.get('upload_id'):
+            self._admit('upload.chunk')
+            return self._upload_chunk(params['upload_id'], headers, body)
+        raise FakeDriveError(400, 'badRequest', f"Unsupported upload: {method} uploadType={upload_type}")
+
+    def _upload_chunk(self, upload_id, headers, body):
+        with self._lock:
+            session = self.sessions.get(upload_id)
+        if session is None:
+            raise FakeDriveError(404, 'notFound', 'Upload session not found')
+        content_range = headers.get('content-range', '')
+        m = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if m:
+            start = int(m.group(1))
+            if start != len(session['data']):
+                raise FakeDriveError(400, 'badRequest', 'Chunk does not continue the session')
+            session['data'] += body
+            if m.group(3) != '*':
+                session['size'] = int(m.group(3))
+        elif not re.fullmatch(r'bytes \*/(\d+|\*)', content_range):
+            raise FakeDriveError(400, 'badRequest', f"Bad Content-Range: {content_range}")
+
+        received = len(session['data'])
+        if session['size'] and received >= session['size']:
+            with self._lock:
+                self.sessions.pop(upload_id, None)
+            return self._json(self._new_file(session['metadata'], bytes(session['data'])))
+        response_headers = {'Content-Length': '0'}
+        if received:
+            response_headers['Range'] = f"bytes=0-{received - 1}"
+        return 308, response_headers, b''
+
+    @staticmethod
+    def _split_multipart(content_type, body):
+        m = re.search(r'boundary="?([^";]+)"?', content_type)
+        if not m:
+            raise FakeDriveError(400, 'badRequest', 'Missing multipart boundary')
+        delimiter = b'--' + m.group(1).encode()
+        parts = []
+        for chunk in body.split(delimiter)[1:]:
+            if chunk.startswith(b'--'):
+                break
+            chunk = chunk[2:] if chunk.startswith(b'\r\n') else chunk.lstrip(b'\n')
+            head, _, content = chunk.partition(b'\r\n\r\n') if b'\r\n\r\n' in chunk else chunk.partition(b'\n\n')
+            if content.endswith(b'\r\n'):
+                content = content[:-2]
+            elif content.endswith(b'\n'):
+                content = content[:-1]
+            part_headers = {}
+            head = re.sub(rb'\r?\n[ \t]+', b' ', head)  # Header dài bị gấp dòng (RFC 5322)
+            for line in head.decode('utf-8', 'replace').splitlines():
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    part_headers[key.strip().lower()] = value.strip()
+            parts.append((part_headers, content))
+        return parts
+
+    def _parse_multipart(self, content_type, body):
+        parts = self._split_multipart(content_type, body)
+        if len(parts) != 2:
+            raise FakeDriveError(400, 'badRequest', 'Multipart upload needs metadata and media')
+        return json.loads(parts[0][1] or b'{}'), parts[1][1]
+
+    def batch(self, content_type, body, base_url):
+        """Xử lý batch request: từng phần là một HTTP request, trả về multipart/mixed"""
+        with self._lock:
+            self.stats['batches'] += 1
+        boundary = uuid.uuid4().hex
+        output = []
+        for part_headers, content in self._split_multipart(content_type, body):
+            request_line, _, rest = content.partition(b'\n')
+            method, uri, _ = request_line.decode().strip().split(' ', 2)
+            raw_headers, _, inner_body = rest.partition(b'\r\n\r\n') if b'\r\n\r\n' in rest else rest.partition(b'\n\n')
+            inner_headers = {}
+            for line in raw_headers.decode('utf-8', 'replace').splitlines():
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    inner_headers[key.strip().lower()] = value.strip()
+            inner_headers['x-fake-base'] = base_url
+            parsed = urlparse(uri)
+            params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+            status, headers, response_body = self.dispatch(method, parsed.path, params, inner_headers, inner_body)
+            content_id = part_headers.get('content-id', '<>').strip('<>')
+            lines = [f"--{boundary}", "Content-Type: application/http", f"Content-ID: <response-{content_id}>", "",
+                     f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}"]
+            lines += [f"{key}: {value}" for key, value in headers.items()]
+            output.append(("\r\n".join(lines) + "\r\n\r\n").encode() + response_body + b"\r\n")
+        output.append(f"--{boundary}--".encode())
+        return 200, {'Content-Type': f'multipart/mixed; boundary="{boundary}"'}, b''.join(output)
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Không in từng request
+
+    def setup(self):
+        super().setup()
+        # Gửi response ngay, không chờ gộp gói (Nagle) làm sai số đo độ trễ
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.drive._lock:
+            self.server.drive.stats['connections'] += 1  # Kết nối TCP mới (keep-alive thì không tăng)
+
+    def _handle(self):
+        drive = self.server.drive
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else b''
+        parsed = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        base_url = f"http://{self.headers.get('Host')}"
+        headers['x-fake-base'] = base_url
+        with drive._lock:
+            drive.stats['http_requests'] += 1
+
+        if parsed.path == '/__stats__':
+            status, response_headers, response_body = drive._json(drive.get_stats())
+        elif parsed.path == '/__reset__':
+            drive.reset()
+            status, response_headers, response_body = drive._json({'ok': True})
+        elif parsed.path == '/__config__':
+            config = json.loads(body or b'{}')
+            for key in ('latency', 'error_rate', 'rate_limit', 'throttle_status'):
+                if key in config:
+                    setattr(drive, key, config[key])
+            status, response_headers, response_body = drive._json({'ok': True})
+        elif parsed.path == '/batch/drive/v3':
+            status, response_headers, response_body = drive.batch(headers.get('content-type', ''), body, base_url)
+        else:
+            status, response_headers, response_body = drive.dispatch(
+                self.command, parsed.path, params, headers, body)
+
+        self.send_response(status)
+        for key, value in response_headers.items():
+            if key.lower() != 'content-length':
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+class FakeDriveServer:
+    """Chạy FakeDrive trên cổng HTTP local (luồng nền)"""
+
+    def __init__(self, host='127.0.0.1', port=0, **drive_options):
+        self.drive = FakeDrive(**drive_options)
+        self.httpd = ThreadingHTTPServer((host, port), FakeDriveHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.drive = self.drive
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    ap = argparse.ArgumentParser(description="Server Google Drive v3 giả lập để test/benchmark uploader")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="Giây trễ mỗi request API")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ lỗi 503 ngẫu nhiên (0..1)")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="Số request/giây tối đa (0 = không giới hạn)")
+    ap.add_argument("--throttle-status", type=int, choices=(403, 429), default=403)
+    args = ap.parse_args()
+
+    server = FakeDriveServer(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                             rate_limit=args.rate_limit, throttle_status=args.throttle_status)
+    print(f"Fake Drive đang chạy tại {server.url} (Ctrl+C để dừng)", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import mmap
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# Thuật toán hash hỗ trợ: tên -> hàm tạo đối tượng hash
+HASH_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'md5': hashlib.md5,  # Cần để so với md5Checksum của Google Drive
+    'blake2b': hashlib.blake2b,
+}
+if XXHASH_AVAILABLE:
+    HASH_ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+
+# Thuật toán nhanh cho đường chống trùng: xxhash nếu đã cài, nếu không thì BLAKE2b
+DEDUP_ALGORITHM = 'xxh3_128' if XXHASH_AVAILABLE else 'blake2b'
+
+def hash_file(file_path, algorithm=DEDUP_ALGORITHM):
+    """Hash nội dung file bằng mmap (không copy dữ liệu qua buffer Python)"""
+    hasher = HASH_ALGORITHMS[algorithm]()
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hasher.hexdigest()  # mmap không hỗ trợ file rỗng
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            hasher.update(mapped)
+    return hasher.hexdigest()
+
+class FingerprintCache:
+    """
+    Cache hash file lưu trong SQLite, nhận diện file theo (inode, kích thước, mtime)
+    nên file không đổi sẽ không bao giờ bị hash lại, kể cả khi đã đổi tên (sắp xếp lại số thứ tự).
+    """
+
+    def __init__(self, db_file="fingerprints.db", max_workers=None):
+        self.db_file = db_file
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) + 2)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " path TEXT NOT NULL,"
+            " algorithm TEXT NOT NULL,"
+            " dev INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " PRIMARY KEY (path, algorithm))")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fingerprints_inode"
+            " ON fingerprints(dev, inode, size, mtime_ns, algorithm)")
+        self._db.commit()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def lookup(self, path, algorithm=DEDUP_ALGORITHM):
+        """Tìm hash trong cache, trả về None nếu file đã thay đổi hoặc chưa có"""
+        abs_path, dev, inode, size, mtime_ns = self._key(path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT dev, inode, size, mtime_ns, digest FROM fingerprints WHERE path = ? AND algorithm = ?",
+                (abs_path, algorithm)).fetchone()
+            if row and row[:4] == (dev, inode, size, mtime_ns):
+                return row[4]
+            # File đã đổi tên nhưng nội dung không đổi (cùng inode, kích thước, mtime)
+            row = self._db.execute(
+                "SELECT digest FROM fingerprints WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                (dev, inode, size, mtime_ns, algorithm)).fetchone()
+        if row:
+            self.remember(path, algorithm, row[0])
+            return row[0]
+        return None
+
+    def remember(self, path, algorithm, digest):
+        """Ghi hash đã biết của file vào cache"""
+        abs_path, dev, inode, size, mtime_ns = self._key(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO fingerprints (path, algorithm, dev, inode, size, mtime_ns, digest)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (abs_path, algorithm, dev, inode, size, mtime_ns, digest))
+            self._db.commit()
+
+    def digest(self, path, algorithm=DEDUP_ALGORITHM):
+        """Hash của file, chỉ tính lại khi file đã thay đổi"""
+        cached = self.lookup(path, algorithm)
+        if cached:
+            self.stats['hits'] += 1
+            return cached
+        self.stats['misses'] += 1
+        digest = hash_file(path, algorithm)
+        self.remember(path, algorithm, digest)
+        return digest
+
+    def digest_many(self, paths, algorithm=DEDUP_ALGORITHM):
+        """
+        Hash nhiều file: lấy từ cache nếu có, các file còn lại hash song song bằng thread pool.
+        Trả về: {path: digest} (file lỗi đọc sẽ bị bỏ qua)
+        """
+        results, misses = {}, []
+        for path in paths:
+            try:
+                cached = self.lookup(path, algorithm)
+            except OSError:
+                continue
+            if cached:
+                results[path] = cached
+            else:
+                misses.append(path)
+        self.stats['hits'] += len(results)
+        self.stats['misses'] += len(misses)
+
+        if misses:
+            rows = []
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(hash_file, path, algorithm): path for path in misses}
+                for future, path in futures.items():
+                    try:
+                        digest = future.result()
+                        rows.append(self._key(path) + (algorithm, digest))
+                    except OSError:
+                        continue
+                    results[path] = digest
+            # Ghi một lần cho cả lô
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO fingerprints (path, dev, inode, size, mtime_ns, algorithm, digest)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._db.commit()
+        return results
+
+    def forget(self, path):
+        """Xóa mọi hash đã lưu của file"""
+        with self._lock:
+            self._db.execute("DELETE FROM fingerprints WHERE path = ?", (os.path.abspath(path),))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
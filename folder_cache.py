@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from datetime import datetime
+
+# Tên folder theo ngày do uploader tạo (YYYY-MM-DD)
+DATE_FOLDER_FORMAT = "%Y-%m-%d"
+
+class FolderCache:
+    """
+    Cache đường dẫn folder -> folder ID trên Google Drive, lưu ra file JSON cạnh drive_config.json.
+    Khóa: (parent ID, tên folder) cho folder tìm/tạo theo tên, ('mapped', folder ID) cho folder
+    custom mapping đã kiểm tra. Mục quá TTL cần kiểm tra lại với Drive trước khi dùng tiếp.
+    """
+
+    def __init__(self, cache_file="drive_folder_cache.json", ttl_seconds=24 * 3600, log_callback=None):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self.log_callback = log_callback
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Mỗi lần chỉ một luồng ghi file
+        self._entries = {}
+        self._today = datetime.now().strftime(DATE_FOLDER_FORMAT)
+        self.load()
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            print(f"Folder cache: {message}")
+
+    @staticmethod
+    def _key(parent_id, name):
+        return f"{parent_id or 'root'}/{name}"
+
+    def load(self, cache_file=None):
+        """Đọc cache từ file (bỏ qua nếu file hỏng)"""
+        if cache_file:
+            self.cache_file = cache_file
+        entries = {}
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    entries = json.load(f).get('folders', {})
+        except (OSError, ValueError):
+            entries = {}
+        with self._lock:
+            self._entries = entries
+        self._check_date_rollover()
+
+    def save(self):
+        """
+        Ghi cache ra file (ghi file tạm riêng rồi đổi tên để không hỏng khi tắt đột ngột).
+        Các upload worker ghi nối tiếp nhau, bản chụp sau luôn được ghi sau
+        """
+        with self._save_lock:
+            with self._lock:
+                data = {'folders': dict(self._entries)}
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.cache_file) + ".",
+                                                suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.cache_file)))
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_path, self.cache_file)
+            except OSError as e:
+                self.log_message(f"⚠️ Không ghi được cache folder {self.cache_file}: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    def _check_date_rollover(self):
+        """Sang ngày mới: bỏ các folder ngày cũ khỏi cache để file không phình mãi"""
+        today = datetime.now().strftime(DATE_FOLDER_FORMAT)
+        with self._lock:
+            self._today = today
+            stale = []
+            for key, entry in self._entries.items():
+                name = key.rsplit('/', 1)[-1]
+                if entry.get('date_folder') and name != today:
+                    stale.append(key)
+            for key in stale:
+                del self._entries[key]
+        return bool(stale)
+
+    def get(self, parent_id, name):
+        """
+        Tìm folder ID trong cache.
+        Trả về: (folder_id, cần kiểm tra lại) hoặc (None, False) nếu chưa có
+        """
+        if datetime.now().strftime(DATE_FOLDER_FORMAT) != self._today and self._check_date_rollover():
+            self.save()
+        with self._lock:
+            entry = self._entries.get(self._key(parent_id, name))
+        if not entry:
+            return None, False
+        expired = time.time() - entry.get('validated_at', 0) > self.ttl_seconds
+        return entry['id'], expired
+
+    def put(self, parent_id, name, folder_id):
+        """Ghi folder ID vừa tìm/tạo/kiểm tra xong"""
+        entry = {'id': folder_id, 'validated_at': time.time()}
+        if self._is_date_name(name):
+            entry['date_folder'] = True
+        with self._lock:
+            self._entries[self._key(parent_id, name)] = entry
+        self.save()
+
+    def put_many(self, items):
+        """Ghi nhiều folder một lần (kết quả batch request): items = [(parent ID, tên, folder ID)]"""
+        now = time.time()
+        with self._lock:
+            for parent_id, name, folder_id in items:
+                entry = {'id': folder_id, 'validated_at': now}
+                if self._is_date_name(name):
+                    entry['date_folder'] = True
+                self._entries[self._key(parent_id, name)] = entry
+        if items:
+            self.save()
+
+    def invalidate(self, parent_id, name):
+        """Xóa mục cache (folder đã bị xóa/chuyển vào thùng rác)"""
+        with self._lock:
+            removed = self._entries.pop(self._key(parent_id, name), None)
+        if removed:
+            self.save()
+
+    def invalidate_id(self, folder_id):
+        """Xóa mọi mục trỏ tới folder ID và mọi folder nằm bên trong nó (mọi cấp)"""
+        with self._lock:
+            removed_ids = {folder_id}
+            stale = set()
+            while True:
+                # Khóa "<parent ID>/<tên>": folder con của folder vừa bị xóa cũng bị xóa, lặp tới hết cây
+                found = [key for key, entry in self._entries.items()
+                         if key not in stale and (entry['id'] in removed_ids
+                                                  or key.split('/', 1)[0] in removed_ids)]
+                if not found:
+                    break
+                stale.update(found)
+                removed_ids.update(self._entries[key]['id'] for key in found)
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            self.save()
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._entries = {}
+        self.save()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @staticmethod
+    def _is_date_name(name):
+        try:
+            datetime.strptime(name, DATE_FOLDER_FORMAT)
+            return True
+        except (TypeError, ValueError):
+            return False
@@ -1,18 +1,40 @@
 import os
-import io
 import json
+import hashlib
+import time
+import socket
 import threading
-import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+from image_transcoder import smallest_variant, UploadTranscoder, UPLOAD_FORMATS
+from upload_ledger import UploadLedger
+from folder_cache import FolderCache
+from fingerprint_cache import hash_file
+from upload_queue import DurableUploadQueue, STATE_FAILED, LANE_LIVE, LANE_BACKFILL
+from upload_handoff import UploadHandoff
+from drive_scheduler import RequestScheduler, UploadCancelled, is_retryable, error_status, retry_after_seconds
+from drive_batch import DriveBatch, FOLDER_MIME_TYPE, escape_query_value
+from delta_sync import DeltaSync
+from upload_verifier import UploadVerifier
+from drive_index import DriveIndex
+from session_archive import (
+    SessionArchive, ArchiveIndex, ARCHIVE_FORMATS, write_archive_job, read_archive_job, is_archive_job
+)
+from credential_manager import CredentialManager
+from storage_backends import DriveBackend, create_backend
+from perf_monitor import (PerfMonitor, METRIC_UPLOAD_BYTES, METRIC_UPLOAD_FILES, METRIC_UPLOAD_ERRORS,
+                          METRIC_UPLOAD_RETRIES, METRIC_UPLOAD_LATENCY)
+
 try:
-    from google.auth.transport.requests import Request
-    from google.oauth2.credentials import Credentials
     from google_auth_oauthlib.flow import InstalledAppFlow
-    from googleapiclient.discovery import build
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient import discovery_cache
     from googleapiclient.http import MediaIoBaseUpload
     from googleapiclient.errors import HttpError
+    from google.auth.exceptions import TransportError
+    import httplib2
     GOOGLE_DRIVE_AVAILABLE = True
 except ImportError:
     GOOGLE_DRIVE_AVAILABLE = False
@@ -23,16 +45,78 @@ class GoogleDriveUploader:
     # Scope cho Google Drive API
     SCOPES = ['https://www.googleapis.com/auth/drive.file']
     
+    # MIME type theo phần mở rộng (ảnh có thể đã được nén sang WebP/AVIF)
+    MIME_TYPES = {
+        '.png': 'image/png',
+        '.webp': 'image/webp',
+        '.avif': 'image/avif',
+        '.jpg': 'image/jpeg',
+    }
+    
+    # Danh sách file trên Drive tải trong khoảng này trước khi bắt đầu upload thì dùng lại
+    LISTING_REUSE_SECONDS = 60
+    
     def __init__(self, credentials_file="credentials.json", token_file="token.json"):
         self.credentials_file = credentials_file
         self.token_file = token_file
-        self.service = None
-        self.upload_queue = queue.Queue()
+        self._service = None
+        # Token dùng chung: làm mới nền trước khi hết hạn, pool kết nối keep-alive cho các worker
+        self.credential_manager = CredentialManager(token_file, self.SCOPES,
+                                                    log_callback=lambda message: self.log_message(message))
+        self._thread_local = threading.local()  # Mỗi worker giữ service riêng (httplib2 không thread-safe)
+        # Hàng đợi upload lưu trên đĩa; file đang upload dở lần trước được đưa lại về chờ upload
+        self.upload_queue = DurableUploadQueue()
+        self.recovered_uploads = self.upload_queue.recover()
+        self.upload_queue.purge_done()
+        # Luồng chụp đưa file qua bộ đệm có giới hạn (tràn thì ghi spool ra đĩa), không chờ SQLite/mạng
+        self.handoff = UploadHandoff(self.upload_queue, on_enqueued=self._on_handoff_enqueued,
+                                     log_callback=lambda message: self.log_message(message))
         self.is_uploading = False
-        self.upload_thread = None
+        self.upload_threads = []
+        self.upload_workers = 4  # Số luồng upload song song
+        self._active_workers = 0
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        
+        # Điều phối request: token bucket + số upload đồng thời tự điều chỉnh khi bị giới hạn tốc độ
+        self.scheduler = RequestScheduler(max_concurrency=self.upload_workers)
+        # Số liệu theo thời gian cho dashboard hiệu năng (request, byte, lỗi)
+        self.metrics = PerfMonitor()
+        self.scheduler.metrics = self.metrics
+        
+        # Cache folder ID dùng chung giữa các worker, lưu lại giữa các lần chạy
+        self.folder_cache = FolderCache(log_callback=lambda message: self.log_message(message))
+        self._folder_locks = {}
+        self._folder_locks_lock = threading.Lock()
+        
+        # Danh sách file trên Drive theo folder, tải một lần mỗi phiên upload: folder_id -> {tên: [file]}
+        self._remote_listings = {}
+        self._remote_listing_times = {}  # folder_id -> thời điểm tải danh sách
         self.log_callback = None
         self.progress_callback = None
         self.completion_callback = None
+        self.chunk_callback = None
+        
+        # Sổ ghi các file đã upload (dùng để xác nhận trước khi dọn ổ đĩa)
+        self.ledger = UploadLedger()
+        # Đồng bộ thư mục (so sánh local với Drive), tạo khi dùng lần đầu
+        self._delta_sync = None
+        self._verifier = None  # Kiểm tra lại file đã upload với md5Checksum trên Drive
+        
+        # Index local của cây folder trên Drive, cập nhật bằng Changes API
+        self.drive_index = DriveIndex()
+        self.index_sync_interval = 30  # Giây giữa hai lần lấy thay đổi từ Drive
+        self._index_lock = threading.Lock()
+        
+        # Chi nhánh upload cả phiên chụp thành một file tar/zip thay vì từng ảnh
+        self.archive_branches = []
+        self.archive_format = 'tar'
+        self.archive_index = ArchiveIndex()  # Vị trí từng ảnh trong các archive đã upload
+        self.archive_job_dir = "archive_jobs"  # File mô tả archive đang chờ trong hàng đợi upload
+        
+        # Nơi lưu: Drive và/hoặc thư mục local/NAS, mỗi file trong hàng đợi được gửi song song tới tất cả
+        self.storage_backends = [DriveBackend(self)]
+        self._backend_executor = None
         
         # Cấu hình upload
         self.auto_upload = False
@@ -45,6 +129,20 @@ class GoogleDriveUploader:
         self.custom_folder_mapping = {}  # Mapping tùy chỉnh folder cho từng chi nhánh
         self.use_custom_mapping = False  # Sử dụng mapping tùy chỉnh thay vì cấu trúc mặc định
         
+        # Upload theo chunk: file lớn dùng resumable upload, file nhỏ gửi một request multipart
+        self.chunk_size_mb = 8  # Làm tròn xuống bội số 256 KB theo yêu cầu của Drive API
+        self.multipart_threshold_mb = 5
+        # Nén ảnh ngay trước khi upload (mạng chậm): None, 'webp', 'jpeg' hoặc 'original' (chỉ thu nhỏ)
+        self.upload_transcode_format = None
+        self.upload_transcode_quality = 80
+        self.upload_max_width = None  # Thu nhỏ ảnh rộng hơn số pixel này, None = giữ kích thước
+        self._upload_transcoder = None
+        # Giới hạn băng thông upload trong lúc đang chụp (KB/s, 0 = không giới hạn) để không tranh I/O với luồng chụp
+        self.capture_bandwidth_kbps = 0
+        self.capture_active = False
+        # Địa chỉ Drive API khác mặc định (ví dụ fake_drive_server.py khi benchmark), None = Google
+        self.api_root_url = None
+        
         # Thống kê
         self.upload_stats = {
             'total_uploaded': 0,
@@ -52,16 +150,88 @@ class GoogleDriveUploader:
             'current_session': 0,
             'last_upload_time': None
         }
+        self.session_bytes = 0
+        self.session_started_at = None
+    
+    @property
+    def service(self):
+        """Service Google Drive: worker dùng bản riêng của luồng, còn lại dùng bản chung"""
+        return getattr(self._thread_local, 'service', None) or self._service
+    
+    @service.setter
+    def service(self, value):
+        self._service = value
+    
+    @property
+    def _credentials(self):
+        return self.credential_manager.credentials
+    
+    @_credentials.setter
+    def _credentials(self, value):
+        self.credential_manager.set_credentials(value, save=False)
+    
+    def _build_service(self, credentials=None, http=None):
+        """
+        Tạo Drive service (trỏ tới api_root_url nếu có, kể cả batch và upload).
+        http: kết nối đã xác thực lấy từ pool (dùng thay cho credentials)
+        """
+        if not self.api_root_url:
+            if http is not None:
+                return build('drive', 'v3', http=http, cache_discovery=False)
+            return build('drive', 'v3', credentials=credentials, cache_discovery=False)
+        document = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+        document['rootUrl'] = self.api_root_url
+        document.pop('mtlsRootUrl', None)
+        if http is not None:
+            return build_from_document(document, http=http)
+        return build_from_document(document, credentials=credentials)
+    
+    def _init_thread_service(self):
+        """Tạo service riêng cho luồng worker hiện tại, dùng kết nối keep-alive từ pool"""
+        if getattr(self._thread_local, 'service', None) is None and self._credentials:
+            http = self.credential_manager.checkout()
+            self._thread_local.http = http
+            self._thread_local.service = self._build_service(http=http)
+        return self.service
+    
+    def _release_thread_service(self):
+        """Worker dừng: trả kết nối về pool để worker sau dùng lại (không bắt tay TLS lại)"""
+        self._thread_local.service = None
+        self.credential_manager.checkin(getattr(self._thread_local, 'http', None))
+        self._thread_local.http = None
+    
+    def _record_result(self, success, size=0):
+        """Cập nhật thống kê upload (an toàn khi nhiều worker cùng ghi)"""
+        with self._stats_lock:
+            if success:
+                self.metrics.count(METRIC_UPLOAD_FILES)
+                self.upload_stats['total_uploaded'] += 1
+                self.upload_stats['current_session'] += 1
+                self.upload_stats['last_upload_time'] = datetime.now()
+                self.session_bytes += size
+            else:
+                self.upload_stats['total_failed'] += 1
     
     def is_available(self):
         """Kiểm tra xem Google Drive API có sẵn không"""
         return GOOGLE_DRIVE_AVAILABLE
     
-    def set_callbacks(self, log_callback=None, progress_callback=None, completion_callback=None):
-        """Đặt các callback functions"""
+    def set_callbacks(self, log_callback=None, progress_callback=None, completion_callback=None,
+                      chunk_callback=None):
+        """
+        Đặt các callback functions
+        chunk_callback(file_path, bytes_uploaded, total_bytes): gọi sau mỗi chunk của resumable upload
+        """
         self.log_callback = log_callback
         self.progress_callback = progress_callback
         self.completion_callback = completion_callback
+        self.chunk_callback = chunk_callback
+    
+    @property
+    def chunk_size(self):
+        """Kích thước chunk (byte), bội số của 256 KB"""
+        unit = 256 * 1024
+        return max(unit, int(self.chunk_size_mb * 1024 * 1024) // unit * unit)
     
     def log_message(self, message):
         """Ghi log message"""
@@ -75,69 +245,155 @@ class GoogleDriveUploader:
         if not self.is_available():
             raise Exception("Google Drive API không có sẵn. Vui lòng cài đặt: pip install google-api-python-client google-auth-httplib2 google-auth-oauthlib")
         
-        creds = None
-        
-        # Kiểm tra token đã lưu
-        if os.path.exists(self.token_file):
-            try:
-                creds = Credentials.from_authorized_user_file(self.token_file, self.SCOPES)
-            except Exception as e:
-                self.log_message(f"Lỗi đọc token: {e}")
+        manager = self.credential_manager
+        # Token đã lưu (token.json chỉ đọc lần đầu), làm mới nếu đã/sắp hết hạn
+        creds = manager.load()
+        if creds and not manager.ensure_fresh():
+            creds = None
         
         # Nếu không có credentials hợp lệ, yêu cầu xác thực
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception as e:
-                    self.log_message(f"Lỗi làm mới token: {e}")
-                    creds = None
-            
-            if not creds:
-                if not os.path.exists(self.credentials_file):
-                    raise Exception(f"Không tìm thấy file credentials: {self.credentials_file}")
-                
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, self.SCOPES)
-                creds = flow.run_local_server(port=0)
+        if not creds:
+            if not os.path.exists(self.credentials_file):
+                raise Exception(f"Không tìm thấy file credentials: {self.credentials_file}")
             
+            flow = InstalledAppFlow.from_client_secrets_file(
+                self.credentials_file, self.SCOPES)
+            creds = flow.run_local_server(port=0)
             # Lưu credentials cho lần sử dụng tiếp theo
-            with open(self.token_file, 'w') as token:
-                token.write(creds.to_json())
+            manager.set_credentials(creds)
+        else:
+            manager.set_credentials(creds, save=False)
         
-        self.service = build('drive', 'v3', credentials=creds)
+        self.service = self._build_service(http=manager.authorized_http())
+        self._check_account()
         self.log_message("✅ Đã xác thực thành công với Google Drive")
         return True
     
-    def create_folder(self, folder_name, parent_id=None):
-        """Tạo folder trên Google Drive"""
+    def _check_account(self):
+        """
+        Đăng nhập tài khoản Drive khác lần trước: bỏ index, cache folder và root folder của tài khoản cũ
+        (ID folder của tài khoản cũ không dùng được, để lại sẽ upload nhầm/lỗi)
+        """
+        try:
+            about = self.scheduler.call(self.service.about().get(fields='user(permissionId, emailAddress)').execute)
+        except Exception as e:
+            self.log_message(f"⚠️ Không kiểm tra được tài khoản Drive: {e}")
+            return
+        account = (about.get('user') or {}).get('permissionId')
+        if not account:
+            return
+        previous = self.drive_index.account
+        if previous and previous != account:
+            self.drive_index.clear()
+            self.folder_cache.clear()
+            self._remote_listings.clear()
+            self._remote_listing_times.clear()
+            if not self.use_root_folder_id:
+                self.root_folder_id = None
+            self.log_message(f"🔄 Đã đổi tài khoản Drive ({about['user'].get('emailAddress', account)}), "
+                             f"xóa index và cache folder của tài khoản cũ")
+        if previous != account:
+            self.drive_index.account = account
+    
+    def _folder_lock(self, key):
+        """Lock riêng cho từng folder để các worker không tìm/tạo trùng"""
+        with self._folder_locks_lock:
+            return self._folder_locks.setdefault(key, threading.Lock())
+    
+    def _cached_folder(self, parent_id, name):
+        """
+        Lấy folder ID từ cache, kiểm tra lại với Drive nếu đã quá TTL.
+        Trả về None nếu chưa có hoặc folder không còn hợp lệ.
+        """
+        folder_id, expired = self.folder_cache.get(parent_id, name)
+        if not folder_id or not expired:
+            return folder_id
+        if self._check_folder_exists(folder_id):
+            self.folder_cache.put(parent_id, name, folder_id)
+            return folder_id
+        # Folder đã bị xóa -> bỏ cả các folder con đã cache
+        self.folder_cache.invalidate(parent_id, name)
+        self.folder_cache.invalidate_id(folder_id)
+        return None
+    
+    def create_folder(self, folder_name, parent_id=None, create=True):
+        """
+        Tạo folder trên Google Drive (có cache, các worker không tạo trùng folder).
+        create=False: chỉ tìm folder có sẵn, trả về None nếu chưa có
+        """
+        folder_id, expired = self.folder_cache.get(parent_id, folder_name)
+        if folder_id and not expired:
+            return folder_id
+        
+        with self._folder_lock((parent_id, folder_name)):
+            # Worker khác có thể vừa tạo xong trong lúc chờ lock
+            folder_id = self._cached_folder(parent_id, folder_name)
+            if folder_id:
+                return folder_id
+            folder_id = self._find_or_create_folder(folder_name, parent_id, create)
+            if folder_id:
+                self.folder_cache.put(parent_id, folder_name, folder_id)
+            return folder_id
+    
+    def _check_mapped_folder(self, folder_id):
+        """Kiểm tra folder ID cấu hình sẵn (custom mapping, root ID), kết quả được cache theo TTL"""
+        cached_id, expired = self.folder_cache.get('mapped', folder_id)
+        if cached_id and not expired:
+            return True
+        with self._folder_lock(('mapped', folder_id)):
+            if self._cached_folder('mapped', folder_id):
+                return True
+            if self._check_folder_exists(folder_id):
+                self.folder_cache.put('mapped', folder_id, folder_id)
+                return True
+            return False
+    
+    def _find_or_create_folder(self, folder_name, parent_id=None, create=True):
+        """Tìm folder theo tên, tạo mới nếu chưa có (create=True)"""
+        # Index chỉ dùng khi đã có folder. Không có trong index chưa chắc là chưa có trên Drive
+        # (máy khác dùng chung root vừa tạo, ví dụ folder ngày lúc nửa đêm) -> luôn hỏi Drive trước khi tạo
+        indexed = self.drive_index.find_child_folder(parent_id, folder_name) if parent_id else None
+        if indexed:
+            return indexed
+        
         try:
             # Kiểm tra xem folder đã tồn tại chưa
-            query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+            query = f"name='{escape_query_value(folder_name)}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
             if parent_id:
                 query += f" and parents in '{parent_id}'"
             else:
                 query += " and 'root' in parents"
             
-            results = self.service.files().list(q=query, fields="files(id, name)").execute()
+            results = self.scheduler.call(self.service.files().list(q=query, fields="files(id, name)").execute)
             items = results.get('files', [])
             
             if items:
                 # Folder đã tồn tại
                 return items[0]['id']
+            if not create:
+                return None
+            
+            return self._create_folder_on_drive(folder_name, parent_id)
             
-            # Tạo folder mới
+        except HttpError as e:
+            self.log_message(f"❌ Lỗi tạo folder '{folder_name}': {e}")
+            return None
+    
+    def _create_folder_on_drive(self, folder_name, parent_id=None):
+        """Tạo folder mới trên Drive (không kiểm tra trùng) và ghi vào index"""
+        try:
             folder_metadata = {
                 'name': folder_name,
-                'mimeType': 'application/vnd.google-apps.folder'
+                'mimeType': FOLDER_MIME_TYPE
             }
             
             if parent_id:
                 folder_metadata['parents'] = [parent_id]
             
-            folder = self.service.files().create(body=folder_metadata, fields='id').execute()
+            folder = self.scheduler.call(self.service.files().create(body=folder_metadata, fields='id').execute)
             folder_id = folder.get('id')
             
+            self.drive_index.add_file({'id': folder_id, 'name': folder_name, 'mimeType': FOLDER_MIME_TYPE}, parent_id)
             self.log_message(f"📁 Đã tạo folder: {folder_name}")
             return folder_id
             
@@ -145,241 +401,1081 @@ class GoogleDriveUploader:
             self.log_message(f"❌ Lỗi tạo folder '{folder_name}': {e}")
             return None
     
-    def get_or_create_folder_structure(self, channel_name, branch_name):
-        """Tạo cấu trúc thư mục cho kênh và chi nhánh"""
+    def get_or_create_folder_structure(self, channel_name, branch_name, create=True):
+        """
+        Tạo cấu trúc thư mục cho kênh và chi nhánh.
+        create=False: chỉ tìm (dry-run), trả về None nếu folder đích chưa có trên Drive
+        """
         try:
             # Nếu sử dụng custom mapping, upload trực tiếp vào folder đã map
             if self.use_custom_mapping and branch_name in self.custom_folder_mapping:
                 folder_id = self.custom_folder_mapping[branch_name]
-                # Kiểm tra folder có tồn tại không
-                if self._check_folder_exists(folder_id):
-                    self.log_message(f"📁 Sử dụng custom mapping: {branch_name} -> {folder_id}")
+                # Kiểm tra folder có tồn tại không (qua cache)
+                if self._check_mapped_folder(folder_id):
                     return folder_id
                 else:
                     self.log_message(f"❌ Folder ID không hợp lệ cho chi nhánh {branch_name}: {folder_id}")
                     return None
             
             # Nếu không dùng custom mapping, tạo cấu trúc folder thông thường
-            self.log_message(f"📂 Tạo cấu trúc folder thông thường cho {channel_name}/{branch_name}")
-            
-            # Tạo hoặc sử dụng root folder
-            if not self.root_folder_id:
-                if self.use_root_folder_id:
-                    # Sử dụng root_folder_name như là folder ID
-                    self.root_folder_id = self.root_folder_name
-                    if not self._check_folder_exists(self.root_folder_id):
-                        self.log_message(f"❌ Root folder ID không hợp lệ: {self.root_folder_id}")
-                        return None
-                    else:
-                        self.log_message(f"📁 Sử dụng root folder ID: {self.root_folder_id}")
-                else:
-                    # Tạo folder mới theo tên
-                    self.root_folder_id = self.create_folder(self.root_folder_name)
-                    if not self.root_folder_id:
-                        return None
+            # Tạo hoặc sử dụng root folder (chỉ một worker xử lý)
+            with self._folder_lock('root'):
+                if not self._resolve_root_folder(create):
+                    return None
             
             current_folder_id = self.root_folder_id
             
             # Tạo folder theo ngày nếu được bật
             if self.create_date_folders:
                 date_folder = datetime.now().strftime("%Y-%m-%d")
-                current_folder_id = self.create_folder(date_folder, current_folder_id)
+                current_folder_id = self.create_folder(date_folder, current_folder_id, create)
                 if not current_folder_id:
                     return None
             
             # Tạo folder kênh nếu được bật
             if self.create_channel_folders:
-                current_folder_id = self.create_folder(channel_name, current_folder_id)
+                current_folder_id = self.create_folder(channel_name, current_folder_id, create)
                 if not current_folder_id:
                     return None
             
             # Tạo folder chi nhánh nếu được bật
             if self.create_branch_folders:
-                current_folder_id = self.create_folder(branch_name, current_folder_id)
+                current_folder_id = self.create_folder(branch_name, current_folder_id, create)
             
             return current_folder_id
             
         except Exception as e:
+            if self._is_offline_error(e):
+                raise  # Để hàng đợi chờ có mạng rồi thử lại
             self.log_message(f"❌ Lỗi tạo cấu trúc folder: {e}")
             return None
     
+    def _resolve_root_folder(self, create=True):
+        """Xác định root folder ID (dùng ID có sẵn hoặc tạo theo tên)"""
+        if self.root_folder_id:
+            return True
+        
+        if self.use_root_folder_id:
+            # Sử dụng root_folder_name như là folder ID
+            if not self._check_mapped_folder(self.root_folder_name):
+                self.log_message(f"❌ Root folder ID không hợp lệ: {self.root_folder_name}")
+                return False
+            self.root_folder_id = self.root_folder_name
+            self.log_message(f"📁 Sử dụng root folder ID: {self.root_folder_id}")
+        else:
+            # Tạo folder mới theo tên
+            self.root_folder_id = self.create_folder(self.root_folder_name, create=create)
+        return bool(self.root_folder_id)
+    
     def _check_folder_exists(self, folder_id):
-        """Kiểm tra folder có tồn tại trên Google Drive không"""
-        try:
-            self.service.files().get(fileId=folder_id).execute()
+        """Kiểm tra folder có tồn tại trên Google Drive không (và chưa bị xóa vào thùng rác)"""
+        if self._index_is_fresh() and (self.drive_index.is_covered(folder_id) or self.drive_index.get(folder_id)):
             return True
-        except:
+        try:
+            folder = self.scheduler.call(self.service.files().get(fileId=folder_id, fields='id, trashed').execute)
+            return not folder.get('trashed', False)
+        except HttpError as e:
+            if error_status(e) == 404:
+                return False  # Folder đã bị xóa hẳn (hoặc không còn quyền truy cập)
+            # Lỗi mạng/server không có nghĩa folder đã mất: giữ cache, để hàng đợi thử lại sau
+            raise
+    
+    def _index_roots(self):
+        """Các folder gốc cần có trong index: root folder và các folder custom mapping"""
+        roots = []
+        if self.use_root_folder_id:
+            roots.append(self.root_folder_name)
+        elif self.root_folder_id:
+            roots.append(self.root_folder_id)
+        if self.use_custom_mapping:
+            roots.extend(self.custom_folder_mapping.values())
+        return roots
+    
+    def _index_is_fresh(self):
+        """Index đã cập nhật thay đổi từ Drive gần đây"""
+        return time.time() - self.drive_index.last_sync_at < self.index_sync_interval
+    
+    def refresh_drive_index(self, force=False):
+        """
+        Cập nhật index folder: duyệt folder gốc mới (lần đầu), sau đó chỉ lấy thay đổi qua changes().list.
+        force=False: bỏ qua nếu vừa cập nhật trong index_sync_interval giây. Trả về True nếu index dùng được
+        """
+        if not self.service:
             return False
+        with self._index_lock:
+            if not force and self._index_is_fresh():
+                return True
+            try:
+                crawled = self.drive_index.ensure_roots(self.service, self._index_roots(), self.scheduler.call)
+                if crawled:
+                    self.log_message(f"🗂️ Đã tạo index cho {crawled} folder gốc "
+                                     f"({self.drive_index.stats['crawled_folders']} folder)")
+                changes = self.drive_index.sync_changes(self.service, self.scheduler.call)
+                if changes:
+                    self.log_message(f"🔄 Index: cập nhật {changes} thay đổi từ Drive")
+                # Folder đã bị xóa/chuyển đi trên Drive -> bỏ khỏi cache folder và danh sách file
+                for file_id in self.drive_index.last_removed:
+                    self.folder_cache.invalidate_id(file_id)
+                    self._remote_listings.pop(file_id, None)
+                return True
+            except Exception as e:
+                if self._is_offline_error(e):
+                    raise
+                self.log_message(f"⚠️ Không cập nhật được index folder: {e}")
+                return False
+    
+    def get_folders_info(self, folder_ids):
+        """
+        Kiểm tra nhiều folder ID trong một batch request (tối đa 100 folder/HTTP request).
+        Trả về {folder_id: (thông tin folder hoặc None, thông báo lỗi hoặc None)}.
+        Folder hợp lệ được ghi vào cache để upload worker không phải kiểm tra lại.
+        """
+        folder_ids = [folder_id for folder_id in dict.fromkeys(folder_ids) if folder_id]
+        if not folder_ids:
+            return {}
+        
+        batch = DriveBatch(self.service, self.scheduler)
+        for index, folder_id in enumerate(folder_ids):
+            batch.add(index, lambda folder_id=folder_id: self.service.files().get(
+                fileId=folder_id, fields='id, name, mimeType, trashed'))
+        
+        results, valid = {}, []
+        for index, (folder, error) in batch.execute().items():
+            folder_id = folder_ids[index]
+            if error is not None:
+                if error_status(error) == 404:
+                    self.folder_cache.invalidate_id(folder_id)
+                    results[folder_id] = (None, "Folder không tồn tại")
+                else:
+                    results[folder_id] = (None, str(error))
+            elif folder.get('trashed', False):
+                self.folder_cache.invalidate_id(folder_id)
+                results[folder_id] = (None, "Folder đã bị xóa vào thùng rác")
+            else:
+                results[folder_id] = (folder, None)
+                valid.append(('mapped', folder_id, folder_id))
+        self.folder_cache.put_many(valid)
+        return results
+    
+    def find_folders_by_name(self, folder_names, parent_id=None):
+        """Tìm nhiều folder theo tên trong cùng một batch request. Trả về {tên: folder ID hoặc None}"""
+        folder_names = list(dict.fromkeys(folder_names))
+        batch = DriveBatch(self.service, self.scheduler)
+        for index, folder_name in enumerate(folder_names):
+            query = f"name='{escape_query_value(folder_name)}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+            query += f" and '{parent_id or 'root'}' in parents"
+            batch.add(index, lambda query=query: self.service.files().list(q=query, fields="files(id, name)"))
+        
+        found = {}
+        for index, (results, error) in batch.execute().items():
+            folder_name = folder_names[index]
+            if error is not None:
+                self.log_message(f"❌ Lỗi tìm folder '{folder_name}': {error}")
+                found[folder_name] = None
+                continue
+            items = results.get('files', [])
+            found[folder_name] = items[0]['id'] if items else None
+        self.folder_cache.put_many([(parent_id, name, folder_id) for name, folder_id in found.items() if folder_id])
+        return found
+    
+    def create_folders(self, folder_names, parent_id=None):
+        """Tạo nhiều folder trong cùng một batch request. Trả về {tên: folder ID hoặc None nếu lỗi}"""
+        folder_names = list(dict.fromkeys(folder_names))
+        batch = DriveBatch(self.service, self.scheduler)
+        for index, folder_name in enumerate(folder_names):
+            folder_metadata = {'name': folder_name, 'mimeType': FOLDER_MIME_TYPE}
+            if parent_id:
+                folder_metadata['parents'] = [parent_id]
+            batch.add(index, lambda body=folder_metadata: self.service.files().create(body=body, fields='id'))
+        
+        created = {}
+        for index, (folder, error) in batch.execute().items():
+            folder_name = folder_names[index]
+            if error is not None:
+                self.log_message(f"❌ Lỗi tạo folder '{folder_name}': {error}")
+                created[folder_name] = None
+                continue
+            created[folder_name] = folder.get('id')
+            self.log_message(f"📁 Đã tạo folder: {folder_name}")
+        self.folder_cache.put_many([(parent_id, name, folder_id) for name, folder_id in created.items() if folder_id])
+        return created
+    
+    def _prevalidate_mapped_folders(self):
+        """Kiểm tra trước (một batch request) các folder custom mapping chưa có hoặc đã quá hạn trong cache"""
+        if not self.use_custom_mapping or not self.custom_folder_mapping:
+            return
+        stale = []
+        for folder_id in self.custom_folder_mapping.values():
+            cached_id, expired = self.folder_cache.get('mapped', folder_id)
+            if not cached_id or expired:
+                stale.append(folder_id)
+        if not stale:
+            return
+        try:
+            results = self.get_folders_info(stale)
+        except Exception as e:
+            self.log_message(f"⚠️ Chưa kiểm tra được folder mapping: {e}")
+            return
+        for branch_code, folder_id in self.custom_folder_mapping.items():
+            folder, error = results.get(folder_id, (True, None))
+            if error:
+                self.log_message(f"❌ Folder ID không hợp lệ cho chi nhánh {branch_code}: {folder_id} ({error})")
     
     def upload_file(self, file_path, folder_id=None, custom_name=None):
         """Upload một file lên Google Drive"""
+        filename = custom_name or os.path.basename(file_path)
         try:
-            if not os.path.exists(file_path):
-                self.log_message(f"❌ File không tồn tại: {file_path}")
-                return False
-            
-            filename = custom_name or os.path.basename(file_path)
-            
-            # Kiểm tra file đã tồn tại chưa
-            query = f"name='{filename}' and trashed=false"
-            if folder_id:
-                query += f" and parents in '{folder_id}'"
-            
-            results = self.service.files().list(q=query, fields="files(id, name)").execute()
-            items = results.get('files', [])
-            
-            if items:
+            return self._upload(file_path, folder_id, custom_name)
+        except FileNotFoundError:
+            self.log_message(f"❌ File không tồn tại: {file_path}")
+            return False
+        except HttpError as e:
+            self._record_result(False)
+            self.log_message(f"❌ Lỗi upload '{filename}': {e}")
+            return False
+        except Exception as e:
+            self._record_result(False)
+            self.log_message(f"❌ Lỗi không xác định upload '{filename}': {e}")
+            return False
+    
+    @staticmethod
+    def _is_offline_error(error):
+        """Lỗi do mất mạng (không tới được Google), không phải lỗi của file"""
+        return isinstance(error, (ConnectionError, TimeoutError, socket.gaierror, socket.timeout,
+                                  httplib2.ServerNotFoundError, TransportError))
+    
+    def _upload(self, file_path, folder_id=None, custom_name=None, upload_item=None, ledger_path=None):
+        """
+        Upload một file, ném exception nếu lỗi (để hàng đợi quyết định thử lại).
+        upload_item: mục của hàng đợi, dùng để lưu/khôi phục phiên resumable upload
+        ledger_path: file gốc ghi vào sổ upload khi file_path là bản nén tạm (upload_cache/)
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        
+        filename = custom_name or os.path.basename(file_path)
+        file_size = os.path.getsize(file_path)
+        local_md5 = hash_file(file_path, 'md5')  # mmap, không đọc cả file vào bộ nhớ
+        channel_name = upload_item['channel_name'] if upload_item else None
+        branch_name = upload_item['branch_name'] if upload_item else None
+        # Sổ upload luôn theo file gốc; MD5 bản nén đã gửi ghi riêng (uploaded_md5)
+        ledger_path = ledger_path or file_path
+        ledger_md5 = hash_file(ledger_path, 'md5') if ledger_path != file_path else local_md5
+        uploaded_md5 = local_md5 if ledger_path != file_path else None
+        
+        # Kiểm tra trùng: sổ ghi local trước, sau đó danh sách file của folder (tải một lần)
+        existing_id = self.ledger.find_uploaded(ledger_path, ledger_md5, folder_id, filename)
+        if existing_id:
+            self.log_message(f"⚠️ File đã tồn tại: {filename}")
+            return {'id': existing_id, 'name': filename, 'md5Checksum': local_md5, 'size': file_size,
+                    'skipped': True}  # Coi như thành công
+        
+        same_name = self._get_remote_listing(folder_id).get(filename, [])
+        for item in same_name:
+            if item.get('md5Checksum') == local_md5:
                 self.log_message(f"⚠️ File đã tồn tại: {filename}")
-                return True  # Coi như thành công
-            
-            # Chuẩn bị metadata
-            file_metadata = {'name': filename}
-            if folder_id:
-                file_metadata['parents'] = [folder_id]
-            
-            # Upload file
-            with open(file_path, 'rb') as f:
-                media = MediaIoBaseUpload(
-                    io.BytesIO(f.read()),
-                    mimetype='image/png',
-                    resumable=True
-                )
-            
-            file = self.service.files().create(
+                self.ledger.record_upload(ledger_path, ledger_md5, item['id'], folder_id,
+                                          item.get('md5Checksum'), filename, channel_name, branch_name,
+                                          uploaded_md5)
+                return dict(item, skipped=True)  # Coi như thành công
+        if same_name:
+            # Cùng tên nhưng khác nội dung -> vẫn upload, không bỏ mất ảnh mới
+            self.log_message(f"⚠️ Trên Drive đã có '{filename}' với nội dung khác, upload thêm bản mới")
+        
+        # Chuẩn bị metadata
+        file_metadata = {'name': filename}
+        if folder_id:
+            file_metadata['parents'] = [folder_id]
+        
+        # Upload file: đọc trực tiếp từ file theo từng chunk
+        mimetype = self.MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), 'application/octet-stream')
+        resumable = file_size > self.multipart_threshold_mb * 1024 * 1024
+        with open(file_path, 'rb') as f:
+            media = MediaIoBaseUpload(
+                f,
+                mimetype=mimetype,
+                chunksize=self.chunk_size,
+                resumable=resumable
+            )
+            request = self.service.files().create(
                 body=file_metadata,
                 media_body=media,
-                fields='id'
-            ).execute()
-            
-            file_id = file.get('id')
-            if file_id:
-                self.upload_stats['total_uploaded'] += 1
-                self.upload_stats['current_session'] += 1
-                self.upload_stats['last_upload_time'] = datetime.now()
-                self.log_message(f"✅ Đã upload: {filename}")
-                return True
+                fields='id, md5Checksum, size'
+            )
+            if resumable:
+                file = self._upload_chunks(request, file_path, file_size, upload_item, local_md5)
             else:
-                self.upload_stats['total_failed'] += 1
-                self.log_message(f"❌ Upload thất bại: {filename}")
-                return False
-                
+                # File nhỏ: một request multipart, không tốn thêm round trip mở phiên resumable
+                self.scheduler.throttle_bytes(file_size, getattr(self._thread_local, 'stop_event', None))
+                file = self.scheduler.call(request.execute)
+                self.metrics.count(METRIC_UPLOAD_BYTES, file_size)
+        
+        if self.chunk_callback:
+            self.chunk_callback(file_path, file_size, file_size)
+        
+        file_id = file.get('id')
+        if not file_id:
+            raise RuntimeError(f"Drive không trả về file ID cho {filename}")
+        
+        drive_md5 = file.get('md5Checksum')
+        if drive_md5 and drive_md5 != local_md5:
+            # Dữ liệu lên Drive bị hỏng: bỏ bản hỏng vào thùng rác, hàng đợi sẽ upload lại bằng phiên mới
+            # (phiên cũ đã xong, hỏi lại chỉ nhận về đúng bản hỏng này)
+            if upload_item and upload_item.get('id') is not None:
+                self.upload_queue.clear_session(upload_item['id'])
+            self.trash_files([file_id])
+            raise RuntimeError(f"MD5 trên Drive ({drive_md5}) khác file local ({local_md5}): {filename}")
+        
+        # Ghi sổ kèm md5Checksum của Drive để xác nhận file đã lên đủ
+        self.ledger.record_upload(ledger_path, ledger_md5, file_id, folder_id,
+                                  drive_md5, filename, channel_name, branch_name, uploaded_md5)
+        self._add_to_remote_listing(folder_id, filename, file)
+        self._record_result(True, file_size)
+        self.log_message(f"✅ Đã upload: {filename}")
+        return dict(file, name=filename, skipped=False)
+    
+    def trash_files(self, file_ids):
+        """Chuyển các file trên Drive vào thùng rác (một batch request). Trả về số file đã chuyển"""
+        batch = DriveBatch(self.service, self.scheduler)
+        for file_id in file_ids:
+            batch.add(file_id, lambda file_id=file_id: self.service.files().update(
+                fileId=file_id, body={'trashed': True}, fields='id'))
+        trashed = 0
+        for file_id, (response, error) in batch.execute().items():
+            if error:
+                self.log_message(f"⚠️ Không chuyển được file {file_id} vào thùng rác: {error}")
+            else:
+                trashed += 1
+                self._remove_from_remote_listing(file_id)
+        return trashed
+    
+    def _upload_chunks(self, request, file_path, file_size, upload_item=None, file_md5=None):
+        """
+        Gửi file theo từng chunk qua phiên resumable. Phiên, offset và MD5 file được lưu vào hàng đợi sau mỗi chunk,
+        lần sau (kể cả sau khi khởi động lại app) sẽ hỏi server offset rồi gửi tiếp từ đó.
+        File đã đổi nội dung (MD5 khác, kể cả cùng kích thước) thì mở phiên mới.
+        Dừng được giữa hai chunk khi stop_upload_worker được gọi.
+        """
+        item_id = upload_item['id'] if upload_item else None
+        if upload_item and upload_item.get('session_uri'):
+            if upload_item.get('session_size') == file_size and upload_item.get('session_md5') == file_md5:
+                file = self._resume_session(request, upload_item['session_uri'], file_path, file_size)
+                if file is not None:
+                    return file  # Server đã nhận đủ file từ lần trước
+            if not request.resumable_uri:
+                # Phiên hết hạn hoặc file đã thay đổi -> upload lại từ đầu
+                self.upload_queue.clear_session(item_id)
+        
+        stop_event = getattr(self._thread_local, 'stop_event', None)
+        file = None
+        while file is None:
+            if stop_event is not None and stop_event.is_set():
+                raise UploadCancelled(file_path)
+            self.scheduler.throttle_bytes(min(self.chunk_size, file_size - request.resumable_progress), stop_event)
+            sent_before = request.resumable_progress
+            status, file = self.scheduler.call(request.next_chunk)
+            self.metrics.count(METRIC_UPLOAD_BYTES,
+                               (status.resumable_progress if status else file_size) - sent_before)
+            if status:
+                if item_id is not None and request.resumable_uri:
+                    self.upload_queue.save_session(item_id, request.resumable_uri,
+                                                   status.resumable_progress, file_size, file_md5)
+                if self.chunk_callback:
+                    self.chunk_callback(file_path, status.resumable_progress, status.total_size)
+        return file
+    
+    def _resume_session(self, request, session_uri, file_path, file_size):
+        """
+        Hỏi server phiên resumable đã nhận bao nhiêu byte và đặt request gửi tiếp từ đó.
+        Trả về metadata file nếu server đã nhận đủ, None nếu cần gửi tiếp (hoặc phiên không còn dùng được).
+        """
+        def query():
+            resp, content = request.http.request(
+                session_uri, 'PUT', body='',
+                headers={'Content-Range': f'bytes */{file_size}', 'Content-Length': '0'})
+            status = int(resp.status)
+            if status in (429, 500, 502, 503, 504):
+                raise HttpError(resp, content, uri=session_uri)
+            return resp, content
+        
+        try:
+            resp, content = self.scheduler.call(query)
         except HttpError as e:
-            self.upload_stats['total_failed'] += 1
-            self.log_message(f"❌ Lỗi upload '{filename}': {e}")
+            self.log_message(f"⚠️ Không hỏi được phiên upload cũ, upload lại từ đầu: {e}")
+            return None
+        
+        status = int(resp.status)
+        if status in (200, 201):
+            return json.loads(content)
+        if status == 308:
+            # Range: bytes=0-N -> server đã có N+1 byte
+            received = resp.get('range')
+            offset = int(received.rsplit('-', 1)[1]) + 1 if received else 0
+            request.resumable_uri = session_uri
+            request.resumable_progress = offset
+            self.log_message(f"♻️ Upload tiếp {os.path.basename(file_path)} "
+                             f"từ {offset / (1024 * 1024):.1f}/{file_size / (1024 * 1024):.1f} MB")
+            return None
+        # 404/410: phiên đã hết hạn
+        return None
+    
+    def _get_remote_listing(self, folder_id, refresh=False):
+        """
+        Danh sách file trong folder trên Drive, gom theo tên: {tên: [{id, name, md5Checksum, size}]}.
+        Tải một lần cho mỗi folder (phân trang 1000 file/lần), các worker dùng chung.
+        refresh=True: tải lại từ Drive (đồng bộ thủ công)
+        """
+        key = folder_id or 'root'
+        if key in self._remote_listings and not refresh:
+            return self._remote_listings[key]
+        
+        with self._folder_lock(('listing', key)):
+            if key in self._remote_listings and not refresh:
+                return self._remote_listings[key]
+            
+            # Folder có trong index: lấy thay đổi mới nhất rồi đọc từ index, không liệt kê lại cả folder
+            if folder_id and self.refresh_drive_index(force=refresh):
+                listing = self.drive_index.listing(folder_id)
+                if listing is not None:
+                    self._remote_listings[key] = listing
+                    self._remote_listing_times[key] = time.time()
+                    return listing
+            
+            listing = {}
+            page_token = None
+            while True:
+                results = self.scheduler.call(self.service.files().list(
+                    q=f"'{key}' in parents and trashed=false",
+                    fields="nextPageToken, files(id, name, md5Checksum, size)",
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute)
+                for item in results.get('files', []):
+                    listing.setdefault(item['name'], []).append(item)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+            self._remote_listings[key] = listing
+            self._remote_listing_times[key] = time.time()
+            return listing
+    
+    def _add_to_remote_listing(self, folder_id, filename, file):
+        """Thêm file vừa upload vào danh sách đã tải của folder (và vào index)"""
+        if folder_id:
+            self.drive_index.add_file(dict(file, name=filename), folder_id)
+        listing = self._remote_listings.get(folder_id or 'root')
+        if listing is not None:
+            with self._folder_lock(('listing', folder_id or 'root')):
+                listing.setdefault(filename, []).append(
+                    {'id': file.get('id'), 'name': filename, 'md5Checksum': file.get('md5Checksum'),
+                     'size': file.get('size')})
+    
+    def _remove_from_remote_listing(self, file_id):
+        """Bỏ file đã xóa khỏi danh sách đã tải của các folder (và khỏi index) để kiểm tra trùng không dùng nhầm"""
+        self.drive_index.remove_file(file_id)
+        for key, listing in list(self._remote_listings.items()):
+            with self._folder_lock(('listing', key)):
+                for name, items in list(listing.items()):
+                    remaining = [item for item in items if item.get('id') != file_id]
+                    if len(remaining) != len(items):
+                        if remaining:
+                            listing[name] = remaining
+                        else:
+                            del listing[name]
+    
+    def add_to_upload_queue(self, file_path, channel_name, branch_name, custom_name=None, lane=LANE_LIVE):
+        """
+        Thêm file vào hàng đợi upload (lưu trên đĩa).
+        lane: LANE_LIVE cho ảnh vừa chụp, LANE_BACKFILL cho upload bù cả thư mục (nhường live đi trước)
+        """
+        self.upload_queue.put(file_path, channel_name, branch_name, custom_name, lane)
+    
+    def queue_capture_upload(self, file_path, channel_name, branch_name, custom_name=None):
+        """Đưa ảnh vừa chụp vào làn live qua bộ đệm (không chặn luồng chụp); worker tự khởi động khi cần"""
+        self.handoff.offer(file_path, channel_name, branch_name, custom_name, LANE_LIVE)
+    
+    def _on_handoff_enqueued(self):
+        """Có file mới vào hàng đợi từ bộ đệm (luồng nền): bật worker nếu đang dừng và đã xác thực"""
+        if not self.is_uploading and (self._credentials or not self.drive_enabled()):
+            self.start_upload_worker()
+    
+    def set_capture_active(self, active):
+        """
+        Báo đang chụp/đã chụp xong: trong lúc chụp, upload bị giới hạn capture_bandwidth_kbps
+        để không tranh mạng/USB/đĩa với luồng chụp; chụp xong thì bỏ giới hạn
+        """
+        self.capture_active = active
+        if active and not self.is_uploading and self._credentials:
+            # Sắp có ảnh cần upload: mở sẵn kết nối keep-alive để ảnh đầu tiên không chờ bắt tay TLS
+            missing = self.upload_workers - self.credential_manager.idle_connections()
+            if missing > 0:
+                self.credential_manager.prewarm(
+                    missing, (self.api_root_url or "https://www.googleapis.com/") + "drive/v3/about?fields=kind")
+        limit = self.capture_bandwidth_kbps * 1024 if active and self.capture_bandwidth_kbps else None
+        if limit == self.scheduler.bandwidth_limit:
+            return
+        self.scheduler.set_bandwidth_limit(limit)
+        if limit:
+            self.log_message(f"🐢 Đang chụp: giới hạn upload {self.capture_bandwidth_kbps} KB/s")
+        else:
+            self.log_message("🚀 Bỏ giới hạn băng thông upload")
+    
+    def resume_pending_uploads(self):
+        """Tiếp tục upload các file còn trong hàng đợi từ lần chạy trước (chụp lúc mất mạng, app bị tắt...)"""
+        pending = self.upload_queue.qsize()
+        if not pending or self.is_uploading:
             return False
-        except Exception as e:
-            self.upload_stats['total_failed'] += 1
-            self.log_message(f"❌ Lỗi không xác định upload '{filename}': {e}")
+        if self.drive_enabled() and not self._credentials and not os.path.exists(self.token_file):
+            self.log_message(f"⏳ Còn {pending} file chờ upload, cần xác thực Google Drive")
             return False
+        if self.recovered_uploads:
+            self.log_message(f"♻️ Khôi phục {self.recovered_uploads} file đang upload dở lần trước")
+            self.recovered_uploads = 0
+        self.log_message(f"📤 Tiếp tục upload {pending} file còn trong hàng đợi")
+        self.start_upload_worker()
+        return True
     
-    def add_to_upload_queue(self, file_path, channel_name, branch_name, custom_name=None):
-        """Thêm file vào hàng đợi upload"""
-        upload_item = {
-            'file_path': file_path,
-            'channel_name': channel_name,
-            'branch_name': branch_name,
-            'custom_name': custom_name,
-            'timestamp': datetime.now()
-        }
-        self.upload_queue.put(upload_item)
+    def retry_failed_uploads(self):
+        """Đưa các file đã hết số lần thử (dead-letter) về hàng đợi và upload lại"""
+        count = self.upload_queue.retry_failed()
+        if count:
+            self.log_message(f"♻️ Thử lại {count} file upload lỗi")
+            self.start_upload_worker()
+        return count
     
     def start_upload_worker(self):
-        """Bắt đầu worker thread để xử lý upload queue"""
+        """Bắt đầu các worker thread để xử lý upload queue song song"""
         if self.is_uploading:
             return
         
+        if self.drive_enabled():
+            # Xác thực một lần trước khi chia cho các worker
+            if not self._credentials:
+                try:
+                    self.authenticate()
+                except Exception as e:
+                    self.log_message(f"❌ Không thể xác thực Google Drive: {e}")
+                    return
+            
+            # Kiểm tra trước toàn bộ folder custom mapping trong một batch request
+            self._prevalidate_mapped_folders()
+            # Cập nhật index folder (lần đầu: duyệt cây, sau đó chỉ lấy thay đổi)
+            try:
+                self.refresh_drive_index()
+            except Exception as e:
+                self.log_message(f"⚠️ Chưa cập nhật được index folder: {e}")
+        
         self.is_uploading = True
-        self.upload_stats['current_session'] = 0
-        self.upload_thread = threading.Thread(target=self._upload_worker, daemon=True)
-        self.upload_thread.start()
-        self.log_message("🚀 Bắt đầu upload worker")
+        self._stop_event = threading.Event()
+        self.scheduler.set_max_concurrency(self.upload_workers)
+        self.credential_manager.pool_size = max(self.credential_manager.pool_size, self.upload_workers)
+        # Tải lại danh sách file trên Drive cho phiên mới (có thể đã thay đổi từ máy khác),
+        # trừ danh sách vừa tải lúc đồng bộ thư mục
+        now = time.time()
+        self._remote_listings = {key: listing for key, listing in self._remote_listings.items()
+                                 if now - self._remote_listing_times.get(key, 0) < self.LISTING_REUSE_SECONDS}
+        with self._stats_lock:
+            self.upload_stats['current_session'] = 0
+            self.session_bytes = 0
+            self.session_started_at = time.time()
+            self._active_workers = self.upload_workers
+        self.upload_threads = []
+        for _ in range(self.upload_workers):
+            thread = threading.Thread(target=self._upload_worker, args=(self._stop_event,), daemon=True)
+            thread.start()
+            self.upload_threads.append(thread)
+        self.log_message(f"🚀 Bắt đầu {self.upload_workers} upload worker")
     
     def stop_upload_worker(self):
-        """Dừng upload worker"""
+        """
+        Dừng các upload worker. Worker dừng sau chunk đang gửi; file dở dang được trả về hàng đợi
+        cùng phiên resumable nên không cần chờ lâu.
+        """
         self.is_uploading = False
-        if self.upload_thread and self.upload_thread.is_alive():
-            self.upload_thread.join(timeout=5)
+        self._stop_event.set()
+        deadline = time.time() + 1
+        for thread in self.upload_threads:
+            if thread.is_alive():
+                thread.join(timeout=max(0, deadline - time.time()))
+        self.upload_threads = []
         self.log_message("⏹ Đã dừng upload worker")
     
-    def _upload_worker(self):
-        """Worker thread xử lý upload queue"""
-        while self.is_uploading:
-            try:
-                # Lấy item từ queue với timeout
-                upload_item = self.upload_queue.get(timeout=1)
-                
-                # Xác thực nếu cần
-                if not self.service:
-                    if not self.authenticate():
-                        self.log_message("❌ Không thể xác thực Google Drive")
-                        continue
-                
-                # Tạo cấu trúc folder
-                folder_id = self.get_or_create_folder_structure(
-                    upload_item['channel_name'], 
-                    upload_item['branch_name']
-                )
-                
-                if folder_id:
-                    # Upload file
-                    success = self.upload_file(
-                        upload_item['file_path'],
-                        folder_id,
-                        upload_item['custom_name']
-                    )
-                    
-                    # Callback progress
-                    if self.progress_callback:
-                        self.progress_callback(success, upload_item)
-                else:
-                    self.log_message(f"❌ Không thể tạo folder cho {upload_item['channel_name']}/{upload_item['branch_name']}")
-                
-                self.upload_queue.task_done()
-                
-            except queue.Empty:
-                # Timeout - kiểm tra nếu queue rỗng thì dừng
-                if self.upload_queue.empty():
-                    self.log_message("📤 Queue rỗng, dừng upload worker")
+    def _upload_worker(self, stop_event):
+        """Worker thread xử lý upload queue (mỗi worker có service riêng)"""
+        self._thread_local.stop_event = stop_event
+        try:
+            self._init_thread_service()
+        except Exception as e:
+            self.log_message(f"❌ Không thể tạo kết nối Google Drive cho worker: {e}")
+        
+        while not stop_event.is_set():
+            # Lấy item từ queue với timeout
+            upload_item = self.upload_queue.claim(timeout=1)
+            if upload_item is None:
+                # Hết file chờ upload thì dừng; còn file đang chờ tới lượt thử lại thì tiếp tục đợi
+                if not self.upload_queue.has_pending():
                     break
                 continue
+            
+            try:
+                # Chờ tới lượt theo giới hạn upload đồng thời hiện tại
+                with self.scheduler.slot(stop_event.is_set):
+                    if is_archive_job(upload_item['file_path']):
+                        self._process_archive_item(upload_item)
+                    else:
+                        self._put_to_backends(upload_item)
+                self.upload_queue.complete(upload_item['id'])
+                success = True
+            except UploadCancelled:
+                # Dừng giữa chừng: trả về hàng đợi, lần sau upload tiếp từ offset đã lưu
+                self.upload_queue.release(upload_item['id'])
+                break
+            except FileNotFoundError:
+                # File local đã mất -> không thể thử lại
+                self.upload_queue.dead_letter(upload_item['id'], "File không tồn tại")
+                self._abandon_upload_item(upload_item)
+                self.log_message(f"❌ File không tồn tại: {upload_item['file_path']}")
+                success = False
             except Exception as e:
-                self.log_message(f"❌ Lỗi trong upload worker: {e}")
+                success = self._handle_upload_error(upload_item, e)
+                if success is None:
+                    continue  # Đã hẹn thử lại
+            
+            # Callback progress (chỉ khi đã có kết quả cuối cùng)
+            if self.progress_callback:
+                self.progress_callback(success, upload_item)
         
-        # Đặt flag về False khi worker kết thúc
+        # Service của luồng này không dùng nữa, kết nối về pool
+        self._release_thread_service()
+        
+        with self._stats_lock:
+            if stop_event is not self._stop_event:
+                return  # Nhóm worker cũ đã bị thay bằng nhóm mới
+            self._active_workers -= 1
+            last_worker = self._active_workers <= 0
+        if not last_worker:
+            return
+        
+        # Worker cuối cùng: đặt flag về False và báo hoàn thành
         self.is_uploading = False
-        self.log_message("📤 Upload worker đã hoàn thành")
+        if not stop_event.is_set() and self.upload_queue.has_pending():
+            # Bộ đệm handoff vừa đưa file vào sau lần kiểm tra has_pending cuối cùng nhưng trước khi tắt cờ:
+            # nó thấy worker còn chạy nên không bật lại -> bật nhóm worker mới, nhóm đó sẽ báo hoàn thành
+            self._on_handoff_enqueued()
+            if self.is_uploading:
+                return
+        self.log_message(f"📤 Upload worker đã hoàn thành | {self.format_throughput()}")
+        lanes = self.upload_queue.lane_status()
+        if lanes[LANE_BACKFILL]['claimed']:
+            self.log_message(f"⏱️ Thời gian chờ trung bình: ảnh vừa chụp {lanes[LANE_LIVE]['avg_wait']:.1f}s, "
+                             f"upload bù {lanes[LANE_BACKFILL]['avg_wait']:.1f}s")
+        if self._upload_transcoder is not None:
+            self.log_message(f"🗜️ Nén khi upload: {self._upload_transcoder.format_stats()}")
+        if len(self.storage_backends) > 1:
+            for backend in self.storage_backends:
+                self.log_message(f"💾 {backend.describe()}: {backend.format_stats()}")
         
         # Callback khi hoàn thành
         if self.completion_callback:
             self.completion_callback(self.upload_stats)
     
-    def upload_folder_contents(self, folder_path, channel_name, branch_name, file_pattern=None):
-        """Upload toàn bộ nội dung của một folder"""
-        if not os.path.exists(folder_path):
-            self.log_message(f"❌ Folder không tồn tại: {folder_path}")
+    def _process_upload_item(self, upload_item):
+        """Upload một mục của hàng đợi, ném exception nếu lỗi"""
+        if not self.service:
+            raise RuntimeError("Không thể xác thực Google Drive")
+        
+        # Tạo cấu trúc folder
+        folder_id = self.get_or_create_folder_structure(
+            upload_item['channel_name'], 
+            upload_item['branch_name']
+        )
+        if not folder_id:
+            raise RuntimeError(f"Không thể tạo folder cho {upload_item['channel_name']}/{upload_item['branch_name']}")
+        
+        # Nếu ảnh đã được nén thì upload bản nhỏ nhất; đuôi tên file luôn theo file thật gửi đi
+        file_path = smallest_variant(upload_item['file_path'])
+        custom_name = upload_item['custom_name']
+        if custom_name:
+            custom_name = os.path.splitext(custom_name)[0] + os.path.splitext(file_path)[1]
+        
+        transcoder = self._get_upload_transcoder()
+        if transcoder is None:
+            return self._upload(file_path, folder_id, custom_name, upload_item)
+        
+        # Nén bản gửi lên Drive (file gốc giữ nguyên), tên trên Drive đổi theo đuôi mới
+        prepared = transcoder.prepare(file_path)
+        upload_name = self.upload_name(file_path, custom_name) if prepared['status'] == 'ok' else custom_name
+        file = self._upload(prepared['dst'], folder_id, upload_name, upload_item, ledger_path=file_path)
+        transcoder.release(prepared)
+        return file
+    
+    def _abandon_upload_item(self, upload_item):
+        """
+        Mục upload bị bỏ (dead-letter): xóa bản nén còn lại trong upload_cache/;
+        archive của phiên chụp thì chuyển các ảnh sang upload riêng lẻ
+        """
+        if is_archive_job(upload_item['file_path']):
+            self._fall_back_to_frames(upload_item)
+            return
+        transcoder = self._get_upload_transcoder()
+        if transcoder is not None:
+            transcoder.discard(smallest_variant(upload_item['file_path']))
+    
+    # ----- Nơi lưu (Drive, local/NAS) -----
+    
+    def drive_enabled(self):
+        """Google Drive là một trong các nơi lưu"""
+        return any(isinstance(backend, DriveBackend) for backend in self.storage_backends)
+    
+    def can_upload(self):
+        """Có ít nhất một nơi lưu dùng được ngay (để tự động upload ảnh vừa chụp)"""
+        return any(backend.is_ready() for backend in self.storage_backends)
+    
+    def set_storage_backends(self, backends):
+        """Đổi danh sách nơi lưu (Drive luôn được xử lý trong luồng worker vì cần service riêng)"""
+        self.storage_backends = sorted(backends, key=lambda backend: not isinstance(backend, DriveBackend))
+    
+    def _put_to_backends(self, upload_item):
+        """
+        Gửi một file tới mọi nơi lưu cùng lúc: Drive chạy trong luồng worker, các nơi khác trong thread pool.
+        Nơi lưu đã xong được ghi vào hàng đợi, lần thử lại chỉ gửi tới nơi còn lỗi
+        """
+        done = set(upload_item.get('backends_done') or ())
+        targets = [backend for backend in self.storage_backends if backend.name not in done]
+        if not targets:
             return
+        started = time.perf_counter()
+        if len(targets) > 1 and self._backend_executor is None:
+            with self._stats_lock:
+                if self._backend_executor is None:
+                    self._backend_executor = ThreadPoolExecutor(max_workers=max(4, self.upload_workers * 2),
+                                                                thread_name_prefix="storage")
+        futures = [(backend, self._backend_executor.submit(self._put_to_backend, backend, upload_item))
+                   for backend in targets[1:]]
+        errors, sizes = [], []
+        for backend, future in [(targets[0], None)] + futures:
+            try:
+                if future is None:
+                    size = self._put_to_backend(backend, upload_item)
+                else:
+                    size = future.result()
+                done.add(backend.name)
+                sizes.append(size)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            if len(targets) > 1 and upload_item.get('id') is not None:
+                self.upload_queue.set_backends_done(upload_item['id'], done)
+            raise errors[0]
+        self.metrics.record(METRIC_UPLOAD_LATENCY, time.perf_counter() - started)
+        if not self.drive_enabled():
+            # Thống kê phiên upload do Drive ghi; không dùng Drive thì tính ở đây. Kích thước lấy từ kết quả
+            # của nơi lưu: file gốc có thể đã bị thay bằng bản nén hoặc bị dọn ổ đĩa ngay sau khi lưu xong
+            self._record_result(True, max(sizes, default=0))
+    
+    def _put_to_backend(self, backend, upload_item):
+        """Gửi file tới một nơi lưu, ghi thống kê của nơi lưu đó. Trả về số byte đã lưu"""
+        started = time.perf_counter()
+        file_path = upload_item['file_path']
+        try:
+            source_size = os.path.getsize(smallest_variant(file_path))  # Đo trước khi file có thể bị dọn
+        except OSError:
+            source_size = 0
+        try:
+            result = backend.put(file_path, upload_item['channel_name'], upload_item['branch_name'],
+                                 upload_item['custom_name'], upload_item)
+        except Exception as e:
+            backend.record(None, 0, time.perf_counter() - started, e)
+            if len(self.storage_backends) > 1 and not isinstance(e, UploadCancelled):
+                self.log_message(f"⚠️ {backend.name}: lỗi lưu {os.path.basename(file_path)}: {e}")
+            raise
+        size = result.get('size') if result else None
+        size = int(size) if size is not None else source_size
+        backend.record(result, size, time.perf_counter() - started)
+        return size
+    
+    def get_backend_stats(self):
+        """Thống kê theo nơi lưu: {tên: {stored, skipped, failed, bytes, seconds, mb_per_second}}"""
+        return {backend.name: backend.get_stats() for backend in self.storage_backends}
+    
+    def _get_upload_transcoder(self):
+        """Bộ nén lúc upload (tạo khi dùng lần đầu), None nếu không bật"""
+        if self.upload_transcode_format not in UPLOAD_FORMATS:
+            return None
+        transcoder = self._upload_transcoder
+        if (transcoder is None or transcoder.mode != self.upload_transcode_format
+                or transcoder.quality != self.upload_transcode_quality
+                or transcoder.max_width != self.upload_max_width):
+            with self._stats_lock:
+                if self._upload_transcoder is transcoder:
+                    if transcoder is not None:
+                        transcoder.shutdown(wait=False)
+                    self._upload_transcoder = UploadTranscoder(
+                        self.upload_transcode_format, self.upload_transcode_quality, self.upload_max_width,
+                        log_callback=self.log_callback)
+                transcoder = self._upload_transcoder
+        return transcoder
+    
+    def upload_name(self, file_path, custom_name=None):
+        """Tên file trên Drive (đổi đuôi nếu ảnh được nén sang định dạng khác lúc upload)"""
+        name = custom_name or os.path.basename(file_path)
+        if self.upload_transcode_format in UPLOAD_FORMATS:
+            ext = UPLOAD_FORMATS[self.upload_transcode_format][0]
+            if ext:
+                name = os.path.splitext(name)[0] + ext
+        return name
+    
+    def _handle_upload_error(self, upload_item, error):
+        """
+        Ghi lỗi vào hàng đợi: hẹn thử lại hoặc chuyển sang dead-letter.
+        Trả về None nếu sẽ thử lại, False nếu đã bỏ cuộc.
+        """
+        filename = os.path.basename(upload_item['file_path'])
+        self.metrics.count(METRIC_UPLOAD_ERRORS)
+        status = error_status(error)
+        if status in (400, 403, 413) and not is_retryable(error):
+            # Request sai, hết dung lượng Drive, không có quyền... -> thử lại cũng không được
+            self.upload_queue.dead_letter(upload_item['id'], error)
+            self.upload_queue.clear_session(upload_item['id'])
+            self._abandon_upload_item(upload_item)
+            self._record_result(False)
+            self.log_message(f"❌ Upload thất bại (không thể thử lại): {filename} ({error})")
+            return False
         
-        files_added = 0
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            
-            # Kiểm tra pattern nếu có
-            if file_pattern and not file_pattern.match(filename):
-                continue
-            
-            if os.path.isfile(file_path) and filename.lower().endswith('.png'):
-                self.add_to_upload_queue(file_path, channel_name, branch_name)
-                files_added += 1
+        offline = self._is_offline_error(error)
+        state = self.upload_queue.fail(upload_item['id'], error, count_attempt=not offline,
+                                       retry_after=retry_after_seconds(error))
+        if state == STATE_FAILED:
+            self.upload_queue.clear_session(upload_item['id'])
+            self._abandon_upload_item(upload_item)
+            self._record_result(False)
+            self.log_message(f"❌ Upload thất bại sau {upload_item['attempts'] + 1} lần thử: {filename} ({error})")
+            return False
+        self.metrics.count(METRIC_UPLOAD_RETRIES)
+        if offline:
+            self.log_message(f"📴 Mất kết nối, sẽ upload lại khi có mạng: {filename}")
+        else:
+            self.log_message(f"⚠️ Lỗi upload '{filename}' (lần {upload_item['attempts'] + 1}), sẽ thử lại: {error}")
+        return None
+    
+    def _get_delta_sync(self):
+        if self._delta_sync is None:
+            self._delta_sync = DeltaSync(self)
+        return self._delta_sync
+    
+    def plan_folder_sync(self, folder_path, channel_name, branch_name, file_pattern=None):
+        """
+        So sánh thư mục local với folder trên Drive (dry-run, không upload).
+        Trả về SyncPlan (file mới/đã đổi/đã có, số byte), hoặc None nếu folder không tồn tại
+        """
+        if not os.path.exists(folder_path):
+            self.log_message(f"❌ Folder không tồn tại: {folder_path}")
+            return None
+        return self._get_delta_sync().plan(folder_path, channel_name, branch_name, file_pattern)
+    
+    def upload_folder_contents(self, folder_path, channel_name, branch_name, file_pattern=None, plan=None):
+        """
+        Đồng bộ một folder: chỉ đưa vào hàng đợi file chưa có hoặc đã thay đổi trên Drive.
+        plan: kế hoạch đã lập bằng plan_folder_sync (nếu không có thì lập mới)
+        """
+        if plan is None:
+            plan = self.plan_folder_sync(folder_path, channel_name, branch_name, file_pattern)
+            if plan is None:
+                return 0
+            self.log_message(plan.summary())
         
+        files_added = self._get_delta_sync().apply(plan, channel_name, branch_name)
         self.log_message(f"📤 Đã thêm {files_added} file vào hàng đợi upload")
         return files_added
     
+    def is_archive_branch(self, branch_name):
+        """Chi nhánh này upload cả phiên thành một archive"""
+        return branch_name in self.archive_branches
+    
+    def queue_session_archive(self, files, channel_name, branch_name, archive_format=None):
+        """
+        Đưa ảnh của một phiên chụp vào hàng đợi upload dưới dạng một archive tar/zip (gọi khi phiên chụp kết thúc).
+        Archive được ghi thành file mô tả trong archive_job_dir và upload như mọi mục khác của hàng đợi:
+        lưu phiên resumable, thử lại khi lỗi, upload tiếp sau khi khởi động lại app.
+        Trả về ID mục trong hàng đợi, hoặc None nếu không có ảnh
+        """
+        archive_format = archive_format or self.archive_format
+        files = [path for path in files if os.path.isfile(path)]
+        if not files:
+            self.log_message("⚠️ Không có ảnh nào để đóng gói")
+            return None
+        if not self.drive_enabled():
+            # Archive chỉ upload lên Drive; không dùng Drive thì lưu từng ảnh như bình thường
+            self.upload_queue.put_many([(path, channel_name, branch_name, None, LANE_LIVE) for path in files])
+            self._on_handoff_enqueued()
+            return None
+        archive_name = f"{branch_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{archive_format}"
+        job_path = write_archive_job(self.archive_job_dir, files, archive_format, archive_name,
+                                     channel_name, branch_name)
+        item_id = self.upload_queue.put(job_path, channel_name, branch_name, archive_name, LANE_LIVE)
+        self.log_message(f"📦 Đã đưa archive {archive_name} ({len(files)} ảnh) vào hàng đợi upload")
+        self._on_handoff_enqueued()
+        return item_id
+    
+    def _process_archive_item(self, upload_item):
+        """
+        Đóng gói các ảnh của một phiên chụp thành một file tar/zip (tạo dần khi đọc, không ghi file tạm)
+        và upload bằng một phiên resumable lưu trong hàng đợi. Vị trí từng ảnh được ghi vào archive_index.db.
+        Ném exception nếu lỗi (hàng đợi hẹn thử lại)
+        """
+        if not self.service:
+            raise RuntimeError("Không thể xác thực Google Drive")
+        job_path = upload_item['file_path']
+        job = read_archive_job(job_path)
+        files = [path for path in job['files'] if os.path.isfile(path)]
+        if not files:
+            raise FileNotFoundError(job_path)
+        channel_name, branch_name = upload_item['channel_name'], upload_item['branch_name']
+        archive_name = job['archive_name']
+        archive = SessionArchive(files, job['format'], {'channel': channel_name, 'branch': branch_name},
+                                 created_at=job['created_at'])
+        folder_id = self.get_or_create_folder_structure(channel_name, branch_name)
+        if not folder_id:
+            raise RuntimeError(f"Không thể tạo folder cho {channel_name}/{branch_name}")
+        self.log_message(f"📦 Upload archive {archive_name}: {len(archive.frames)} ảnh, "
+                         f"{archive.size / (1024 * 1024):.1f} MB")
+        
+        file_metadata = {'name': archive_name, 'parents': [folder_id]}
+        stream = archive.open()
+        try:
+            media = MediaIoBaseUpload(stream, mimetype=archive.mimetype,
+                                      chunksize=self.chunk_size, resumable=True)
+            request = self.service.files().create(body=file_metadata, media_body=media,
+                                                  fields='id, md5Checksum, size')
+            # Dấu vân tay của manifest thay cho MD5 file: ảnh đổi thì không gửi tiếp phiên cũ
+            file = self._upload_chunks(request, archive_name, archive.size, upload_item, archive.fingerprint())
+            archive_md5 = stream.md5
+        finally:
+            stream.close()
+        
+        file_id = file.get('id')
+        if not file_id:
+            raise RuntimeError(f"Drive không trả về file ID cho {archive_name}")
+        if archive_md5 is None:
+            archive_md5 = archive.compute_md5()  # Upload tiếp từ giữa phiên: stream chưa hash đủ
+        drive_md5 = file.get('md5Checksum')
+        verified = archive_md5 is not None and drive_md5 == archive_md5
+        if archive_md5 and drive_md5 and not verified:
+            self.log_message(f"⚠️ MD5 archive trên Drive khác bản local: {archive_name}")
+        
+        self.archive_index.record(archive, archive_name, file_id, folder_id, archive_md5, drive_md5,
+                                  channel_name, branch_name)
+        if verified:
+            # Archive đã lên đủ -> từng ảnh bên trong coi như đã upload (cho phép dọn ổ đĩa)
+            for frame in archive.frames:
+                self.ledger.record_upload(frame['local_path'], frame['md5'], file_id, folder_id,
+                                          frame['md5'], f"{archive_name}/{frame['name']}",
+                                          channel_name, branch_name)
+        self._add_to_remote_listing(folder_id, archive_name, file)
+        self._record_result(True, archive.size)
+        self._remove_archive_job(job_path)
+        self.log_message(f"✅ Đã upload archive: {archive_name}")
+        return file
+    
+    def _fall_back_to_frames(self, upload_item):
+        """Archive bị bỏ (dead-letter): đưa từng ảnh của phiên vào hàng đợi để không ảnh nào bị bỏ lại"""
+        job_path = upload_item['file_path']
+        try:
+            job = read_archive_job(job_path)
+        except (OSError, ValueError) as e:
+            self.log_message(f"❌ Không đọc được danh sách ảnh của archive {os.path.basename(job_path)}: {e}")
+            return 0
+        items = [(path, upload_item['channel_name'], upload_item['branch_name'], None, LANE_BACKFILL)
+                 for path in job['files'] if os.path.isfile(path)]
+        added = self.upload_queue.put_many(items)
+        # Các ảnh giờ được upload riêng lẻ: bỏ mục archive để "thử lại" không upload trùng
+        self.upload_queue.complete(upload_item['id'])
+        self._remove_archive_job(job_path)
+        self.log_message(f"📤 Upload archive {job['archive_name']} thất bại, chuyển {added} ảnh sang upload riêng lẻ")
+        return added
+    
+    def _remove_archive_job(self, job_path):
+        try:
+            os.remove(job_path)
+        except OSError:
+            pass
+    
+    def fetch_archived_frame(self, name_or_path, dest_path):
+        """
+        Tải riêng một ảnh nằm trong archive trên Drive (request Range, không tải cả archive).
+        Trả về True nếu tải được và đúng MD5
+        """
+        locations = self.archive_index.locate(name_or_path)
+        if not locations:
+            self.log_message(f"❌ Không tìm thấy ảnh trong archive nào: {name_or_path}")
+            return False
+        location = locations[0]
+        start, end = location['data_offset'], location['data_offset'] + location['size'] - 1
+        try:
+            request = self.service.files().get_media(fileId=location['drive_file_id'])
+            request.headers['Range'] = f"bytes={start}-{end}"
+            data = self.scheduler.call(request.execute)
+        except Exception as e:
+            self.log_message(f"❌ Lỗi tải ảnh từ archive {location['archive_name']}: {e}")
+            return False
+        if hashlib.md5(data).hexdigest() != location['md5']:
+            self.log_message(f"❌ Ảnh tải từ archive sai MD5: {location['name']}")
+            return False
+        with open(dest_path, 'wb') as f:
+            f.write(data)
+        self.log_message(f"📥 Đã tải {location['name']} từ {location['archive_name']}")
+        return True
+    
+    def verify_uploads(self, base_dir=None, requeue=True, reupload_missing=False):
+        """
+        Kiểm tra các file đã upload với md5Checksum/size trên Drive, đưa file hỏng/đã sửa vào hàng đợi
+        (file mất trên Drive chỉ upload lại khi reupload_missing=True). Trả về VerificationReport (theo chi nhánh)
+        """
+        if self._verifier is None:
+            self._verifier = UploadVerifier(self)
+        report = self._verifier.verify(base_dir, requeue, reupload_missing)
+        if report.requeued:
+            self.start_upload_worker()
+        return report
+    
+    def get_throughput(self):
+        """Tốc độ upload của phiên hiện tại: (file/s, MB/s)"""
+        with self._stats_lock:
+            files = self.upload_stats['current_session']
+            size = self.session_bytes
+            started_at = self.session_started_at
+        elapsed = time.time() - started_at if started_at else 0
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return files / elapsed, size / (1024 * 1024) / elapsed
+    
+    def format_throughput(self):
+        """Chuỗi tốc độ upload để hiển thị"""
+        files_per_second, mb_per_second = self.get_throughput()
+        return f"{files_per_second:.2f} file/s, {mb_per_second:.2f} MB/s ({self.upload_workers} worker)"
+    
     def get_upload_status(self):
         """Lấy trạng thái upload"""
+        files_per_second, mb_per_second = self.get_throughput()
+        with self._stats_lock:
+            stats = self.upload_stats.copy()
+            active_workers = self._active_workers if self.is_uploading else 0
+        counts = self.upload_queue.counts()
+        buffered, spooled = self.handoff.pending()
         return {
             'is_uploading': self.is_uploading,
-            'queue_size': self.upload_queue.qsize(),
-            'stats': self.upload_stats.copy()
+            'queue_size': counts['pending'] + counts['in_flight'] + buffered + spooled,
+            'failed_count': counts[STATE_FAILED],
+            'stats': stats,
+            'active_workers': active_workers,
+            'files_per_second': files_per_second,
+            'mb_per_second': mb_per_second,
+            'scheduler': self.scheduler.get_status(),
+            'lanes': self.upload_queue.lane_status(),
+            'handoff': {'buffered': buffered, 'spooled': spooled},
+            'backends': self.get_backend_stats(),
+            'auth': dict(self.credential_manager.stats, idle_connections=self.credential_manager.idle_connections()),
+            'transcode': self._upload_transcoder.get_stats() if self._upload_transcoder else None
         }
     
     def reset_upload_stats(self):
@@ -395,7 +1491,8 @@ class GoogleDriveUploader:
     
     def configure_upload(self, auto_upload=None, create_date_folders=None, 
                         create_branch_folders=None, create_channel_folders=None,
-                        root_folder_name=None, use_custom_mapping=None, use_root_folder_id=None):
+                        root_folder_name=None, use_custom_mapping=None, use_root_folder_id=None,
+                        upload_workers=None):
         """Cấu hình các tùy chọn upload"""
         if auto_upload is not None:
             self.auto_upload = auto_upload
@@ -413,6 +1510,8 @@ class GoogleDriveUploader:
         if use_root_folder_id is not None:
             self.use_root_folder_id = use_root_folder_id
             self.root_folder_id = None  # Reset để tạo lại folder
+        if upload_workers is not None:
+            self.upload_workers = max(1, int(upload_workers))  # Áp dụng từ lần upload tiếp theo
     
     def set_custom_folder_mapping(self, mapping_dict):
         """
@@ -436,7 +1535,7 @@ class GoogleDriveUploader:
     def get_folder_id_by_name(self, folder_name, parent_id=None):
         """Tìm folder ID theo tên"""
         try:
-            query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+            query = f"name='{escape_query_value(folder_name)}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
             if parent_id:
                 query += f" and parents in '{parent_id}'"
             
@@ -462,35 +1561,27 @@ class GoogleDriveUploader:
             parent_id = parent_folder_id
         else:
             # Sử dụng root folder đã được thiết lập
-            if not self.root_folder_id:
-                if self.use_root_folder_id:
-                    self.root_folder_id = self.root_folder_name
-                    if not self._check_folder_exists(self.root_folder_id):
-                        self.log_message(f"❌ Root folder ID không hợp lệ: {self.root_folder_id}")
-                        return {}
-                else:
-                    self.root_folder_id = self.create_folder(self.root_folder_name)
-                    if not self.root_folder_id:
-                        return {}
+            with self._folder_lock('root'):
+                if not self._resolve_root_folder():
+                    return {}
             parent_id = self.root_folder_id
         
         self.log_message(f"🔍 Tìm folder chi nhánh trong parent folder ID: {parent_id}")
         
+        # Tìm tất cả folder trong một batch request, tạo các folder còn thiếu trong batch thứ hai
+        found = self.find_folders_by_name(branch_folder_names.values(), parent_id)
+        missing = [name for name, folder_id in found.items() if not folder_id]
+        created = self.create_folders(missing, parent_id) if missing else {}
+        
         for branch_code, folder_name in branch_folder_names.items():
-            # Tìm folder theo tên trong parent folder
-            folder_id = self.get_folder_id_by_name(folder_name, parent_id)
-            
-            if folder_id:
-                mapping[branch_code] = folder_id
-                self.log_message(f"✅ Tìm thấy {branch_code} -> {folder_name} (ID: {folder_id})")
+            if found.get(folder_name):
+                mapping[branch_code] = found[folder_name]
+                self.log_message(f"✅ Tìm thấy {branch_code} -> {folder_name} (ID: {found[folder_name]})")
+            elif created.get(folder_name):
+                mapping[branch_code] = created[folder_name]
+                self.log_message(f"➕ Tạo mới {branch_code} -> {folder_name} (ID: {created[folder_name]})")
             else:
-                # Tạo folder mới nếu không tìm thấy
-                folder_id = self.create_folder(folder_name, parent_id)
-                if folder_id:
-                    mapping[branch_code] = folder_id
-                    self.log_message(f"➕ Tạo mới {branch_code} -> {folder_name} (ID: {folder_id})")
-                else:
-                    self.log_message(f"❌ Không thể tạo folder cho {branch_code}: {folder_name}")
+                self.log_message(f"❌ Không thể tạo folder cho {branch_code}: {folder_name}")
         
         if mapping:
             self.set_custom_folder_mapping(mapping)
@@ -509,6 +1600,18 @@ class GoogleDriveUploader:
             'use_root_folder_id': self.use_root_folder_id,
             'use_custom_mapping': self.use_custom_mapping,
             'custom_folder_mapping': self.custom_folder_mapping,
+            'upload_workers': self.upload_workers,
+            'chunk_size_mb': self.chunk_size_mb,
+            'multipart_threshold_mb': self.multipart_threshold_mb,
+            'requests_per_second': self.scheduler.requests_per_second,
+            'archive_branches': self.archive_branches,
+            'archive_format': self.archive_format,
+            'upload_transcode_format': self.upload_transcode_format,
+            'upload_transcode_quality': self.upload_transcode_quality,
+            'upload_max_width': self.upload_max_width,
+            'capture_bandwidth_kbps': self.capture_bandwidth_kbps,
+            'handoff_buffer_size': self.handoff.max_items,
+            'storage_backends': [backend.to_config() for backend in self.storage_backends],
             'upload_stats': self.upload_stats
         }
         
@@ -526,6 +1629,10 @@ class GoogleDriveUploader:
                 with open(config_file, 'r', encoding='utf-8') as f:
                     config = json.load(f)
                 
+                # Cache folder nằm cạnh file cấu hình
+                config_dir = os.path.dirname(os.path.abspath(config_file))
+                self.folder_cache.load(os.path.join(config_dir, "drive_folder_cache.json"))
+                
                 self.auto_upload = config.get('auto_upload', False)
                 self.create_date_folders = config.get('create_date_folders', True)
                 self.create_branch_folders = config.get('create_branch_folders', True)
@@ -534,6 +1641,27 @@ class GoogleDriveUploader:
                 self.use_root_folder_id = config.get('use_root_folder_id', False)
                 self.use_custom_mapping = config.get('use_custom_mapping', False)
                 self.custom_folder_mapping = config.get('custom_folder_mapping', {})
+                self.upload_workers = max(1, int(config.get('upload_workers', 4)))
+                self.chunk_size_mb = float(config.get('chunk_size_mb', 8))
+                self.multipart_threshold_mb = float(config.get('multipart_threshold_mb', 5))
+                self.scheduler.requests_per_second = float(config.get('requests_per_second', 10.0))
+                self.archive_branches = list(config.get('archive_branches', []))
+                archive_format = config.get('archive_format', 'tar')
+                self.archive_format = archive_format if archive_format in ARCHIVE_FORMATS else 'tar'
+                upload_format = config.get('upload_transcode_format')
+                self.upload_transcode_format = upload_format if upload_format in UPLOAD_FORMATS else None
+                self.upload_transcode_quality = int(config.get('upload_transcode_quality', 80))
+                max_width = config.get('upload_max_width')
+                self.upload_max_width = int(max_width) if max_width else None
+                self.capture_bandwidth_kbps = max(0, int(config.get('capture_bandwidth_kbps', 0)))
+                self.handoff.max_items = max(1, int(config.get('handoff_buffer_size', 256)))
+                backend_configs = config.get('storage_backends')
+                if backend_configs:
+                    try:
+                        self.set_storage_backends([create_backend(item, self) for item in backend_configs])
+                        self.log_message("💾 Nơi lưu: " + ", ".join(backend.describe() for backend in self.storage_backends))
+                    except ValueError as e:
+                        self.log_message(f"❌ Cấu hình nơi lưu không hợp lệ, chỉ dùng Google Drive: {e}")
                 
                 # Load stats nhưng reset current_session
                 saved_stats = config.get('upload_stats', {})
@@ -558,21 +1686,37 @@ class GoogleDriveUploader:
         
         self.log_message("🔍 DEBUG: Kiểm tra cấu trúc folder...")
         
-        # Kiểm tra root folder
-        if self.use_root_folder_id:
-            root_id = self.root_folder_name
+        # Kiểm tra root folder và các folder custom mapping trong cùng một batch request
+        root_id = self.root_folder_name if self.use_root_folder_id else None
+        mapping = self.custom_folder_mapping if self.use_custom_mapping else {}
+        folder_ids = ([root_id] if root_id else []) + list(mapping.values())
+        try:
+            # Folder có trong index (vừa lấy thay đổi từ Drive) không cần gọi API
+            folders = {}
+            if self.refresh_drive_index(force=True):
+                for folder_id in folder_ids:
+                    if self.drive_index.is_covered(folder_id) and self.drive_index.get(folder_id):
+                        folders[folder_id] = (self.drive_index.get(folder_id), None)
+            missing = [folder_id for folder_id in folder_ids if folder_id not in folders]
+            if missing:
+                folders.update(self.get_folders_info(missing))
+        except Exception as e:
+            self.log_message(f"❌ Lỗi kiểm tra folder: {e}")
+            return
+        
+        if root_id:
             self.log_message(f"📁 Root folder ID: {root_id}")
-            
-            if self._check_folder_exists(root_id):
+            folder_info, error = folders.get(root_id, (None, None))
+            if folder_info:
+                self.log_message(f"✅ Root folder tồn tại: {folder_info.get('name', 'Unknown')} (ID: {root_id})")
                 try:
-                    folder_info = self.service.files().get(fileId=root_id, fields="name").execute()
-                    folder_name = folder_info.get('name', 'Unknown')
-                    self.log_message(f"✅ Root folder tồn tại: {folder_name} (ID: {root_id})")
-                    
-                    # Liệt kê các folder con
-                    query = f"parents in '{root_id}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-                    results = self.service.files().list(q=query, fields="files(id, name)").execute()
-                    items = results.get('files', [])
+                    # Liệt kê các folder con (từ index nếu có)
+                    if self.drive_index.is_covered(root_id):
+                        items = self.drive_index.children(root_id, folders_only=True)
+                    else:
+                        query = f"parents in '{root_id}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+                        results = self.scheduler.call(self.service.files().list(q=query, fields="files(id, name)").execute)
+                        items = results.get('files', [])
                     
                     self.log_message(f"📂 Tìm thấy {len(items)} folder con:")
                     for item in items:
@@ -581,22 +1725,18 @@ class GoogleDriveUploader:
                 except Exception as e:
                     self.log_message(f"❌ Lỗi lấy thông tin root folder: {e}")
             else:
-                self.log_message(f"❌ Root folder ID không tồn tại: {root_id}")
+                self.log_message(f"❌ Root folder ID không tồn tại: {root_id} ({error})")
                 self.log_message("💡 Hãy kiểm tra lại ID hoặc quyền truy cập folder")
         
         # Kiểm tra custom mapping
         if self.use_custom_mapping:
             self.log_message("🗂️ Kiểm tra custom mapping:")
-            for branch_code, folder_id in self.custom_folder_mapping.items():
-                if self._check_folder_exists(folder_id):
-                    try:
-                        folder_info = self.service.files().get(fileId=folder_id, fields="name").execute()
-                        folder_name = folder_info.get('name', 'Unknown')
-                        self.log_message(f"  ✅ {branch_code}: {folder_name} (ID: {folder_id})")
-                    except:
-                        self.log_message(f"  ❌ {branch_code}: Lỗi lấy thông tin (ID: {folder_id})")
+            for branch_code, folder_id in mapping.items():
+                folder_info, error = folders.get(folder_id, (None, None))
+                if folder_info:
+                    self.log_message(f"  ✅ {branch_code}: {folder_info.get('name', 'Unknown')} (ID: {folder_id})")
                 else:
-                    self.log_message(f"  ❌ {branch_code}: Folder không tồn tại (ID: {folder_id})")
+                    self.log_message(f"  ❌ {branch_code}: {error} (ID: {folder_id})")
                     
     def list_my_drive_folders(self, parent_folder_id=None):
         """Liệt kê tất cả folder trong Drive để tìm đúng ID"""
@@ -607,20 +1747,33 @@ class GoogleDriveUploader:
         try:
             self.log_message("🔍 SCAN: Tìm kiếm tất cả folder trong Drive...")
             
-            if parent_folder_id:
-                query = f"parents in '{parent_folder_id}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-                self.log_message(f"📂 Tìm trong folder ID: {parent_folder_id}")
+            if parent_folder_id and self.refresh_drive_index() and self.drive_index.is_covered(parent_folder_id):
+                # Folder nằm trong index: không cần gọi API
+                self.log_message(f"📂 Tìm trong folder ID: {parent_folder_id} (index)")
+                items = [dict(item, parents=[parent_folder_id])
+                         for item in self.drive_index.children(parent_folder_id, folders_only=True)]
             else:
-                query = "mimeType='application/vnd.google-apps.folder' and trashed=false"
-                self.log_message("📂 Tìm trong toàn bộ Drive")
-            
-            results = self.service.files().list(
-                q=query,
-                fields="files(id, name, parents)",
-                pageSize=100
-            ).execute()
+                if parent_folder_id:
+                    query = f"parents in '{parent_folder_id}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+                    self.log_message(f"📂 Tìm trong folder ID: {parent_folder_id}")
+                else:
+                    query = f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+                    self.log_message("📂 Tìm trong toàn bộ Drive")
+                
+                # Phân trang để không bỏ sót folder khi Drive có nhiều hơn một trang
+                items, page_token = [], None
+                while True:
+                    results = self.scheduler.call(self.service.files().list(
+                        q=query,
+                        fields="nextPageToken, files(id, name, parents)",
+                        pageSize=1000,
+                        pageToken=page_token
+                    ).execute)
+                    items.extend(results.get('files', []))
+                    page_token = results.get('nextPageToken')
+                    if not page_token:
+                        break
             
-            items = results.get('files', [])
             self.log_message(f"📋 Tìm thấy {len(items)} folder:")
             
             for item in items:
@@ -0,0 +1,379 @@
+import os
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from Autoscreen import IMAGE_EXTENSIONS
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Các chế độ nén: tên -> (phần mở rộng, lossless)
+TRANSCODE_MODES = {
+    'png': ('.png', True),             # Nén lại PNG tối ưu, giữ nguyên điểm ảnh
+    'webp_lossless': ('.webp', True),  # WebP không mất dữ liệu
+    'webp': ('.webp', False),          # WebP có mất dữ liệu theo quality
+    'avif': ('.avif', False),          # AVIF có mất dữ liệu (cần Pillow hỗ trợ AVIF)
+}
+
+# Định dạng của bản gửi lên Drive khi nén lúc upload: tên -> (phần mở rộng, định dạng Pillow)
+UPLOAD_FORMATS = {
+    'webp': ('.webp', 'WEBP'),
+    'jpeg': ('.jpg', 'JPEG'),
+    'original': (None, None),  # Giữ định dạng, chỉ thu nhỏ theo max_width
+}
+
+def smallest_variant(file_path):
+    """Trả về file nhỏ nhất trong các định dạng cùng tên (NN_BR_Kênh.png/.webp/.avif)"""
+    stem = os.path.splitext(file_path)[0]
+    best_path, best_size = file_path, None
+    for ext in IMAGE_EXTENSIONS:
+        candidate = stem + ext
+        try:
+            size = os.path.getsize(candidate)
+        except OSError:
+            continue
+        if best_size is None or size < best_size:
+            best_path, best_size = candidate, size
+    return best_path
+
+def _pixels_equal(path_a, path_b):
+    """So sánh từng điểm ảnh của hai file (dùng cho chế độ lossless)"""
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        if a.size != b.size:
+            return False
+        return a.convert('RGBA').tobytes() == b.convert('RGBA').tobytes()
+
+def transcode_file(src, mode='png', quality=80, keep_original=False, verify=True):
+    """
+    Nén lại một file ảnh. Hàm chạy trong process con nên chỉ nhận/trả dữ liệu đơn giản.
+    Trả về: dict {src, dst, status, bytes_in, bytes_out, seconds, error}
+    status: 'ok' | 'skipped' (không nhỏ hơn) | 'failed'
+    """
+    started = time.perf_counter()
+    result = {'src': src, 'dst': src, 'status': 'failed', 'bytes_in': 0,
+              'bytes_out': 0, 'seconds': 0.0, 'error': None}
+    ext, lossless = TRANSCODE_MODES[mode]
+    dst = os.path.splitext(src)[0] + ext
+    tmp_path = dst + '.tmp'
+
+    try:
+        bytes_in = os.path.getsize(src)
+        result['bytes_in'] = bytes_in
+        result['bytes_out'] = bytes_in
+
+        with Image.open(src) as image:
+            image.load()
+            if mode == 'png':
+                image.save(tmp_path, format='PNG', optimize=True)
+            elif mode == 'webp_lossless':
+                image.save(tmp_path, format='WEBP', lossless=True, quality=100, method=6)
+            elif mode == 'webp':
+                image.save(tmp_path, format='WEBP', quality=quality, method=4)
+            elif mode == 'avif':
+                image.save(tmp_path, format='AVIF', quality=quality)
+
+        if lossless and verify and not _pixels_equal(src, tmp_path):
+            os.remove(tmp_path)
+            result['error'] = "Điểm ảnh không khớp sau khi nén"
+            return result
+
+        bytes_out = os.path.getsize(tmp_path)
+        if bytes_out >= bytes_in:
+            # Không tiết kiệm được gì -> giữ file gốc
+            os.remove(tmp_path)
+            result['status'] = 'skipped'
+            return result
+
+        os.replace(tmp_path, dst)
+        if dst != src and not keep_original:
+            os.remove(src)
+
+        result.update(dst=dst, status='ok', bytes_out=bytes_out)
+        return result
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        result['error'] = str(e)
+        return result
+    finally:
+        result['seconds'] = time.perf_counter() - started
+
+def transcode_for_upload(src, dst, fmt='webp', quality=80, max_width=None):
+    """
+    Tạo bản gửi lên Drive của một ảnh (file gốc giữ nguyên). Chạy trong process con.
+    Trả về: dict {src, dst, status, bytes_in, bytes_out, seconds, error}
+    status: 'ok' | 'skipped' (không nhỏ hơn -> upload file gốc) | 'failed'
+    """
+    started = time.perf_counter()
+    result = {'src': src, 'dst': src, 'status': 'failed', 'bytes_in': 0,
+              'bytes_out': 0, 'seconds': 0.0, 'error': None}
+    tmp_path = dst + '.tmp'
+    try:
+        bytes_in = os.path.getsize(src)
+        result['bytes_in'] = bytes_in
+        result['bytes_out'] = bytes_in
+
+        with Image.open(src) as image:
+            image.load()
+            pil_format = UPLOAD_FORMATS[fmt][1] or image.format
+            if max_width and image.width > max_width:
+                height = max(1, round(image.height * max_width / image.width))
+                image = image.resize((max_width, height), Image.LANCZOS)
+            if pil_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')  # JPEG không có kênh alpha
+            if pil_format == 'WEBP':
+                image.save(tmp_path, format='WEBP', quality=quality, method=4)
+            elif pil_format == 'JPEG':
+                image.save(tmp_path, format='JPEG', quality=quality, optimize=True)
+            elif pil_format == 'PNG':
+                image.save(tmp_path, format='PNG', optimize=True)
+            else:
+                image.save(tmp_path, format=pil_format, quality=quality)
+
+        bytes_out = os.path.getsize(tmp_path)
+        if bytes_out >= bytes_in:
+            os.remove(tmp_path)
+            result['status'] = 'skipped'
+            return result
+
+        os.replace(tmp_path, dst)
+        result.update(dst=dst, status='ok', bytes_out=bytes_out)
+        return result
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        result['error'] = str(e)
+        return result
+    finally:
+        result['seconds'] = time.perf_counter() - started
+
+class ImageTranscoder:
+    """Nén ảnh nền bằng process pool, dùng ngay sau khi chụp hoặc chạy hàng loạt trên thư mục"""
+
+    def __init__(self, mode='png', quality=80, keep_original=False, verify=True,
+                 max_workers=None, log_callback=None):
+        if mode not in TRANSCODE_MODES:
+            raise ValueError(f"Chế độ nén không hợp lệ: {mode}")
+        self.mode = mode
+        self.quality = quality
+        self.keep_original = keep_original
+        self.verify = verify
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.log_callback = log_callback
+        self._executor = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def is_available(self):
+        """Kiểm tra Pillow có sẵn không"""
+        return PIL_AVAILABLE
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(f"🗜️ {message}")
+        else:
+            print(f"Transcode: {message}")
+
+    def reset_stats(self):
+        """Reset thống kê nén"""
+        self.stats = {
+            'files_ok': 0,
+            'files_skipped': 0,
+            'files_failed': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'started_at': None,
+        }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            if self.stats['started_at'] is None:
+                self.stats['started_at'] = time.time()
+            return self._executor
+
+    def _record(self, result):
+        with self._lock:
+            self.stats[f"files_{result['status']}"] += 1
+            self.stats['bytes_in'] += result['bytes_in']
+            self.stats['bytes_out'] += result['bytes_out']
+        if result['status'] == 'failed':
+            self.log_message(f"❌ Lỗi nén {os.path.basename(result['src'])}: {result['error']}")
+
+    def submit(self, file_path, callback=None):
+        """
+        Đưa một file vào hàng đợi nén (không chặn luồng chụp).
+        callback(result) được gọi khi xong; result['dst'] là file nên dùng để upload.
+        """
+        future = self._get_executor().submit(
+            transcode_file, file_path, self.mode, self.quality, self.keep_original, self.verify)
+
+        def _done(fut):
+            try:
+                result = fut.result()
+            except Exception as e:
+                result = {'src': file_path, 'dst': file_path, 'status': 'failed',
+                          'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0, 'error': str(e)}
+            self._record(result)
+            if callback:
+                callback(result)
+
+        future.add_done_callback(_done)
+        return future
+
+    def transcode_folder(self, folder_path, file_pattern=None, recursive=False):
+        """Nén hàng loạt các ảnh PNG trong thư mục, trả về thống kê"""
+        if not os.path.exists(folder_path):
+            self.log_message(f"❌ Thư mục không tồn tại: {folder_path}")
+            return self.get_stats()
+
+        files = []
+        for dirpath, dirnames, filenames in os.walk(folder_path):
+            for filename in filenames:
+                if not filename.lower().endswith('.png'):
+                    continue
+                if file_pattern and not file_pattern.match(filename):
+                    continue
+                files.append(os.path.join(dirpath, filename))
+            if not recursive:
+                break
+
+        self.log_message(f"Bắt đầu nén {len(files)} file ({self.mode}, {self.max_workers} process)")
+        futures = [self.submit(path) for path in files]
+        for future in futures:
+            future.exception()  # Chờ hoàn tất, lỗi đã được ghi nhận trong _record
+
+        stats = self.get_stats()
+        self.log_message(self.format_stats(stats))
+        return stats
+
+    def get_stats(self):
+        """Thống kê: số file, byte tiết kiệm và tốc độ xử lý"""
+        with self._lock:
+            stats = self.stats.copy()
+        elapsed = time.time() - stats['started_at'] if stats['started_at'] else 0
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        stats['elapsed'] = elapsed
+        stats['mb_per_second'] = (stats['bytes_in'] / (1024 * 1024) / elapsed) if elapsed > 0 else 0
+        total_files = stats['files_ok'] + stats['files_skipped'] + stats['files_failed']
+        stats['files_per_second'] = (total_files / elapsed) if elapsed > 0 else 0
+        return stats
+
+    def format_stats(self, stats=None):
+        """Chuỗi tóm tắt thống kê để hiển thị trong log"""
+        stats = stats or self.get_stats()
+        saved_mb = stats['bytes_saved'] / (1024 * 1024)
+        ratio = (stats['bytes_saved'] / stats['bytes_in'] * 100) if stats['bytes_in'] else 0
+        return (f"Đã nén {stats['files_ok']} file (bỏ qua {stats['files_skipped']}, lỗi {stats['files_failed']}) | "
+                f"Tiết kiệm {saved_mb:.1f} MB ({ratio:.1f}%) | "
+                f"{stats['files_per_second']:.1f} file/s, {stats['mb_per_second']:.1f} MB/s")
+
+    def shutdown(self, wait=True):
+        """Dừng process pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+class UploadTranscoder(ImageTranscoder):
+    """
+    Nén ảnh ngay trước khi upload (WebP/JPEG theo quality, hoặc thu nhỏ) bằng process pool.
+    Bản nén nằm trong cache_dir, file gốc giữ nguyên; upload xong thì xóa bản nén.
+    """
+
+    def __init__(self, fmt='webp', quality=80, max_width=None, cache_dir="upload_cache",
+                 max_workers=None, log_callback=None):
+        if fmt not in UPLOAD_FORMATS:
+            raise ValueError(f"Định dạng upload không hợp lệ: {fmt}")
+        super().__init__(max_workers=max_workers, log_callback=log_callback)
+        self.mode = fmt
+        self.quality = quality
+        self.max_width = max_width
+        self.cache_dir = cache_dir
+
+    def target_path(self, file_path):
+        """Đường dẫn bản nén trong cache (cố định theo file gốc để upload tiếp được phiên resumable)"""
+        stem, ext = os.path.splitext(os.path.basename(file_path))
+        key = hashlib.md5(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.cache_dir, f"{key}_{stem}{UPLOAD_FORMATS[self.mode][0] or ext}")
+
+    def prepare(self, file_path):
+        """
+        Nén một file để upload (chặn luồng gọi, việc nén chạy trong process pool).
+        Trả về result của transcode_for_upload; result['dst'] là file cần upload
+        """
+        dst = self.target_path(file_path)
+        try:
+            src_stat, dst_stat = os.stat(file_path), os.stat(dst)
+            if dst_stat.st_mtime >= src_stat.st_mtime:
+                # Bản nén từ lần thử trước (upload lỗi/dừng giữa chừng)
+                return {'src': file_path, 'dst': dst, 'status': 'ok', 'bytes_in': src_stat.st_size,
+                        'bytes_out': dst_stat.st_size, 'seconds': 0.0, 'error': None}
+        except OSError:
+            pass
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            result = self._get_executor().submit(
+                transcode_for_upload, file_path, dst, self.mode, self.quality, self.max_width).result()
+        except Exception as e:
+            result = {'src': file_path, 'dst': file_path, 'status': 'failed',
+                      'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0, 'error': str(e)}
+        self._record(result)
+        if result['status'] == 'ok':
+            saved = result['bytes_in'] - result['bytes_out']
+            ratio = saved / result['bytes_in'] * 100 if result['bytes_in'] else 0
+            self.log_message(f"{os.path.basename(file_path)} -> {os.path.basename(dst)}: "
+                             f"{result['bytes_in'] / 1024:.0f} KB -> {result['bytes_out'] / 1024:.0f} KB "
+                             f"(-{ratio:.0f}%, {result['seconds']:.2f}s)")
+        return result
+
+    def release(self, result):
+        """Xóa bản nén sau khi đã upload xong"""
+        if result['status'] == 'ok' and result['dst'] != result['src']:
+            self.discard(result['src'])
+
+    def discard(self, file_path):
+        """Xóa bản nén (nếu có) của file gốc, ví dụ khi mục upload đã bị bỏ"""
+        try:
+            os.remove(self.target_path(file_path))
+        except OSError:
+            pass
+
+def main():
+    ap = argparse.ArgumentParser(description="Nén lại ảnh chụp màn hình (PNG tối ưu / WebP / AVIF)")
+    ap.add_argument("folder", help="Thư mục chứa ảnh PNG")
+    ap.add_argument("--mode", choices=sorted(TRANSCODE_MODES), default="png", help="Chế độ nén")
+    ap.add_argument("--quality", type=int, default=80, help="Chất lượng cho chế độ có mất dữ liệu (1-100)")
+    ap.add_argument("--keep-original", action="store_true", help="Giữ lại file PNG gốc")
+    ap.add_argument("--no-verify", dest="verify", action="store_false", help="Bỏ kiểm tra điểm ảnh ở chế độ lossless")
+    ap.add_argument("--workers", type=int, default=None, help="Số process (mặc định: số nhân CPU)")
+    ap.add_argument("--recursive", action="store_true", help="Duyệt cả thư mục con")
+    args = ap.parse_args()
+
+    if not PIL_AVAILABLE:
+        raise SystemExit("Cần cài Pillow: pip install Pillow")
+
+    transcoder = ImageTranscoder(mode=args.mode, quality=args.quality, keep_original=args.keep_original,
+                                 verify=args.verify, max_workers=args.workers)
+    try:
+        transcoder.transcode_folder(args.folder, recursive=args.recursive)
+    finally:
+        transcoder.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from perf_monitor import (
+    METRIC_SHOTS, METRIC_DUPLICATES, METRIC_STUCK_STOPS, METRIC_SCREENCAP, METRIC_HASH, METRIC_SWIPE,
+    METRIC_SETTLE, METRIC_UPLOAD_LATENCY, METRIC_UPLOAD_BYTES, METRIC_UPLOAD_RETRIES, METRIC_API_CALLS,
+    METRIC_API_ERRORS, GAUGE_CAPTURE_RUNNING, GAUGE_SESSION_SHOTS
+)
+from upload_queue import STATE_FAILED
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Chuỗi thời lượng -> (tên histogram Prometheus, mô tả)
+HISTOGRAMS = {
+    METRIC_SCREENCAP: ('autoscreen_screencap_seconds', 'Thời gian chụp màn hình qua ADB'),
+    METRIC_HASH: ('autoscreen_hash_seconds', 'Thời gian hash ảnh để phát hiện khung trùng'),
+    METRIC_SWIPE: ('autoscreen_swipe_seconds', 'Thời gian lệnh vuốt qua ADB'),
+    METRIC_SETTLE: ('autoscreen_settle_seconds', 'Thời gian chờ màn hình ổn định sau khi vuốt'),
+    METRIC_UPLOAD_LATENCY: ('autoscreen_upload_seconds', 'Thời gian lưu một file tới mọi nơi lưu'),
+}
+
+# Bộ đếm trong PerfMonitor -> (tên counter Prometheus, mô tả)
+COUNTERS = {
+    METRIC_SHOTS: ('autoscreen_frames_taken_total', 'Ảnh mới đã chụp'),
+    METRIC_DUPLICATES: ('autoscreen_duplicate_frames_total', 'Khung trùng với khung trước'),
+    METRIC_STUCK_STOPS: ('autoscreen_stuck_stops_total', 'Phiên chụp dừng vì trùng liên tiếp'),
+    METRIC_UPLOAD_RETRIES: ('autoscreen_upload_retries_total', 'Lỗi upload được hẹn thử lại'),
+    METRIC_UPLOAD_BYTES: ('autoscreen_upload_bytes_total', 'Byte đã gửi lên Drive'),
+    METRIC_API_CALLS: ('autoscreen_drive_api_requests_total', 'Request Drive API'),
+    METRIC_API_ERRORS: ('autoscreen_drive_api_errors_total', 'Request Drive API bị lỗi'),
+}
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class _MetricsWriter:
+    """Ghi các dòng định dạng text của Prometheus (HELP/TYPE một lần cho mỗi metric)"""
+
+    def __init__(self):
+        self.lines = []
+
+    def header(self, name, kind, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, value, labels=None):
+        if labels:
+            label_text = ','.join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+            self.lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+        else:
+            self.lines.append(f"{name} {_format_value(value)}")
+
+    def metric(self, name, kind, help_text, value, labels=None):
+        self.header(name, kind, help_text)
+        self.sample(name, value, labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+class MetricsExporter:
+    """
+    Endpoint HTTP /metrics (định dạng text của Prometheus) để máy giám sát scrape từ xa.
+    Chạy http.server trong luồng nền; mọi số liệu được đọc lúc có request scrape
+    (PerfMonitor, upload_stats, hàng đợi, dung lượng ổ), không ai scrape thì không tốn gì ngoài luồng chờ
+    """
+
+    def __init__(self, monitor, uploader=None, host="127.0.0.1", port=9464, disk_path="shots",
+                 retention_manager=None, log_callback=None):
+        self.monitor = monitor
+        self.uploader = uploader
+        self.host = host
+        self.port = port
+        self.disk_path = disk_path  # Thư mục lưu ảnh để đo dung lượng ổ
+        self.retention_manager = retention_manager
+        self.log_callback = log_callback
+        self._server = None
+        self._thread = None
+        self.scrapes = 0
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            print(f"Metrics: {message}")
+
+    def start(self):
+        """Mở endpoint (port 0: để hệ điều hành chọn port trống). Trả về True nếu đang chạy"""
+        if self._server is not None:
+            return True
+        self.monitor.enable_totals(HISTOGRAMS)
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                try:
+                    body = exporter.render().encode('utf-8')
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Không ghi log mỗi lần scrape
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.log_message(f"❌ Không mở được endpoint metrics {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics")
+        self._thread.start()
+        self.log_message(f"📊 Endpoint metrics: http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._server is not None
+
+    def render(self):
+        """Toàn bộ số liệu ở định dạng text của Prometheus"""
+        self.scrapes += 1
+        writer = _MetricsWriter()
+        self._render_capture(writer)
+        self._render_uploads(writer)
+        self._render_disk(writer)
+        return writer.text()
+
+    def _render_capture(self, writer):
+        totals = self.monitor.totals()
+        for metric, (name, help_text) in COUNTERS.items():
+            writer.metric(name, 'counter', help_text, totals.get(metric, 0))
+
+        histograms = self.monitor.histograms()
+        for metric, (name, help_text) in HISTOGRAMS.items():
+            snapshot = histograms.get(metric)
+            if snapshot is None:
+                continue
+            buckets, total, count = snapshot
+            writer.header(name, 'histogram', help_text)
+            for bound, cumulative in buckets:
+                writer.sample(f"{name}_bucket", cumulative, {'le': _format_value(float(bound))})
+            writer.sample(f"{name}_sum", total)
+            writer.sample(f"{name}_count", count)
+
+        gauges = self.monitor.gauges()
+        writer.metric('autoscreen_capture_running', 'gauge', 'Đang chụp (1) hay không (0)',
+                      int(bool(gauges.get(GAUGE_CAPTURE_RUNNING))))
+        writer.metric('autoscreen_session_frames', 'gauge', 'Số ảnh mới của phiên chụp gần nhất',
+                      gauges.get(GAUGE_SESSION_SHOTS, 0))
+
+    def _render_uploads(self, writer):
+        uploader = self.uploader
+        if uploader is None:
+            return
+        with uploader._stats_lock:
+            stats = uploader.upload_stats.copy()
+        writer.metric('autoscreen_uploads_total', 'counter', 'File đã upload xong', stats.get('total_uploaded', 0))
+        writer.metric('autoscreen_upload_failures_total', 'counter', 'File upload thất bại (đã bỏ cuộc)',
+                      stats.get('total_failed', 0))
+        last_upload = stats.get('last_upload_time')
+        if last_upload is not None and hasattr(last_upload, 'timestamp'):
+            writer.metric('autoscreen_last_upload_timestamp_seconds', 'gauge', 'Thời điểm upload xong gần nhất',
+                          last_upload.timestamp())
+        writer.metric('autoscreen_uploading', 'gauge', 'Worker upload đang chạy (1) hay không (0)',
+                      int(bool(uploader.is_uploading)))
+
+        writer.header('autoscreen_upload_queue_depth', 'gauge', 'File chờ upload theo làn (pending + đang gửi)')
+        for lane, status in uploader.upload_queue.lane_status().items():
+            writer.sample('autoscreen_upload_queue_depth', status['pending'] + status['in_flight'], {'lane': lane})
+        buffered, spooled = uploader.handoff.pending()
+        writer.header('autoscreen_upload_handoff_items', 'gauge', 'File chưa vào hàng đợi (bộ đệm / spool trên đĩa)')
+        writer.sample('autoscreen_upload_handoff_items', buffered, {'stage': 'buffered'})
+        writer.sample('autoscreen_upload_handoff_items', spooled, {'stage': 'spooled'})
+        writer.metric('autoscreen_upload_dead_letter', 'gauge', 'File upload thất bại còn trong hàng đợi',
+                      uploader.upload_queue.counts()[STATE_FAILED])
+
+    def _render_disk(self, writer):
+        path = os.path.abspath(self.disk_path or ".")
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)  # Thư mục ảnh chưa được tạo: đo ổ chứa nó
+        usage = shutil.disk_usage(path)
+        writer.metric('autoscreen_disk_total_bytes', 'gauge', 'Dung lượng ổ chứa thư mục ảnh', usage.total)
+        writer.metric('autoscreen_disk_free_bytes', 'gauge', 'Dung lượng còn trống của ổ chứa thư mục ảnh',
+                      usage.free)
+        if self.retention_manager is not None and self.retention_manager.stats.get('disk_usage'):
+            # Lấy từ lượt dọn dẹp gần nhất, không quét lại thư mục mỗi lần scrape
+            writer.metric('autoscreen_shots_bytes', 'gauge', 'Dung lượng ảnh local (lượt dọn dẹp gần nhất)',
+                          self.retention_manager.stats['disk_usage'])
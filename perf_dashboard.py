@@ -0,0 +1,164 @@
+import math
+import tkinter as tk
+from tkinter import ttk
+
+from perf_monitor import (
+    METRIC_SHOTS, METRIC_SCREENCAP, METRIC_HASH, METRIC_SWIPE, METRIC_SETTLE,
+    METRIC_UPLOAD_BYTES, METRIC_UPLOAD_ERRORS, METRIC_API_CALLS, METRIC_API_ERRORS,
+    METRIC_QUEUE_LIVE, METRIC_QUEUE_BACKFILL
+)
+from upload_queue import LANE_LIVE, LANE_BACKFILL
+
+def _nice_ceiling(value):
+    """Làm tròn lên 1/2/5 x 10^n cho trục Y dễ đọc"""
+    if value <= 0:
+        return 1.0
+    magnitude = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 5):
+        if step * magnitude >= value:
+            return step * magnitude
+    return 10 * magnitude
+
+class TimeSeriesChart:
+    """Biểu đồ đường nhiều chuỗi trên tk.Canvas, vẽ lại toàn bộ mỗi lần cập nhật (vài chục điểm mỗi chuỗi)"""
+
+    def __init__(self, parent, title, series, value_format="{:.1f}", height=110):
+        """series: [(nhãn, màu)]"""
+        self.title = title
+        self.series = series
+        self.value_format = value_format
+        self.frame = ttk.Frame(parent)
+        self.title_var = tk.StringVar(value=title)
+        ttk.Label(self.frame, textvariable=self.title_var, font=('Segoe UI', 9, 'bold')).pack(anchor=tk.W)
+        self.canvas = tk.Canvas(self.frame, height=height, bg='white',
+                                highlightthickness=1, highlightbackground='#dee2e6')
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+    def update(self, values_list, current=None):
+        """values_list: một danh sách giá trị cho mỗi chuỗi (cũ -> mới); current: giá trị hiện tại cho tiêu đề"""
+        if current is not None:
+            self.title_var.set(f"{self.title}: " + " / ".join(self.value_format.format(value) for value in current))
+        canvas = self.canvas
+        canvas.delete('all')
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        if width < 40 or height < 30:
+            return
+        left, top, bottom = 36, 14, height - 4
+        top_value = _nice_ceiling(max((max(values) for values in values_list if values), default=0))
+
+        # Lưới ngang và nhãn trục Y
+        for fraction in (0, 0.5, 1):
+            y = bottom - (bottom - top) * fraction
+            canvas.create_line(left, y, width - 4, y, fill='#e9ecef')
+            canvas.create_text(left - 4, y, text=f"{top_value * fraction:g}", anchor=tk.E,
+                               font=('Segoe UI', 7), fill='#6c757d')
+
+        # Chú thích màu từng chuỗi
+        x = width - 6
+        for label, color in reversed(self.series):
+            item = canvas.create_text(x, 2, text=label, anchor=tk.NE, font=('Segoe UI', 7), fill=color)
+            x = canvas.bbox(item)[0] - 8
+
+        for (label, color), values in zip(self.series, values_list):
+            if len(values) < 2:
+                continue
+            step = (width - 4 - left) / (len(values) - 1)
+            points = []
+            for index, value in enumerate(values):
+                points.extend((left + index * step, bottom - (bottom - top) * min(value / top_value, 1.0)))
+            canvas.create_line(*points, fill=color, width=2)
+
+class PerfDashboard:
+    """
+    Tab hiệu năng: biểu đồ trượt (window giây gần nhất) từ PerfMonitor, làm mới mỗi REFRESH_MS.
+    Chỉ vẽ khi tab đang được xem; độ dài hàng đợi được lấy mẫu ở mỗi lần làm mới
+    """
+
+    REFRESH_MS = 1000
+    WINDOW = 120  # Giây hiển thị
+    BUCKET = 2    # Giây mỗi điểm
+    STAGE_COLORS = (('screencap', '#007bff'), ('hash', '#6f42c1'), ('swipe', '#fd7e14'), ('settle', '#20c997'))
+
+    def __init__(self, parent, root, monitor, uploader=None, is_visible=None):
+        self.root = root
+        self.monitor = monitor
+        self.uploader = uploader
+        self.is_visible = is_visible or (lambda: True)
+        self._after_id = None
+
+        frame = ttk.LabelFrame(parent, text=f"Hiệu năng ({self.WINDOW // 60} phút gần nhất)",
+                               style="Card.TLabelframe", padding="5")
+        frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=2, pady=2)
+        frame.columnconfigure(0, weight=1)
+        frame.columnconfigure(1, weight=1)
+
+        self.shots_chart = TimeSeriesChart(frame, "📸 Ảnh/phút", [("ảnh/phút", '#28a745')])
+        self.stage_chart = TimeSeriesChart(frame, "⏱️ Độ trễ chụp (ms)", self.STAGE_COLORS, "{:.0f}")
+        self.upload_chart = TimeSeriesChart(frame, "📤 Upload MB/s", [("MB/s", '#007bff')], "{:.2f}")
+        self.api_chart = TimeSeriesChart(frame, "🌐 Drive API/giây", [("request/s", '#17a2b8')])
+        self.queue_chart = TimeSeriesChart(frame, "📥 Hàng đợi upload",
+                                           [("vừa chụp", '#007bff'), ("upload bù", '#6c757d')], "{:.0f}")
+        self.error_chart = TimeSeriesChart(frame, "⚠️ Lỗi/phút",
+                                           [("upload", '#dc3545'), ("API", '#fd7e14')])
+        charts = (self.shots_chart, self.stage_chart, self.upload_chart,
+                  self.api_chart, self.queue_chart, self.error_chart)
+        for index, chart in enumerate(charts):
+            chart.frame.grid(row=index // 2, column=index % 2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=4, pady=3)
+            frame.rowconfigure(index // 2, weight=1)
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.REFRESH_MS, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _tick(self):
+        try:
+            self._sample_queue()
+            if self.is_visible():
+                self.redraw()
+        finally:
+            self._after_id = self.root.after(self.REFRESH_MS, self._tick)
+
+    def _sample_queue(self):
+        """Lấy mẫu độ dài hàng đợi từng làn"""
+        if self.uploader is None:
+            return
+        lanes = self.uploader.upload_queue.lane_status()
+        self.monitor.record(METRIC_QUEUE_LIVE, lanes[LANE_LIVE]['pending'] + lanes[LANE_LIVE]['in_flight'])
+        self.monitor.record(METRIC_QUEUE_BACKFILL,
+                            lanes[LANE_BACKFILL]['pending'] + lanes[LANE_BACKFILL]['in_flight'])
+
+    def _series(self, name, mode='rate', scale=1.0):
+        # Bỏ khoảng cuối đang đo dở để đường không tụt xuống ở mép phải
+        values = self.monitor.series(name, self.WINDOW, self.BUCKET, mode)[:-1]
+        return [value * scale for value in values]
+
+    @staticmethod
+    def _recent(values, points=5, skip_empty=False):
+        """Giá trị hiện tại: trung bình vài điểm cuối (skip_empty: bỏ khoảng không có mẫu, dùng cho độ trễ)"""
+        tail = [value for value in values[-points:] if value or not skip_empty]
+        return sum(tail) / len(tail) if tail else 0.0
+
+    def redraw(self):
+        shots = self._series(METRIC_SHOTS, scale=60)
+        self.shots_chart.update([shots], [self._recent(shots)])
+
+        stages = [self._series(name, 'mean', 1000)
+                  for name in (METRIC_SCREENCAP, METRIC_HASH, METRIC_SWIPE, METRIC_SETTLE)]
+        self.stage_chart.update(stages, [self._recent(values, skip_empty=True) for values in stages])
+
+        upload = self._series(METRIC_UPLOAD_BYTES, scale=1 / (1024 * 1024))
+        self.upload_chart.update([upload], [self._recent(upload)])
+
+        api = self._series(METRIC_API_CALLS)
+        self.api_chart.update([api], [self._recent(api)])
+
+        queue = [self._series(METRIC_QUEUE_LIVE, 'last'), self._series(METRIC_QUEUE_BACKFILL, 'last')]
+        self.queue_chart.update(queue, [values[-1] if values else 0 for values in queue])
+
+        errors = [self._series(METRIC_UPLOAD_ERRORS, scale=60), self._series(METRIC_API_ERRORS, scale=60)]
+        self.error_chart.update(errors, [self._recent(values) for values in errors])
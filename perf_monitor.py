@@ -0,0 +1,186 @@
+import time
+import bisect
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Tên các chuỗi số liệu
+METRIC_SHOTS = 'shots'                  # Ảnh mới chụp được (đếm)
+METRIC_SCREENCAP = 'stage_screencap'    # Giây: chụp màn hình (kèm cắt/mã hóa)
+METRIC_HASH = 'stage_hash'              # Giây: hash ảnh để phát hiện khung trùng
+METRIC_DUPLICATES = 'duplicates'        # Khung trùng với khung trước (vuốt không đổi nội dung)
+METRIC_STUCK_STOPS = 'stuck_stops'      # Phiên dừng vì trùng liên tiếp (hết nội dung)
+METRIC_SWIPE = 'stage_swipe'            # Giây: lệnh vuốt qua ADB
+METRIC_SETTLE = 'stage_settle'          # Giây: chờ màn hình ổn định sau khi vuốt
+CAPTURE_STAGES = (METRIC_SCREENCAP, METRIC_HASH, METRIC_SWIPE, METRIC_SETTLE)
+METRIC_UPLOAD_BYTES = 'upload_bytes'    # Byte đã gửi lên Drive (theo chunk)
+METRIC_UPLOAD_FILES = 'upload_files'    # File upload xong
+METRIC_UPLOAD_ERRORS = 'upload_errors'  # Lỗi upload (cả lần sẽ thử lại)
+METRIC_UPLOAD_RETRIES = 'upload_retries'  # Lỗi upload được hẹn thử lại
+METRIC_UPLOAD_LATENCY = 'upload_latency'  # Giây: lưu một file tới mọi nơi lưu
+METRIC_API_CALLS = 'api_calls'          # Request Drive API
+METRIC_API_ERRORS = 'api_errors'        # Request Drive API bị lỗi
+METRIC_QUEUE_LIVE = 'queue_live'        # Số file chờ trong làn live (lấy mẫu định kỳ)
+METRIC_QUEUE_BACKFILL = 'queue_backfill'
+# Gauge (giá trị hiện tại, ghi qua set_gauge)
+GAUGE_CAPTURE_RUNNING = 'capture_running'  # Luồng chụp đang chạy
+GAUGE_SESSION_SHOTS = 'session_shots'      # Số ảnh mới của phiên chụp hiện tại/gần nhất
+
+# Mốc (giây) của histogram thời lượng, từ hash vài ms tới upload file lớn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class SampleRing:
+    """
+    Ring buffer kích thước cố định, không dùng khóa: mỗi lần ghi lấy ô kế tiếp từ itertools.count
+    (next() là nguyên tử trong CPython) rồi ghi đè một tuple (thời điểm, giá trị) vào ô đó.
+    Luồng chụp/upload ghi không phải chờ; luồng đọc (GUI) sao chép danh sách ô rồi lọc theo thời gian
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self._slots = [None] * size
+        self._counter = itertools.count()
+
+    def add(self, value, timestamp=None):
+        self._slots[next(self._counter) % self.size] = (timestamp or time.monotonic(), value)
+
+    def since(self, start):
+        """Các mẫu từ thời điểm start (monotonic), theo thứ tự thời gian"""
+        samples = [sample for sample in list(self._slots) if sample is not None and sample[0] >= start]
+        samples.sort(key=lambda sample: sample[0])
+        return samples
+
+class Histogram:
+    """Histogram tích lũy (đếm theo mốc, tổng, số mẫu) từ lúc bật, dạng histogram của Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Ô cuối: lớn hơn mốc cao nhất (+Inf)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """([(mốc, số mẫu <= mốc)], tổng, số mẫu); mốc cuối là float('inf')"""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total, running
+
+class PerfMonitor:
+    """
+    Số liệu hiệu năng theo thời gian cho dashboard: mỗi chuỗi là một SampleRing.
+    count() cho sự kiện (ảnh, byte, request), record() cho thời lượng và giá trị đo (độ dài hàng đợi)
+    """
+
+    def __init__(self, ring_size=8192):
+        self.ring_size = ring_size
+        self._rings = {}
+        self._gauges = {}
+        # Bộ đếm và histogram tích lũy chỉ có khi bật (metrics_exporter); chưa bật thì count/record không tốn thêm gì
+        self._totals = None
+        self._totals_lock = threading.Lock()
+        self._histograms = {}
+
+    def _ring(self, name):
+        ring = self._rings.get(name)
+        if ring is None:
+            ring = self._rings.setdefault(name, SampleRing(self.ring_size))
+        return ring
+
+    def count(self, name, amount=1):
+        """Ghi một sự kiện (amount: số lượng, ví dụ số byte)"""
+        self._ring(name).add(amount)
+        if self._totals is not None:
+            with self._totals_lock:
+                self._totals[name] = self._totals.get(name, 0) + amount
+
+    def record(self, name, value):
+        """Ghi một giá trị đo (thời lượng giây, độ dài hàng đợi...)"""
+        self._ring(name).add(value)
+        histogram = self._histograms.get(name)
+        if histogram is not None:
+            histogram.observe(value)
+
+    def set_gauge(self, name, value):
+        """Giá trị hiện tại (đang chụp, số ảnh của phiên...), đọc qua gauges()"""
+        self._gauges[name] = value
+
+    def gauges(self):
+        return dict(self._gauges)
+
+    def enable_totals(self, histogram_names=(), buckets=LATENCY_BUCKETS):
+        """Bắt đầu cộng dồn bộ đếm (tổng từ lúc bật) và histogram cho các chuỗi thời lượng histogram_names"""
+        with self._totals_lock:
+            if self._totals is None:
+                self._totals = {}
+        histograms = dict(self._histograms)
+        for name in histogram_names:
+            histograms.setdefault(name, Histogram(buckets))
+        self._histograms = histograms  # Thay cả dict: luồng ghi không thấy dict đang sửa dở
+
+    def totals(self):
+        """Tổng tích lũy của các bộ đếm từ lúc enable_totals ({} nếu chưa bật)"""
+        with self._totals_lock:
+            return dict(self._totals or {})
+
+    def histograms(self):
+        """{tên: ([(mốc, số mẫu <= mốc)], tổng, số mẫu)}"""
+        return {name: histogram.snapshot() for name, histogram in self._histograms.items()}
+
+    @contextmanager
+    def timed(self, name):
+        """Đo thời gian khối lệnh: with monitor.timed(METRIC_SWIPE): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def series(self, name, window=120, bucket=2, mode='rate'):
+        """
+        Chuỗi giá trị theo từng khoảng bucket giây trong window giây gần nhất (cũ -> mới):
+        - rate: tổng mỗi khoảng / bucket (sự kiện/giây)
+        - mean: trung bình các mẫu trong khoảng (0 nếu không có mẫu)
+        - last: mẫu cuối của khoảng, khoảng trống lấy giá trị trước đó (giá trị đo như độ dài hàng đợi)
+        """
+        now = time.monotonic()
+        start = now - window
+        count = max(1, int(window / bucket))
+        sums = [0.0] * count
+        counts = [0] * count
+        lasts = [None] * count
+        ring = self._rings.get(name)
+        for timestamp, value in (ring.since(start) if ring else []):
+            index = min(count - 1, int((timestamp - start) / bucket))
+            sums[index] += value
+            counts[index] += 1
+            lasts[index] = value
+        if mode == 'rate':
+            return [total / bucket for total in sums]
+        if mode == 'mean':
+            return [total / n if n else 0.0 for total, n in zip(sums, counts)]
+        values, previous = [], 0.0
+        for value in lasts:
+            previous = value if value is not None else previous
+            values.append(previous)
+        return values
+
+    def total(self, name, window=60):
+        """Tổng các mẫu trong window giây gần nhất"""
+        ring = self._rings.get(name)
+        return sum(value for _, value in ring.since(time.monotonic() - window)) if ring else 0
+
+    def mean(self, name, window=60):
+        """Trung bình các mẫu trong window giây gần nhất (None nếu không có mẫu)"""
+        ring = self._rings.get(name)
+        samples = ring.since(time.monotonic() - window) if ring else []
+        return sum(value for _, value in samples) / len(samples) if samples else None
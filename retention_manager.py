@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import argparse
+import threading
+
+from Autoscreen import IMAGE_EXTENSIONS, EVICTED_DIR
+from upload_ledger import UploadLedger
+from fingerprint_cache import hash_file
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+class RetentionManager:
+    """
+    Dọn ổ đĩa: xóa ảnh local đã được xác nhận trên Google Drive (Drive file ID + MD5 khớp)
+    khi vượt quota dung lượng hoặc quá số ngày lưu, ảnh cũ nhất xóa trước.
+    Mỗi ảnh đã dọn để lại một file dấu vết trong <thư mục chi nhánh>/.evicted/ (thumbnail hoặc file rỗng)
+    để số thứ tự, thống kê và danh sách file vẫn đúng.
+    """
+
+    THUMBNAIL_SIZE = (160, 160)
+
+    def __init__(self, base_dir="shots", ledger=None, log_callback=None):
+        self.base_dir = os.path.abspath(base_dir)
+        self.ledger = ledger or UploadLedger()
+        self.log_callback = log_callback
+
+        # Cấu hình dọn dẹp
+        self.enabled = False
+        self.quota_gb = 20.0        # 0 = không giới hạn dung lượng
+        self.max_age_days = 0       # 0 = không giới hạn số ngày
+        self.keep_thumbnail = True
+        self.interval_seconds = 300
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'files_evicted': 0,
+            'bytes_freed': 0,
+            'last_run_time': None,
+            'disk_usage': 0,
+        }
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(f"🧹 {message}")
+        else:
+            print(f"Retention: {message}")
+
+    def disk_usage(self):
+        """Dung lượng thật đang dùng trong base_dir (hardlink chỉ tính một lần, bỏ qua .evicted)"""
+        seen, total = set(), 0
+        for dirpath, dirnames, filenames in os.walk(self.base_dir):
+            dirnames[:] = [d for d in dirnames if d != EVICTED_DIR]
+            for filename in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if key not in seen:
+                    seen.add(key)
+                    total += st.st_size
+        return total
+
+    def _is_still_confirmed(self, local_path):
+        """Kiểm tra lại file trước khi xóa: MD5 local vẫn khớp với bản trên Drive"""
+        if self.ledger.is_confirmed(local_path):
+            return True
+        entry = self.ledger.get(local_path)
+        if not entry or not entry['drive_md5'] or not os.path.exists(local_path):
+            return False
+        if entry['drive_md5'] != (entry['uploaded_md5'] or entry['md5']):
+            return False
+        # mtime đổi (ví dụ sau khi đưa vào kho chống trùng) -> so lại nội dung với file lúc upload (mmap)
+        return hash_file(local_path, 'md5') == entry['md5']
+
+    def _write_stub(self, local_path):
+        """Tạo file dấu vết trong .evicted/ (thumbnail nếu có Pillow, nếu không thì file rỗng)"""
+        folder, filename = os.path.split(local_path)
+        stub_dir = os.path.join(folder, EVICTED_DIR)
+        os.makedirs(stub_dir, exist_ok=True)
+        stub_path = os.path.join(stub_dir, filename)
+        tmp_path = stub_path + ".tmp"
+
+        if self.keep_thumbnail and PIL_AVAILABLE:
+            try:
+                with Image.open(local_path) as image:
+                    image.thumbnail(self.THUMBNAIL_SIZE)
+                    image.save(tmp_path, format=image.format or 'PNG')
+                os.replace(tmp_path, stub_path)
+                return stub_path
+            except Exception as e:
+                self.log_message(f"⚠️ Không tạo được thumbnail {filename}: {e}")
+
+        with open(tmp_path, 'wb'):
+            pass
+        os.replace(tmp_path, stub_path)
+        return stub_path
+
+    def _candidates(self):
+        """Các file đã xác nhận trên Drive, sắp xếp cũ nhất trước (theo thời gian chụp)"""
+        candidates = []
+        for local_path, size, uploaded_at in self.ledger.confirmed_files(self.base_dir):
+            if not local_path.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                st = os.stat(local_path)
+            except OSError:
+                continue
+            candidates.append((st.st_mtime, local_path, st))
+        candidates.sort()
+        return candidates
+
+    def run_once(self):
+        """Chạy một lượt dọn dẹp. Trả về (số file đã dọn, số byte giải phóng)"""
+        with self._lock:
+            usage = self.disk_usage()
+            quota_bytes = int(self.quota_gb * 1024 ** 3) if self.quota_gb else 0
+            age_cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days else None
+            store_dir = os.path.join(self.base_dir, ".store")
+            has_store = os.path.isdir(store_dir)
+
+            evicted, freed = 0, 0
+            for mtime, local_path, st in self._candidates():
+                over_quota = quota_bytes and usage - freed > quota_bytes
+                too_old = age_cutoff is not None and mtime < age_cutoff
+                if not over_quota and not too_old:
+                    # Danh sách đã sắp cũ -> mới, các file sau cũng không cần dọn
+                    break
+                try:
+                    if not self._is_still_confirmed(local_path):
+                        continue
+                    self._write_stub(local_path)
+                    os.remove(local_path)
+                except OSError as e:
+                    self.log_message(f"❌ Lỗi dọn {os.path.basename(local_path)}: {e}")
+                    continue
+
+                self.ledger.mark_evicted(local_path)
+                evicted += 1
+                # Hardlink tới blob trong kho: dung lượng được giải phóng khi GC xóa blob
+                if st.st_nlink == 1 or (has_store and st.st_nlink == 2):
+                    freed += st.st_size
+
+            if evicted and has_store:
+                from blob_store import BlobStore
+                store = BlobStore(self.base_dir, log_callback=self.log_callback)
+                try:
+                    store.gc()
+                finally:
+                    store.close()
+
+            self.stats['files_evicted'] += evicted
+            self.stats['bytes_freed'] += freed
+            self.stats['last_run_time'] = time.time()
+            self.stats['disk_usage'] = self.disk_usage() if evicted else usage
+
+        if evicted:
+            self.log_message(f"Đã dọn {evicted} file, giải phóng {freed / (1024 * 1024):.1f} MB "
+                             f"(đang dùng {self.stats['disk_usage'] / 1024 ** 3:.2f} GB)")
+        return evicted, freed
+
+    def start(self):
+        """Chạy dọn dẹp định kỳ trong luồng nền (không chặn luồng chụp)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+        self.log_message(f"🚀 Đã bật dọn dẹp tự động (quota {self.quota_gb} GB, "
+                         f"tối đa {self.max_age_days or '∞'} ngày)")
+
+    def stop(self):
+        """Dừng luồng dọn dẹp"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def _worker(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.log_message(f"❌ Lỗi dọn dẹp: {e}")
+            self._stop_event.wait(self.interval_seconds)
+
+    def save_config(self, config_file="retention_config.json"):
+        """Lưu cấu hình dọn dẹp"""
+        config = {
+            'enabled': self.enabled,
+            'quota_gb': self.quota_gb,
+            'max_age_days': self.max_age_days,
+            'keep_thumbnail': self.keep_thumbnail,
+            'interval_seconds': self.interval_seconds,
+        }
+        try:
+            with open(config_file, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2)
+        except Exception as e:
+            self.log_message(f"❌ Lỗi lưu cấu hình: {e}")
+
+    def load_config(self, config_file="retention_config.json"):
+        """Tải cấu hình dọn dẹp"""
+        try:
+            if os.path.exists(config_file):
+                with open(config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                self.enabled = config.get('enabled', False)
+                self.quota_gb = float(config.get('quota_gb', 20.0))
+                self.max_age_days = int(config.get('max_age_days', 0))
+                self.keep_thumbnail = config.get('keep_thumbnail', True)
+                self.interval_seconds = int(config.get('interval_seconds', 300))
+        except Exception as e:
+            self.log_message(f"❌ Lỗi tải cấu hình: {e}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Dọn ảnh local đã upload và xác nhận trên Google Drive")
+    ap.add_argument("--out", default="shots", help="Thư mục gốc lưu ảnh")
+    ap.add_argument("--quota-gb", type=float, default=None, help="Dung lượng tối đa (GB), 0 = không giới hạn")
+    ap.add_argument("--max-age-days", type=int, default=None, help="Số ngày giữ ảnh, 0 = không giới hạn")
+    ap.add_argument("--no-thumbnail", action="store_true", help="Không giữ thumbnail cho ảnh đã dọn")
+    args = ap.parse_args()
+
+    manager = RetentionManager(args.out)
+    manager.load_config()
+    if args.quota_gb is not None:
+        manager.quota_gb = args.quota_gb
+    if args.max_age_days is not None:
+        manager.max_age_days = args.max_age_days
+    if args.no_thumbnail:
+        manager.keep_thumbnail = False
+    try:
+        manager.run_once()
+        print(f"Đang dùng {manager.stats['disk_usage'] / 1024 ** 3:.2f} GB")
+    finally:
+        manager.ledger.close()
+
+if __name__ == "__main__":
+    main()
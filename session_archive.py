@@ -0,0 +1,382 @@
+import io
+import os
+import json
+import time
+import zlib
+import bisect
+import struct
+import sqlite3
+import hashlib
+import tarfile
+import threading
+from datetime import datetime
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+ARCHIVE_MIME_TYPES = {'tar': 'application/x-tar', 'zip': 'application/zip'}
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_JOB_SUFFIX = ".archive.json"  # File mô tả archive chờ upload (mục trong hàng đợi upload)
+
+# Cấu trúc header ZIP (chỉ dùng kiểu lưu không nén: ảnh PNG/WebP/AVIF đã nén sẵn)
+ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+ZIP_CENTRAL_DIR = struct.Struct("<4s4B4HL2L5H2L")
+ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+ZIP_LIMIT = 0xFFFFFFFF
+
+def _scan_file(path):
+    """Đọc file một lần: (kích thước, mtime, MD5, CRC32)"""
+    md5, crc, size = hashlib.md5(), 0, 0
+    with open(path, 'rb') as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            md5.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return size, mtime, md5.hexdigest(), crc
+
+def _dos_datetime(timestamp):
+    dt = datetime.fromtimestamp(max(timestamp, 315532800))  # ZIP không lưu được trước 1980
+    return (dt.hour << 11 | dt.minute << 5 | dt.second // 2,
+            (dt.year - 1980) << 9 | dt.month << 5 | dt.day)
+
+def _zip_name(name):
+    """Tên file trong ZIP: ASCII nếu được, nếu không thì UTF-8 kèm cờ 0x800"""
+    try:
+        return name.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return name.encode('utf-8'), 0x800
+
+def write_archive_job(job_dir, files, archive_format, archive_name, channel_name, branch_name):
+    """
+    Ghi mô tả một archive cần upload (danh sách ảnh, định dạng, thời điểm tạo) để đưa vào hàng đợi upload.
+    Archive dựng lại từ file này luôn ra cùng nội dung nên phiên resumable dùng tiếp được sau khi khởi động lại app
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    job_path = os.path.abspath(os.path.join(job_dir, archive_name + ARCHIVE_JOB_SUFFIX))
+    job = {
+        'archive_name': archive_name,
+        'format': archive_format,
+        'files': [os.path.abspath(path) for path in files],
+        'channel': channel_name,
+        'branch': branch_name,
+        'created_at': time.time(),
+    }
+    tmp_path = job_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, job_path)
+    return job_path
+
+def read_archive_job(job_path):
+    """Đọc file mô tả archive (FileNotFoundError nếu đã bị xóa)"""
+    with open(job_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def is_archive_job(path):
+    return path.endswith(ARCHIVE_JOB_SUFFIX)
+
+class ArchiveStream(io.RawIOBase):
+    """
+    File tar/zip "ảo": ghép header, dữ liệu ảnh (đọc thẳng từ file gốc) và manifest khi được đọc,
+    không tạo bản sao tạm trên đĩa. Seek được nên resumable upload gửi lại/gửi tiếp từ offset bất kỳ.
+    MD5 của cả archive được tính dần khi đọc tuần tự để so với md5Checksum của Drive.
+    """
+
+    def __init__(self, segments):
+        super().__init__()
+        # segments: [(vị trí bắt đầu, bytes) hoặc (vị trí bắt đầu, (đường dẫn, kích thước))]
+        self._segments = segments
+        self._starts = [start for start, _ in segments]
+        last_start, last = segments[-1]
+        self.size = last_start + (len(last) if isinstance(last, bytes) else last[1])
+        self._pos = 0
+        self._open_path, self._open_file = None, None
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def _read_segment(self, index, offset, length):
+        _, payload = self._segments[index]
+        if isinstance(payload, bytes):
+            return payload[offset:offset + length]
+        path, size = payload
+        if self._open_path != path:
+            if self._open_file:
+                self._open_file.close()
+            self._open_file, self._open_path = open(path, 'rb'), path
+        self._open_file.seek(offset)
+        data = self._open_file.read(min(length, size - offset))
+        if len(data) != min(length, size - offset):
+            raise IOError(f"File đã thay đổi trong lúc đóng gói: {path}")
+        return data
+
+    def read(self, size=-1):
+        if self._pos >= self.size:
+            return b''
+        end = self.size if size is None or size < 0 else min(self.size, self._pos + size)
+        parts, pos = [], self._pos
+        while pos < end:
+            index = bisect.bisect_right(self._starts, pos) - 1
+            start, payload = self._segments[index]
+            segment_size = len(payload) if isinstance(payload, bytes) else payload[1]
+            length = min(end, start + segment_size) - pos
+            parts.append(self._read_segment(index, pos - start, length))
+            pos += length
+        data = b''.join(parts)
+        # Chỉ cộng vào MD5 phần chưa hash (đọc lại khi gửi lại chunk không bị tính hai lần)
+        if self._pos <= self._hashed < end:
+            self._md5.update(data[self._hashed - self._pos:])
+            self._hashed = end
+        self._pos = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    @property
+    def md5(self):
+        """MD5 của cả archive, None nếu chưa đọc tuần tự hết (ví dụ upload tiếp từ giữa phiên)"""
+        return self._md5.hexdigest() if self._hashed == self.size else None
+
+    def close(self):
+        if self._open_file:
+            self._open_file.close()
+            self._open_file, self._open_path = None, None
+        super().close()
+
+class SessionArchive:
+    """
+    Gói các ảnh của một phiên chụp thành một file tar hoặc zip (không nén) để upload một lần.
+    manifest.json (thành phần cuối) ghi tên, kích thước, MD5 và vị trí byte của từng ảnh trong archive
+    để sau này lấy riêng một ảnh bằng request Range mà không tải cả archive.
+    """
+
+    def __init__(self, files, archive_format='tar', metadata=None, created_at=None):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Định dạng archive không hỗ trợ: {archive_format}")
+        self.archive_format = archive_format
+        self.metadata = dict(metadata or {})
+        # Cùng ảnh + cùng created_at -> cùng nội dung từng byte (để upload tiếp phiên resumable)
+        self.created_at = created_at if created_at is not None else time.time()
+        self.frames = []
+        seen = set()
+        for path in files:
+            name = os.path.basename(path)
+            if name in seen or name == MANIFEST_NAME:
+                continue
+            seen.add(name)
+            size, mtime, md5, crc = _scan_file(path)
+            self.frames.append({'name': name, 'local_path': os.path.abspath(path), 'size': size,
+                                'mtime': mtime, 'md5': md5, 'crc32': crc})
+        if not self.frames:
+            raise ValueError("Không có ảnh nào để đóng gói")
+        self.mimetype = ARCHIVE_MIME_TYPES[archive_format]
+        self._segments = self._build_tar() if archive_format == 'tar' else self._build_zip()
+
+    def manifest(self):
+        """Nội dung manifest.json (offset đã tính xong khi dựng archive)"""
+        return {
+            'format': self.archive_format,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(timespec='seconds'),
+            **self.metadata,
+            'frames': [{key: frame[key] for key in ('name', 'size', 'md5', 'mtime', 'data_offset')}
+                       for frame in self.frames],
+        }
+
+    def open(self):
+        """Stream đọc archive (mỗi lần upload mở một stream mới)"""
+        return ArchiveStream(self._segments)
+
+    def fingerprint(self):
+        """MD5 của manifest: đổi khi danh sách ảnh hoặc nội dung ảnh đổi (phiên resumable cũ không dùng được nữa)"""
+        return hashlib.md5(json.dumps(self.manifest(), sort_keys=True).encode('utf-8')).hexdigest()
+
+    def compute_md5(self):
+        """Đọc lại cả archive để tính MD5 (khi upload tiếp từ giữa phiên, stream không đọc tuần tự từ đầu)"""
+        stream = self.open()
+        try:
+            while stream.read(1024 * 1024):
+                pass
+            return stream.md5
+        finally:
+            stream.close()
+
+    @property
+    def size(self):
+        start, payload = self._segments[-1]
+        return start + (len(payload) if isinstance(payload, bytes) else payload[1])
+
+    def _build_tar(self):
+        segments, pos = [], 0
+
+        def add(payload, length):
+            nonlocal pos
+            segments.append((pos, payload))
+            pos += length
+
+        def add_member(name, size, mtime, payload):
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime, info.mode = size, int(mtime), 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            add(header, len(header))
+            data_offset = pos
+            add(payload, size)
+            padding = -size % tarfile.BLOCKSIZE
+            if padding:
+                add(b'\0' * padding, padding)
+            return data_offset
+
+        for frame in self.frames:
+            frame['data_offset'] = add_member(frame['name'], frame['size'], frame['mtime'],
+                                              (frame['local_path'], frame['size']))
+        manifest = json.dumps(self.manifest(), ensure_ascii=False, indent=2).encode('utf-8')
+        add_member(MANIFEST_NAME, len(manifest), self.created_at, manifest)
+        # Hai block rỗng kết thúc archive, làm tròn theo record size của tar
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(pos + end) % tarfile.RECORDSIZE
+        add(b'\0' * end, end)
+        return segments
+
+    def _build_zip(self):
+        segments, central, pos = [], [], 0
+
+        def add(payload, length):
+            nonlocal pos
+            segments.append((pos, payload))
+            pos += length
+
+        def add_member(name, size, mtime, crc, payload):
+            if size > ZIP_LIMIT or pos > ZIP_LIMIT:
+                raise ValueError("Archive zip quá 4 GB, hãy dùng định dạng tar")
+            filename, flags = _zip_name(name)
+            dostime, dosdate = _dos_datetime(mtime)
+            header_offset = pos
+            header = ZIP_LOCAL_HEADER.pack(b"PK\003\004", 20, 0, flags, 0, dostime, dosdate,
+                                           crc, size, size, len(filename), 0) + filename
+            add(header, len(header))
+            data_offset = pos
+            add(payload, size)
+            central.append(ZIP_CENTRAL_DIR.pack(b"PK\001\002", 20, 3, 20, 0, flags, 0, dostime, dosdate,
+                                                crc, size, size, len(filename), 0, 0, 0, 0,
+                                                0o100644 << 16, header_offset) + filename)
+            return data_offset
+
+        for frame in self.frames:
+            frame['data_offset'] = add_member(frame['name'], frame['size'], frame['mtime'], frame['crc32'],
+                                              (frame['local_path'], frame['size']))
+        manifest = json.dumps(self.manifest(), ensure_ascii=False, indent=2).encode('utf-8')
+        add_member(MANIFEST_NAME, len(manifest), self.created_at, zlib.crc32(manifest), manifest)
+
+        central_offset = pos
+        central_dir = b''.join(central)
+        if central_offset + len(central_dir) > ZIP_LIMIT or len(central) > 0xFFFF:
+            raise ValueError("Archive zip quá lớn, hãy dùng định dạng tar")
+        end_record = ZIP_END_RECORD.pack(b"PK\005\006", 0, 0, len(central), len(central),
+                                         len(central_dir), central_offset, 0)
+        add(central_dir + end_record, len(central_dir) + len(end_record))
+        return segments
+
+class ArchiveIndex:
+    """
+    Sổ (SQLite) các archive đã upload và vị trí từng ảnh bên trong,
+    để tìm lại một ảnh (theo tên hoặc đường dẫn local) nằm trong archive nào trên Drive.
+    """
+
+    def __init__(self, db_file="archive_index.db"):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS archives ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " drive_file_id TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " format TEXT NOT NULL,"
+            " channel_name TEXT,"
+            " branch_name TEXT,"
+            " folder_id TEXT,"
+            " size INTEGER NOT NULL,"
+            " md5 TEXT,"
+            " drive_md5 TEXT,"
+            " uploaded_at REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            " archive_id INTEGER NOT NULL,"
+            " name TEXT NOT NULL,"
+            " local_path TEXT,"
+            " size INTEGER NOT NULL,"
+            " md5 TEXT NOT NULL,"
+            " data_offset INTEGER NOT NULL,"
+            " PRIMARY KEY (archive_id, name))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_frames_name ON frames(name)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_frames_path ON frames(local_path)")
+        self._db.commit()
+
+    def record(self, archive, name, drive_file_id, folder_id=None, md5=None, drive_md5=None,
+               channel_name=None, branch_name=None):
+        """Ghi archive vừa upload và vị trí các ảnh. Trả về ID trong sổ"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO archives (drive_file_id, name, format, channel_name, branch_name, folder_id,"
+                " size, md5, drive_md5, uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (drive_file_id, name, archive.archive_format, channel_name, branch_name, folder_id,
+                 archive.size, md5, drive_md5, time.time()))
+            archive_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO frames (archive_id, name, local_path, size, md5, data_offset) VALUES (?, ?, ?, ?, ?, ?)",
+                [(archive_id, frame['name'], frame['local_path'], frame['size'], frame['md5'], frame['data_offset'])
+                 for frame in archive.frames])
+            self._db.commit()
+            return archive_id
+
+    def locate(self, name_or_path):
+        """
+        Tìm ảnh trong các archive (theo tên file hoặc đường dẫn local), archive mới nhất trước.
+        Trả về [{drive_file_id, archive_name, name, size, md5, data_offset}]
+        """
+        column = 'local_path' if os.sep in name_or_path or '/' in name_or_path else 'name'
+        value = os.path.abspath(name_or_path) if column == 'local_path' else name_or_path
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT a.drive_file_id, a.name, f.name, f.size, f.md5, f.data_offset FROM frames f"
+                f" JOIN archives a ON a.id = f.archive_id WHERE f.{column} = ? ORDER BY a.id DESC",
+                (value,)).fetchall()
+        keys = ('drive_file_id', 'archive_name', 'name', 'size', 'md5', 'data_offset')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def checksums(self):
+        """MD5 của các archive đã upload: {Drive file ID: MD5}"""
+        with self._lock:
+            return dict(self._db.execute("SELECT drive_file_id, md5 FROM archives"))
+
+    def archives(self):
+        """Danh sách archive đã upload: [(tên, định dạng, số ảnh, kích thước, thời điểm upload)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT a.name, a.format, COUNT(f.name), a.size, a.uploaded_at FROM archives a"
+                " LEFT JOIN frames f ON f.archive_id = a.id GROUP BY a.id ORDER BY a.id").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,252 @@
+import os
+import time
+import errno
+import shutil
+import threading
+from datetime import datetime
+
+from fingerprint_cache import hash_file
+from image_transcoder import smallest_variant
+
+# Loại nơi lưu (khóa "type" trong storage_backends của drive_config.json)
+BACKEND_DRIVE = 'drive'
+BACKEND_LOCAL = 'local'
+
+# Lỗi copy trong kernel không hỗ trợ (khác filesystem, hệ điều hành cũ...) -> chuyển sang cách khác
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP}
+
+def _copy_loop(copy_chunk, size):
+    """Gọi copy_chunk(số byte) tới khi đủ size. Trả về số byte đã copy"""
+    copied = 0
+    while copied < size:
+        sent = copy_chunk(min(size - copied, 1 << 30))
+        if not sent:
+            break
+        copied += sent
+    return copied
+
+def fast_copy(src, dst):
+    """
+    Copy file không qua bộ nhớ của Python: copy_file_range (Linux, server-side copy trên NFS/SMB),
+    sau đó sendfile, cuối cùng copy theo khối 1 MB (Windows). Trả về tên cách đã dùng
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(in_fd).st_size
+        if hasattr(os, 'copy_file_range'):
+            try:
+                if _copy_loop(lambda count: os.copy_file_range(in_fd, out_fd, count), size) >= size:
+                    return 'copy_file_range'
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS or fdst.tell():
+                    raise
+        if hasattr(os, 'sendfile') and os.name == 'posix':
+            try:
+                offset = fsrc.tell()
+                copied = _copy_loop(lambda count: os.sendfile(out_fd, in_fd, None, count), size - offset)
+                if offset + copied >= size:
+                    return 'sendfile'
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS or fdst.tell():
+                    raise
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        return 'copy'
+
+class StorageBackend:
+    """
+    Nơi lưu ảnh upload (Drive, thư mục local/NAS...). Mỗi backend có:
+    - put(local_path, channel_name, branch_name, name, upload_item): lưu file, trả về
+      {id, name, md5Checksum, size, skipped} (skipped=True nếu nội dung đã có sẵn)
+    - exists / list / verify để kiểm tra file đã lưu
+    Thống kê riêng cho từng backend (số file, MB, thời gian) do hàng đợi ghi qua record()
+    """
+
+    type_name = None
+
+    def __init__(self, name=None):
+        self.name = name or self.type_name
+        self._stats_lock = threading.Lock()
+        self.stats = {'stored': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def is_ready(self):
+        """Backend dùng được ngay (đã xác thực, ổ NAS đã mount...)"""
+        return True
+
+    def put(self, local_path, channel_name, branch_name, name=None, upload_item=None):
+        raise NotImplementedError
+
+    def list(self, channel_name, branch_name):
+        """File đã lưu của chi nhánh, gom theo tên: {tên: [{id, name, md5Checksum, size}]}"""
+        raise NotImplementedError
+
+    def exists(self, channel_name, branch_name, name, md5=None):
+        """Đã có file cùng tên (và cùng MD5 nếu truyền vào)"""
+        return any(md5 is None or item.get('md5Checksum') == md5
+                   for item in self.list(channel_name, branch_name).get(name, []))
+
+    def verify(self, item_id, md5):
+        """Bản đã lưu (theo id trả về từ put) có đúng MD5 không"""
+        raise NotImplementedError
+
+    def record(self, result, size, seconds, error=None):
+        """Ghi thống kê một lần put"""
+        with self._stats_lock:
+            if error is not None:
+                self.stats['failed'] += 1
+            elif result and result.get('skipped'):
+                self.stats['skipped'] += 1
+            else:
+                self.stats['stored'] += 1
+                self.stats['bytes'] += size
+            self.stats['seconds'] += seconds
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['mb_per_second'] = stats['bytes'] / (1024 * 1024) / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (f"{stats['stored']} file mới, {stats['skipped']} đã có, {stats['failed']} lỗi, "
+                f"{stats['bytes'] / (1024 * 1024):.1f} MB, {stats['mb_per_second']:.2f} MB/s")
+
+    def describe(self):
+        return self.name
+
+    def to_config(self):
+        return {'type': self.type_name, 'name': self.name}
+
+    def close(self):
+        pass
+
+class DriveBackend(StorageBackend):
+    """Google Drive qua GoogleDriveUploader (cấu trúc folder, nén khi upload, sổ upload, resumable)"""
+
+    type_name = BACKEND_DRIVE
+
+    def __init__(self, uploader, name=None):
+        super().__init__(name)
+        self.uploader = uploader
+
+    def is_ready(self):
+        return self.uploader.service is not None
+
+    def put(self, local_path, channel_name, branch_name, name=None, upload_item=None):
+        item = upload_item or {'id': None, 'file_path': local_path, 'channel_name': channel_name,
+                               'branch_name': branch_name, 'custom_name': name,
+                               'session_uri': None, 'session_offset': 0, 'session_size': None}
+        return self.uploader._process_upload_item(item)
+
+    def list(self, channel_name, branch_name):
+        folder_id = self.uploader.get_or_create_folder_structure(channel_name, branch_name, create=False)
+        if not folder_id:
+            return {}
+        return self.uploader._get_remote_listing(folder_id)
+
+    def verify(self, item_id, md5):
+        file = self.uploader.scheduler.call(
+            self.uploader.service.files().get(fileId=item_id, fields='id, md5Checksum, trashed').execute)
+        return not file.get('trashed') and file.get('md5Checksum') == md5
+
+    def describe(self):
+        return f"{self.name} (Google Drive)"
+
+class LocalBackend(StorageBackend):
+    """
+    Thư mục local hoặc ổ mạng (NAS) đã mount: <root>/<ngày>/<kênh>/<chi nhánh>/<tên file>, cùng cấu trúc với Drive.
+    Copy trong kernel (copy_file_range/sendfile), ghi file tạm rồi đổi tên; file đích cùng kích thước và thời gian
+    sửa thì coi như đã có. Không cần mạng nên cũng dùng làm đích kiểm thử offline cho hàng đợi upload
+    """
+
+    type_name = BACKEND_LOCAL
+
+    def __init__(self, root, name=None, create_date_folders=True):
+        super().__init__(name)
+        self.root = os.path.abspath(root)
+        self.create_date_folders = create_date_folders
+        self.copy_methods = {}  # Cách copy -> số file
+
+    def is_ready(self):
+        return os.path.isdir(self.root)
+
+    def _folder(self, channel_name, branch_name, date=None):
+        parts = [self.root]
+        if self.create_date_folders:
+            parts.append(date or datetime.now().strftime("%Y-%m-%d"))
+        parts.extend([channel_name or "_", branch_name or "_"])
+        return os.path.join(*parts)
+
+    def put(self, local_path, channel_name, branch_name, name=None, upload_item=None):
+        if not self.is_ready():
+            raise ConnectionError(f"Không truy cập được thư mục lưu: {self.root}")
+        # Cùng bản với Drive: bản nhỏ nhất đã nén lúc chụp, đuôi tên theo file thật được copy
+        local_path = smallest_variant(local_path)
+        name = os.path.splitext(name)[0] + os.path.splitext(local_path)[1] if name else os.path.basename(local_path)
+        folder = self._folder(channel_name, branch_name)
+        dst = os.path.join(folder, name)
+        st = os.stat(local_path)
+        try:
+            existing = os.stat(dst)
+        except FileNotFoundError:
+            existing = None
+        if existing and existing.st_size == st.st_size and existing.st_mtime_ns == st.st_mtime_ns:
+            # Đã copy trước đó (giữ nguyên thời gian sửa của file gốc), không đọc lại nội dung
+            return {'id': dst, 'name': name, 'md5Checksum': None, 'size': st.st_size, 'skipped': True}
+
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, f".{name}.part")
+        try:
+            method = fast_copy(local_path, tmp_path)
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, dst)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._stats_lock:
+            self.copy_methods[method] = self.copy_methods.get(method, 0) + 1
+        return {'id': dst, 'name': name, 'md5Checksum': None, 'size': st.st_size, 'skipped': False}
+
+    def list(self, channel_name, branch_name):
+        folder = self._folder(channel_name, branch_name)
+        listing = {}
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    listing[entry.name] = [{'id': entry.path, 'name': entry.name,
+                                            'md5Checksum': hash_file(entry.path, 'md5'),
+                                            'size': entry.stat().st_size}]
+        return listing
+
+    def exists(self, channel_name, branch_name, name, md5=None):
+        path = os.path.join(self._folder(channel_name, branch_name), name)
+        if not os.path.isfile(path):
+            return False
+        return md5 is None or hash_file(path, 'md5') == md5
+
+    def verify(self, item_id, md5):
+        return os.path.isfile(item_id) and hash_file(item_id, 'md5') == md5
+
+    def get_stats(self):
+        stats = super().get_stats()
+        with self._stats_lock:
+            stats['copy_methods'] = dict(self.copy_methods)
+        return stats
+
+    def describe(self):
+        return f"{self.name} ({self.root})"
+
+    def to_config(self):
+        return dict(super().to_config(), path=self.root, create_date_folders=self.create_date_folders)
+
+def create_backend(config, uploader):
+    """Tạo backend từ một mục cấu hình {"type": "drive"} / {"type": "local", "path": "...", "name": "nas"}"""
+    backend_type = config.get('type')
+    if backend_type == BACKEND_DRIVE:
+        return DriveBackend(uploader, config.get('name'))
+    if backend_type == BACKEND_LOCAL:
+        if not config.get('path'):
+            raise ValueError("Backend local cần 'path'")
+        return LocalBackend(config['path'], config.get('name'), config.get('create_date_folders', True))
+    raise ValueError(f"Loại nơi lưu không hỗ trợ: {backend_type}")
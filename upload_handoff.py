@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import shutil
+import threading
+from collections import deque
+
+from upload_queue import LANE_LIVE
+
+class UploadHandoff:
+    """
+    Cầu nối giữa luồng chụp và hàng đợi upload: luồng chụp chỉ thêm vào một bộ đệm trong bộ nhớ có giới hạn
+    (không chờ khóa SQLite, không gọi mạng). Một luồng nền chuyển bộ đệm vào upload_queue.db theo lô.
+    Khi bộ đệm đầy (đĩa/hàng đợi chậm), mục mới được ghi nối vào file spool trên đĩa và nạp lại sau
+    từng lô batch_size mục, nên bộ nhớ không tăng mãi và luồng chụp không bao giờ bị chặn.
+    Vị trí đã nạp được lưu sau mỗi lô đã vào hàng đợi; file spool chỉ bị xóa khi mọi mục đã vào hàng đợi.
+    """
+
+    def __init__(self, upload_queue, max_items=256, spool_file="upload_spool.jsonl",
+                 batch_size=100, on_enqueued=None, log_callback=None):
+        self.upload_queue = upload_queue
+        self.max_items = max(1, max_items)
+        self.spool_file = spool_file
+        self.batch_size = batch_size
+        self.on_enqueued = on_enqueued  # Gọi (trong luồng nền) sau khi có mục mới vào hàng đợi
+        self.log_callback = log_callback
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self._thread = None
+        self.stats = {'offered': 0, 'spooled': 0, 'enqueued': 0, 'max_buffered': 0}
+        self._spooled_pending = 0
+        if self._spool_pending():
+            # Mục spool còn lại từ lần chạy trước
+            for path, offset in ((self.spool_file + ".loading", self._read_spool_offset()), (self.spool_file, 0)):
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        self._spooled_pending += sum(1 for _ in f)
+            self._idle.clear()
+            self._wakeup.set()
+            self._ensure_thread()
+
+    def log_message(self, message):
+        """Ghi log message"""
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            print(f"Upload handoff: {message}")
+
+    def offer(self, file_path, channel_name, branch_name, custom_name=None, lane=LANE_LIVE):
+        """Thêm file cần upload, không bao giờ chặn lâu (gọi từ luồng chụp)"""
+        item = (file_path, channel_name, branch_name, custom_name, lane)
+        with self._lock:
+            self.stats['offered'] += 1
+            self._idle.clear()
+            if len(self._buffer) < self.max_items and not self._spool_pending():
+                self._buffer.append(item)
+                self.stats['max_buffered'] = max(self.stats['max_buffered'], len(self._buffer))
+            else:
+                # Bộ đệm đầy (hoặc spool còn mục cũ, giữ đúng thứ tự): ghi nối vào spool
+                with open(self.spool_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self.stats['spooled'] += 1
+                self._spooled_pending += 1
+        self._wakeup.set()
+        self._ensure_thread()
+
+    def _spool_pending(self):
+        return os.path.exists(self.spool_file) or os.path.exists(self.spool_file + ".loading")
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+            try:
+                while self._drain_once():
+                    pass
+            except Exception as e:
+                self.log_message(f"⚠️ Lỗi chuyển file vào hàng đợi upload, sẽ thử lại: {e}")
+                time.sleep(1.0)
+                self._wakeup.set()
+                continue
+            with self._lock:
+                if not self._buffer and not self._spool_pending():
+                    self._idle.set()
+
+    def _drain_once(self):
+        """Chuyển một lô từ bộ đệm (hoặc spool khi bộ đệm trống) vào hàng đợi. Trả về False nếu không còn gì"""
+        with self._lock:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        spool_end = None
+        if not batch:
+            batch, spool_end = self._load_spool()
+            if not batch:
+                return False
+        try:
+            added = self.upload_queue.put_many(batch)
+        except Exception:
+            if spool_end is None:
+                # Trả lô về đầu bộ đệm để lần sau thử lại (lô từ spool thì đọc lại từ file)
+                with self._lock:
+                    self._buffer.extendleft(reversed(batch))
+            raise
+        if spool_end is not None:
+            self._commit_spool(spool_end, len(batch))
+        self.stats['enqueued'] += len(batch)
+        if added and self.on_enqueued:
+            self.on_enqueued()
+        return True
+
+    def _load_spool(self):
+        """
+        Đọc lô tiếp theo (tối đa batch_size mục) từ spool, bắt đầu từ vị trí đã lưu.
+        Spool được đổi tên thành .loading trước để offer ghi sang file mới.
+        Trả về (danh sách mục, vị trí byte sau lô); danh sách rỗng nếu không còn gì
+        """
+        loading = self.spool_file + ".loading"
+        with self._lock:
+            if not os.path.exists(loading):
+                if not os.path.exists(self.spool_file):
+                    return [], 0
+                os.replace(self.spool_file, loading)
+                self._write_spool_offset(0)
+        items = []
+        with open(loading, 'rb') as f:
+            f.seek(self._read_spool_offset())
+            while len(items) < self.batch_size:
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    items.append(tuple(json.loads(line)))
+                except ValueError:
+                    continue  # Dòng ghi dở khi app bị tắt
+            end = f.tell()
+        if not items:
+            self._commit_spool(end, 0)  # Chỉ còn dòng hỏng
+        return items, end
+
+    def _commit_spool(self, end, count):
+        """Lô từ spool đã vào hàng đợi: lưu vị trí đọc, hết file thì xóa spool"""
+        loading = self.spool_file + ".loading"
+        with self._lock:
+            self._spooled_pending = max(0, self._spooled_pending - count)
+        if end >= os.path.getsize(loading):
+            os.remove(loading)
+            self._write_spool_offset(0)
+        else:
+            self._write_spool_offset(end)
+
+    def _read_spool_offset(self):
+        try:
+            with open(self.spool_file + ".offset", 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_spool_offset(self, offset):
+        path = self.spool_file + ".offset"
+        if not offset:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+        os.replace(path + ".tmp", path)
+
+    def pending(self):
+        """Số mục chưa vào hàng đợi: (trong bộ nhớ, đã ghi ra spool)"""
+        with self._lock:
+            return len(self._buffer), self._spooled_pending
+
+    def flush(self, timeout=5.0):
+        """Chờ mọi mục đã vào hàng đợi upload. Trả về True nếu xong trước timeout"""
+        self._wakeup.set()
+        return self._idle.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Chuyển nốt các mục còn lại rồi dừng luồng nền (mục chưa kịp chuyển vẫn nằm trong spool)"""
+        self.flush(timeout)
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)  # Không để luồng nền đọc spool trong lúc ghi lại
+        with self._lock:
+            remaining = list(self._buffer)
+            self._buffer.clear()
+            if remaining:
+                self._spool_in_front(remaining)
+                self._spooled_pending += len(remaining)
+
+    def _spool_in_front(self, items):
+        """
+        Ghi các mục còn trong bộ đệm vào trước mọi mục đã spool: bộ đệm chỉ nhận mục khi không có spool,
+        nên mục trong bộ đệm luôn cũ hơn. Ghi thành file .loading mới (mục bộ đệm + phần chưa nạp của .loading cũ),
+        file spool (mới hơn) chỉ được nạp sau khi .loading hết
+        """
+        loading = self.spool_file + ".loading"
+        tmp_path = loading + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for item in items:
+                f.write((json.dumps(item, ensure_ascii=False) + "\n").encode('utf-8'))
+            if os.path.exists(loading):
+                with open(loading, 'rb') as old:
+                    old.seek(self._read_spool_offset())
+                    shutil.copyfileobj(old, f)
+        # Xóa vị trí đọc trước khi thay file: tắt ngang giữa hai bước chỉ làm nạp lại vài mục (put_many bỏ qua mục trùng)
+        self._write_spool_offset(0)
+        os.replace(tmp_path, loading)
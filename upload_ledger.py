@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+import threading
+
+class UploadLedger:
+    """
+    Sổ ghi (SQLite) các file đã upload lên Google Drive: file local, MD5, Drive file ID, folder ID
+    và md5Checksum Drive trả về. File được coi là đã xác nhận khi md5Checksum khớp với MD5 của bản đã gửi
+    (uploaded_md5 nếu ảnh được nén lúc upload, nếu không thì MD5 của file local).
+    """
+
+    def __init__(self, db_file="upload_ledger.db"):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " local_path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " md5 TEXT NOT NULL,"
+            " drive_file_id TEXT NOT NULL,"
+            " drive_name TEXT,"
+            " folder_id TEXT,"
+            " drive_md5 TEXT,"
+            " uploaded_at REAL NOT NULL,"
+            " evicted_at REAL)")
+        # Sổ tạo trước khi có kênh/chi nhánh (để upload lại), thời điểm kiểm tra gần nhất và MD5 bản nén đã gửi
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(uploads)")]
+        for column, column_type in (('channel_name', 'TEXT'), ('branch_name', 'TEXT'), ('verified_at', 'REAL'),
+                                    ('uploaded_md5', 'TEXT')):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE uploads ADD COLUMN {column} {column_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_uploads_folder ON uploads(folder_id, drive_name)")
+        self._db.commit()
+
+    def record_upload(self, local_path, md5, drive_file_id, folder_id=None, drive_md5=None, drive_name=None,
+                      channel_name=None, branch_name=None, uploaded_md5=None):
+        """
+        Ghi nhận một file đã có trên Drive.
+        uploaded_md5: MD5 của bản đã gửi khi khác file local (ảnh nén lúc upload), None nếu gửi nguyên file
+        """
+        st = os.stat(local_path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads (local_path, size, mtime_ns, md5, drive_file_id, drive_name,"
+                " folder_id, drive_md5, uploaded_at, evicted_at, channel_name, branch_name, verified_at,"
+                " uploaded_md5) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, NULL, ?)",
+                (os.path.abspath(local_path), st.st_size, st.st_mtime_ns, md5, drive_file_id,
+                 drive_name or os.path.basename(local_path), folder_id, drive_md5, time.time(),
+                 channel_name, branch_name, uploaded_md5))
+            self._db.commit()
+
+    def get(self, local_path):
+        """Thông tin upload của file local, hoặc None"""
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM uploads WHERE local_path = ?", (os.path.abspath(local_path),))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def find_uploaded(self, local_path, md5, folder_id, drive_name):
+        """
+        Kiểm tra trùng trước khi upload, không cần gọi API.
+        Trả về Drive file ID nếu cùng nội dung đã có trong folder (theo file local hoặc theo tên), ngược lại None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT drive_file_id FROM uploads WHERE local_path = ? AND md5 = ? AND folder_id IS ?",
+                (os.path.abspath(local_path), md5, folder_id)).fetchone()
+            if not row:
+                # Cùng nội dung, cùng tên nhưng từ đường dẫn local khác (ví dụ thư mục đã đổi tên)
+                row = self._db.execute(
+                    "SELECT drive_file_id FROM uploads WHERE folder_id IS ? AND drive_name = ? AND md5 = ?",
+                    (folder_id, drive_name, md5)).fetchone()
+        return row[0] if row else None
+
+    def is_confirmed(self, local_path):
+        """File đã có trên Drive với MD5 khớp và chưa bị sửa từ lúc upload"""
+        entry = self.get(local_path)
+        if not entry or not entry['drive_md5'] or entry['drive_md5'] != (entry['uploaded_md5'] or entry['md5']):
+            return False
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            return False
+        return st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']
+
+    def confirmed_files(self, base_dir=None):
+        """Danh sách (local_path, size, uploaded_at) đã xác nhận trên Drive và chưa bị dọn"""
+        query = ("SELECT local_path, size, uploaded_at FROM uploads"
+                 " WHERE evicted_at IS NULL AND drive_md5 IS NOT NULL AND drive_md5 = COALESCE(uploaded_md5, md5)")
+        params = ()
+        if base_dir:
+            query += " AND local_path LIKE ?"
+            params = (os.path.join(os.path.abspath(base_dir), '') + '%',)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def entries(self, base_dir=None):
+        """Các file đã upload và chưa bị dọn (để kiểm tra lại với Drive): [dict]"""
+        query = "SELECT * FROM uploads WHERE evicted_at IS NULL"
+        params = ()
+        if base_dir:
+            query += " AND local_path LIKE ?"
+            params = (os.path.join(os.path.abspath(base_dir), '') + '%',)
+        with self._lock:
+            cursor = self._db.execute(query + " ORDER BY local_path", params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def mark_verified(self, local_paths, verified_at=None):
+        """Ghi thời điểm đã kiểm tra khớp với Drive"""
+        verified_at = verified_at or time.time()
+        with self._lock:
+            self._db.executemany("UPDATE uploads SET verified_at = ? WHERE local_path = ?",
+                                 [(verified_at, os.path.abspath(path)) for path in local_paths])
+            self._db.commit()
+
+    def forget(self, local_path):
+        """Xóa bản ghi (bản trên Drive hỏng/mất, file sẽ được upload lại)"""
+        with self._lock:
+            self._db.execute("DELETE FROM uploads WHERE local_path = ?", (os.path.abspath(local_path),))
+            self._db.commit()
+
+    def mark_evicted(self, local_path):
+        """Đánh dấu file local đã bị dọn (chỉ còn trên Drive)"""
+        with self._lock:
+            self._db.execute("UPDATE uploads SET evicted_at = ? WHERE local_path = ?",
+                             (time.time(), os.path.abspath(local_path)))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
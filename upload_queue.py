@@ -0,0 +1,345 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+
+# Trạng thái của một mục trong hàng đợi upload
+STATE_PENDING = 'pending'      # Chờ upload (có thể đang chờ tới lượt thử lại)
+STATE_IN_FLIGHT = 'in_flight'  # Một worker đang upload
+STATE_DONE = 'done'            # Đã upload xong
+STATE_FAILED = 'failed'        # Hết số lần thử (dead-letter), chờ người dùng cho thử lại
+
+# Làn ưu tiên: ảnh vừa chụp (live) không phải chờ sau hàng nghìn ảnh cũ đang upload bù (backfill)
+LANE_LIVE = 'live'
+LANE_BACKFILL = 'backfill'
+LANES = (LANE_LIVE, LANE_BACKFILL)
+
+class DurableUploadQueue:
+    """
+    Hàng đợi upload lưu trên đĩa (SQLite WAL): không mất file khi tắt app, crash hoặc mất mạng.
+    File lỗi được thử lại với thời gian chờ tăng dần (exponential backoff); quá số lần thử thì
+    chuyển sang trạng thái failed (dead-letter). Lỗi mất mạng không tính vào số lần thử.
+    Hai làn ưu tiên: live được lấy trước (cứ live_weight mục live thì nhường một lượt cho backfill
+    để backfill không bị treo), trong mỗi làn lấy xoay vòng theo chi nhánh.
+    """
+
+    def __init__(self, db_file="upload_queue.db", max_attempts=8, base_delay=5.0, max_delay=600.0,
+                 live_weight=4):
+        self.db_file = db_file
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.live_weight = live_weight
+        self._live_streak = 0   # Số mục live liên tiếp đã lấy trong khi backfill đang chờ
+        self._last_branch = {}  # Làn -> chi nhánh vừa được lấy (để xoay vòng)
+        # Thời gian chờ (từ lúc vào hàng đợi tới lúc bắt đầu upload) theo làn
+        self._wait_stats = {lane: {'claimed': 0, 'avg_wait': 0.0, 'max_wait': 0.0} for lane in LANES}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " file_path TEXT NOT NULL,"
+            " channel_name TEXT,"
+            " branch_name TEXT,"
+            " custom_name TEXT,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " session_uri TEXT,"        # Phiên resumable upload đang dở (nếu có)
+            " session_offset INTEGER,"  # Số byte server đã nhận
+            " session_size INTEGER)")   # Kích thước file lúc mở phiên
+        # Hàng đợi tạo trước khi có cột phiên resumable
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(items)")]
+        for column, column_type in (('session_uri', 'TEXT'), ('session_offset', 'INTEGER'), ('session_size', 'INTEGER'),
+                                    ('lane', f"TEXT NOT NULL DEFAULT '{LANE_LIVE}'"),
+                                    ('backends_done', 'TEXT'),  # Nơi lưu đã nhận file (cách nhau dấu phẩy)
+                                    ('session_md5', 'TEXT')):  # MD5 file lúc mở phiên (file đổi thì không gửi tiếp)
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE items ADD COLUMN {column} {column_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_items_state ON items(state, next_attempt_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_items_lane ON items(state, lane, branch_name, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_items_path ON items(file_path, state)")
+        self._db.commit()
+
+    def recover(self):
+        """Khi khởi động: mục đang upload dở (app bị tắt/crash) được đưa lại về pending"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE items SET state = ?, next_attempt_at = 0, updated_at = ? WHERE state = ?",
+                (STATE_PENDING, time.time(), STATE_IN_FLIGHT))
+            self._db.commit()
+            return cursor.rowcount
+
+    def put(self, file_path, channel_name, branch_name, custom_name=None, lane=LANE_LIVE):
+        """
+        Thêm file vào hàng đợi (bỏ qua nếu file đã đang chờ upload).
+        lane: LANE_LIVE (ảnh vừa chụp) hoặc LANE_BACKFILL (upload bù cả thư mục)
+        """
+        if lane not in LANES:
+            raise ValueError(f"Làn upload không hợp lệ: {lane}")
+        with self._not_empty:
+            item_id, _ = self._insert(file_path, channel_name, branch_name, custom_name, lane, time.time())
+            self._db.commit()
+            self._not_empty.notify()
+            return item_id
+
+    def put_many(self, items):
+        """
+        Thêm nhiều file trong một transaction: items = [(file_path, channel_name, branch_name, custom_name, lane)].
+        Trả về số mục mới
+        """
+        now = time.time()
+        added = 0
+        with self._not_empty:
+            for file_path, channel_name, branch_name, custom_name, lane in items:
+                _, is_new = self._insert(file_path, channel_name, branch_name, custom_name,
+                                         lane if lane in LANES else LANE_LIVE, now)
+                added += is_new
+            self._db.commit()
+            self._not_empty.notify_all()
+        return added
+
+    def _insert(self, file_path, channel_name, branch_name, custom_name, lane, now):
+        """Thêm một mục (chưa commit). Trả về (ID, có phải mục mới không)"""
+        file_path = os.path.abspath(file_path)
+        row = self._db.execute(
+            "SELECT id, lane FROM items WHERE file_path = ? AND state IN (?, ?)",
+            (file_path, STATE_PENDING, STATE_IN_FLIGHT)).fetchone()
+        if row:
+            if lane == LANE_LIVE and row[1] != LANE_LIVE:
+                # File đang chờ trong backfill vừa được chụp lại -> chuyển lên làn live
+                self._db.execute("UPDATE items SET lane = ?, updated_at = ? WHERE id = ?", (lane, now, row[0]))
+            return row[0], False
+        cursor = self._db.execute(
+            "INSERT INTO items (file_path, channel_name, branch_name, custom_name, state,"
+            " created_at, updated_at, lane) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_path, channel_name, branch_name, custom_name, STATE_PENDING, now, now, lane))
+        return cursor.lastrowid, True
+
+    def claim(self, timeout=1.0):
+        """
+        Lấy mục tiếp theo đã tới lượt upload và đánh dấu in_flight.
+        Trả về dict thông tin mục, hoặc None nếu hết thời gian chờ.
+        """
+        deadline = time.time() + timeout
+        with self._not_empty:
+            while True:
+                now = time.time()
+                row = self._next_item(now)
+                if row:
+                    self._db.execute("UPDATE items SET state = ?, updated_at = ? WHERE id = ?",
+                                     (STATE_IN_FLIGHT, now, row[0]))
+                    self._db.commit()
+                    self._record_wait(row[10], now - row[6])
+                    return {
+                        'id': row[0],
+                        'file_path': row[1],
+                        'channel_name': row[2],
+                        'branch_name': row[3],
+                        'custom_name': row[4],
+                        'attempts': row[5],
+                        'created_at': row[6],
+                        'session_uri': row[7],
+                        'session_offset': row[8] or 0,
+                        'session_size': row[9],
+                        'lane': row[10],
+                        'backends_done': row[11].split(',') if row[11] else [],
+                        'session_md5': row[12],
+                    }
+                remaining = deadline - now
+                if remaining <= 0:
+                    return None
+                self._not_empty.wait(remaining)
+
+    def _next_item(self, now):
+        """Chọn mục tiếp theo: live trước (nhường backfill một lượt sau live_weight mục), xoay vòng chi nhánh"""
+        live = self._next_in_lane(LANE_LIVE, now)
+        if live and self._live_streak < self.live_weight:
+            backfill = None
+        else:
+            backfill = self._next_in_lane(LANE_BACKFILL, now)
+        if live and backfill is None:
+            self._live_streak += 1
+            row = live
+        elif backfill:
+            self._live_streak = 0
+            row = backfill
+        else:
+            self._live_streak = 0
+            return None
+        self._last_branch[row[10]] = row[3]
+        return row
+
+    def _next_in_lane(self, lane, now):
+        """Mục cũ nhất của chi nhánh kế tiếp (theo thứ tự tên) sau chi nhánh vừa lấy trong làn"""
+        query = ("SELECT id, file_path, channel_name, branch_name, custom_name, attempts, created_at,"
+                 " session_uri, session_offset, session_size, lane, backends_done, session_md5"
+                 " FROM items WHERE state = ? AND lane = ? AND next_attempt_at <= ?")
+        last_branch = self._last_branch.get(lane)
+        if last_branch is not None:
+            row = self._db.execute(query + " AND branch_name > ? ORDER BY branch_name, id LIMIT 1",
+                                   (STATE_PENDING, lane, now, last_branch)).fetchone()
+            if row:
+                return row
+        return self._db.execute(query + " ORDER BY branch_name, id LIMIT 1", (STATE_PENDING, lane, now)).fetchone()
+
+    def _record_wait(self, lane, wait):
+        stats = self._wait_stats[lane]
+        stats['claimed'] += 1
+        # Trung bình trượt: phản ánh thời gian chờ gần đây chứ không phải từ lúc mở app
+        stats['avg_wait'] = wait if stats['claimed'] == 1 else stats['avg_wait'] * 0.9 + wait * 0.1
+        stats['max_wait'] = max(stats['max_wait'], wait)
+
+    def lane_status(self):
+        """
+        Trạng thái từng làn: {làn: {pending, in_flight, oldest_wait, avg_wait, max_wait, claimed}}
+        oldest_wait: số giây mục pending lâu nhất đã chờ; avg_wait/max_wait: thời gian chờ của các mục đã lấy
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT lane, state, COUNT(*), MIN(created_at) FROM items WHERE state IN (?, ?) GROUP BY lane, state",
+                (STATE_PENDING, STATE_IN_FLIGHT)).fetchall()
+            status = {lane: dict(self._wait_stats[lane], pending=0, in_flight=0, oldest_wait=0.0) for lane in LANES}
+        for lane, state, count, oldest in rows:
+            lane_status = status.setdefault(lane, {'pending': 0, 'in_flight': 0, 'oldest_wait': 0.0,
+                                                   'claimed': 0, 'avg_wait': 0.0, 'max_wait': 0.0})
+            lane_status[state] = count
+            if state == STATE_PENDING:
+                lane_status['oldest_wait'] = now - oldest
+        return status
+
+    def complete(self, item_id):
+        """Đánh dấu đã upload xong"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET state = ?, last_error = NULL, session_uri = NULL, session_offset = NULL,"
+                " session_size = NULL, session_md5 = NULL, updated_at = ? WHERE id = ?",
+                (STATE_DONE, time.time(), item_id))
+            self._db.commit()
+
+    def release(self, item_id):
+        """Trả mục về pending ngay, không tính lần thử (upload bị dừng giữa chừng)"""
+        with self._not_empty:
+            self._db.execute("UPDATE items SET state = ?, next_attempt_at = 0, updated_at = ? WHERE id = ?",
+                             (STATE_PENDING, time.time(), item_id))
+            self._db.commit()
+            self._not_empty.notify()
+
+    def save_session(self, item_id, session_uri, offset, size, md5=None):
+        """Lưu phiên resumable upload, số byte đã gửi và MD5 của file để lần sau upload tiếp từ đó"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET session_uri = ?, session_offset = ?, session_size = ?, session_md5 = ?,"
+                " updated_at = ? WHERE id = ?",
+                (session_uri, offset, size, md5, time.time(), item_id))
+            self._db.commit()
+
+    def set_backends_done(self, item_id, names):
+        """Ghi các nơi lưu đã nhận file, lần thử lại chỉ gửi tới nơi còn lỗi"""
+        with self._lock:
+            self._db.execute("UPDATE items SET backends_done = ?, updated_at = ? WHERE id = ?",
+                             (','.join(sorted(names)) or None, time.time(), item_id))
+            self._db.commit()
+
+    def clear_session(self, item_id):
+        """Bỏ phiên resumable (hết hạn, file đã thay đổi hoặc bản trên Drive bị hỏng)"""
+        self.save_session(item_id, None, None, None)
+
+    def fail(self, item_id, error, count_attempt=True, retry_after=None):
+        """
+        Ghi nhận lỗi: hẹn thử lại theo backoff, hoặc chuyển sang failed khi hết số lần thử.
+        count_attempt=False: lỗi tạm thời (mất mạng) chỉ chờ rồi thử lại, không bao giờ vào dead-letter.
+        retry_after: số giây chờ do server yêu cầu (thay cho backoff).
+        Trả về trạng thái mới của mục.
+        """
+        now = time.time()
+        with self._not_empty:
+            row = self._db.execute("SELECT attempts FROM items WHERE id = ?", (item_id,)).fetchone()
+            if not row:
+                return None
+            attempts = row[0] + 1
+            if count_attempt and attempts >= self.max_attempts:
+                state, next_attempt_at = STATE_FAILED, 0
+            else:
+                state = STATE_PENDING
+                delay = retry_after if retry_after is not None else self.backoff_delay(attempts)
+                next_attempt_at = now + delay
+            self._db.execute(
+                "UPDATE items SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?"
+                " WHERE id = ?", (state, attempts, next_attempt_at, str(error), now, item_id))
+            self._db.commit()
+            self._not_empty.notify()
+            return state
+
+    def dead_letter(self, item_id, error):
+        """Chuyển thẳng sang failed (lỗi không thể thử lại, ví dụ file local đã mất)"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET state = ?, attempts = attempts + 1, last_error = ?, updated_at = ? WHERE id = ?",
+                (STATE_FAILED, str(error), time.time(), item_id))
+            self._db.commit()
+
+    def backoff_delay(self, attempts):
+        """Thời gian chờ trước lần thử thứ attempts: tăng gấp đôi mỗi lần, có nhiễu ngẫu nhiên"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def retry_failed(self):
+        """Cho các mục dead-letter thử lại từ đầu. Trả về số mục"""
+        with self._not_empty:
+            cursor = self._db.execute(
+                "UPDATE items SET state = ?, attempts = 0, next_attempt_at = 0, updated_at = ? WHERE state = ?",
+                (STATE_PENDING, time.time(), STATE_FAILED))
+            self._db.commit()
+            self._not_empty.notify_all()
+            return cursor.rowcount
+
+    def failed_items(self):
+        """Danh sách mục dead-letter: [(file_path, attempts, last_error)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT file_path, attempts, last_error FROM items WHERE state = ? ORDER BY id",
+                (STATE_FAILED,)).fetchall()
+
+    def counts(self):
+        """Số mục theo trạng thái"""
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        counts = {STATE_PENDING: 0, STATE_IN_FLIGHT: 0, STATE_DONE: 0, STATE_FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def qsize(self):
+        """Số file còn phải upload (đang chờ + đang upload)"""
+        counts = self.counts()
+        return counts[STATE_PENDING] + counts[STATE_IN_FLIGHT]
+
+    def has_pending(self):
+        """Còn mục pending (kể cả đang chờ tới lượt thử lại)"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM items WHERE state = ? LIMIT 1",
+                                    (STATE_PENDING,)).fetchone() is not None
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def purge_done(self, older_than_days=7):
+        """Xóa các mục đã xong quá lâu để file db không phình"""
+        cutoff = time.time() - older_than_days * 86400
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM items WHERE state = ? AND updated_at < ?",
+                                      (STATE_DONE, cutoff))
+            self._db.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
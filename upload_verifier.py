@@ -0,0 +1,213 @@
+import os
+import time
+import argparse
+
+from drive_batch import DriveBatch
+from fingerprint_cache import FingerprintCache
+from upload_queue import LANE_BACKFILL
+
+# Kết quả kiểm tra một file
+VERIFY_OK = 'ok'                      # Bản trên Drive khớp MD5 và kích thước
+VERIFY_CORRUPT = 'corrupt'            # Bản trên Drive khác nội dung đã upload (hỏng)
+VERIFY_CHANGED = 'changed'            # File local đã sửa sau khi upload
+VERIFY_MISSING = 'missing'            # Bản trên Drive đã bị xóa/chuyển vào thùng rác
+VERIFY_LOCAL_MISSING = 'local_missing'  # File local không còn (không kiểm tra được)
+VERIFY_STATUSES = (VERIFY_OK, VERIFY_CORRUPT, VERIFY_CHANGED, VERIFY_MISSING, VERIFY_LOCAL_MISSING)
+STATUS_LABELS = {
+    VERIFY_OK: "✅ Khớp",
+    VERIFY_CORRUPT: "❌ Hỏng trên Drive",
+    VERIFY_CHANGED: "✏️ Đã sửa local",
+    VERIFY_MISSING: "☁️ Mất trên Drive",
+    VERIFY_LOCAL_MISSING: "📁 Không còn file local",
+}
+
+class VerificationReport:
+    """Kết quả một lượt kiểm tra, gom theo chi nhánh"""
+
+    def __init__(self):
+        self.branches = {}  # Chi nhánh -> {trạng thái: số file}
+        self.problems = []  # [(chi nhánh, đường dẫn, trạng thái)]
+        self.requeued = 0
+        self.not_requeued = 0  # Bản ghi cũ không có kênh/chi nhánh nên không tự upload lại được
+        self.missing = []      # File mất trên Drive chưa được upload lại (có thể đã bị xóa cố ý)
+        self.trashed = 0       # Bản cũ trên Drive đã chuyển vào thùng rác (hỏng hoặc file local đã sửa)
+        self.hashed = 0
+        self.seconds = 0.0
+
+    def add(self, branch, local_path, status):
+        counts = self.branches.setdefault(branch, dict.fromkeys(VERIFY_STATUSES, 0))
+        counts[status] += 1
+        if status not in (VERIFY_OK, VERIFY_LOCAL_MISSING):
+            self.problems.append((branch, local_path, status))
+
+    def summary(self):
+        """Báo cáo dạng text theo chi nhánh"""
+        lines = [f"🔍 Kiểm tra {sum(sum(c.values()) for c in self.branches.values())} file đã upload "
+                 f"({self.hashed} file phải hash lại, {self.seconds:.1f}s)"]
+        for branch in sorted(self.branches):
+            counts = self.branches[branch]
+            details = ", ".join(f"{STATUS_LABELS[status]}: {count}" for status, count in counts.items() if count)
+            lines.append(f"  🏪 {branch}: {details}")
+        if self.trashed:
+            lines.append(f"  🗑️ Đã chuyển {self.trashed} bản cũ trên Drive vào thùng rác")
+        if self.requeued:
+            lines.append(f"  📤 Đã đưa lại vào hàng đợi: {self.requeued} file")
+        if self.missing:
+            lines.append(f"  ☁️ {len(self.missing)} file đã mất trên Drive, chưa upload lại "
+                         f"(có thể đã bị xóa cố ý, hãy chọn upload lại nếu cần):")
+            lines.extend(f"     - {path}" for path in self.missing[:10])
+            if len(self.missing) > 10:
+                lines.append(f"     ... và {len(self.missing) - 10} file khác")
+        if self.not_requeued:
+            lines.append(f"  ⚠️ {self.not_requeued} file không rõ kênh/chi nhánh, hãy upload lại thư mục")
+        return "\n".join(lines)
+
+class UploadVerifier:
+    """
+    Kiểm tra lại các file đã upload: lấy md5Checksum và size trên Drive theo folder (phân trang / index)
+    và theo batch cho file nằm ngoài folder đã biết, so với MD5 local (cache fingerprint, hash song song).
+    File hỏng hoặc đã sửa local được đưa lại vào hàng đợi (làn backfill), bản cũ trên Drive vào thùng rác.
+    File mất trên Drive (có thể bị xóa cố ý) chỉ được báo cáo, trừ khi gọi với reupload_missing=True.
+    """
+
+    def __init__(self, uploader, fingerprints=None):
+        self.uploader = uploader
+        self.fingerprints = fingerprints or FingerprintCache()
+
+    def _remote_files(self, entries):
+        """Thông tin trên Drive theo file ID: {id: {md5Checksum, size}} (None nếu đã xóa/trong thùng rác)"""
+        uploader = self.uploader
+        remote = {}
+        uploader.refresh_drive_index(force=True)
+        for folder_id in {entry['folder_id'] for entry in entries if entry['folder_id']}:
+            listing = uploader.drive_index.listing(folder_id)
+            if listing is None:
+                listing = uploader._get_remote_listing(folder_id, refresh=True)
+            else:
+                # Danh sách mới từ index thay cho bản đã tải (có thể còn file đã bị xóa trên Drive)
+                uploader._remote_listings[folder_id] = listing
+                uploader._remote_listing_times[folder_id] = time.time()
+            for items in listing.values():
+                for item in items:
+                    remote[item['id']] = item
+
+        # File không có trong danh sách folder (đã bị chuyển đi hoặc xóa): hỏi từng file theo batch
+        missing_ids = {entry['drive_file_id'] for entry in entries} - set(remote)
+        if missing_ids:
+            batch = DriveBatch(uploader.service, uploader.scheduler)
+            for file_id in missing_ids:
+                batch.add(file_id, lambda file_id=file_id: uploader.service.files().get(
+                    fileId=file_id, fields='id, md5Checksum, size, trashed'))
+            for file_id, (response, error) in batch.execute().items():
+                remote[file_id] = None if error or response.get('trashed') else response
+        return remote
+
+    def verify(self, base_dir=None, requeue=True, reupload_missing=False):
+        """
+        Kiểm tra mọi file đã upload (trong base_dir nếu có). Trả về VerificationReport.
+        reupload_missing: upload lại cả file đã mất trên Drive (mặc định chỉ báo cáo)
+        """
+        started = time.perf_counter()
+        uploader = self.uploader
+        report = VerificationReport()
+        entries = uploader.ledger.entries(base_dir)
+        if not entries:
+            uploader.log_message("🔍 Chưa có file nào đã upload để kiểm tra")
+            return report
+
+        remote = self._remote_files(entries)
+        # Archive: bản trên Drive là cả file tar/zip, so với MD5 của archive
+        archive_md5s = uploader.archive_index.checksums()
+        # MD5 local: lấy từ cache nếu file chưa đổi, còn lại hash song song
+        misses_before = self.fingerprints.stats['misses']
+        local_md5s = self.fingerprints.digest_many([entry['local_path'] for entry in entries], 'md5')
+        report.hashed = self.fingerprints.stats['misses'] - misses_before
+
+        verified, trash_ids, requeue_entries = [], [], []
+        for entry in entries:
+            local_path = entry['local_path']
+            branch = entry['branch_name'] or self._folder_name(entry['folder_id'])
+            local_md5 = local_md5s.get(local_path)
+            if local_md5 is None:
+                report.add(branch, local_path, VERIFY_LOCAL_MISSING)
+                continue
+            item = remote.get(entry['drive_file_id'])
+            # Bản trên Drive: cả archive, bản nén lúc upload (kích thước khác file gốc) hoặc chính file local
+            expected_md5 = archive_md5s.get(entry['drive_file_id']) or entry['uploaded_md5'] or entry['md5']
+            same_bytes = entry['drive_file_id'] not in archive_md5s and not entry['uploaded_md5']
+            if item is None:
+                status = VERIFY_MISSING
+            elif local_md5 != entry['md5']:
+                status = VERIFY_CHANGED
+                if entry['drive_file_id'] not in archive_md5s:
+                    trash_ids.append(entry['drive_file_id'])  # Bản cũ, sẽ thay bằng bản vừa sửa
+            elif item.get('md5Checksum') != expected_md5 or (
+                    same_bytes and item.get('size') is not None
+                    and int(item['size']) != os.path.getsize(local_path)):
+                status = VERIFY_CORRUPT
+                if entry['drive_file_id'] not in archive_md5s:
+                    trash_ids.append(entry['drive_file_id'])
+            else:
+                status = VERIFY_OK
+            report.add(branch, local_path, status)
+            if status == VERIFY_OK:
+                verified.append(local_path)
+            elif status == VERIFY_MISSING and not reupload_missing:
+                report.missing.append(local_path)
+            else:
+                requeue_entries.append(entry)
+
+        uploader.ledger.mark_verified(verified)
+        if requeue and requeue_entries:
+            if trash_ids:
+                # Bản hỏng/bản cũ vào thùng rác (khôi phục được trong 30 ngày) để không có hai file cùng tên
+                uploader.trash_files(trash_ids)
+                report.trashed = len(trash_ids)
+            for entry in requeue_entries:
+                if not entry['channel_name'] or not entry['branch_name']:
+                    report.not_requeued += 1
+                    continue
+                uploader.ledger.forget(entry['local_path'])
+                custom_name = entry['drive_name'] if '/' not in (entry['drive_name'] or '') else None
+                uploader.add_to_upload_queue(entry['local_path'], entry['channel_name'], entry['branch_name'],
+                                             custom_name, lane=LANE_BACKFILL)
+                report.requeued += 1
+
+        report.seconds = time.perf_counter() - started
+        uploader.log_message(report.summary())
+        return report
+
+    def _folder_name(self, folder_id):
+        """Tên folder trên Drive (từ index) để gom báo cáo với bản ghi cũ không có chi nhánh"""
+        item = self.uploader.drive_index.get(folder_id) if folder_id else None
+        return item['name'] if item else "(không rõ chi nhánh)"
+
+    def close(self):
+        self.fingerprints.close()
+
+def main():
+    from google_drive_uploader import GoogleDriveUploader
+
+    ap = argparse.ArgumentParser(description="Kiểm tra các file đã upload với md5Checksum trên Google Drive")
+    ap.add_argument("--base-dir", default=None, help="Chỉ kiểm tra file trong thư mục này (ví dụ shots)")
+    ap.add_argument("--no-requeue", dest="requeue", action="store_false", help="Chỉ báo cáo, không upload lại")
+    ap.add_argument("--reupload-missing", action="store_true",
+                    help="Upload lại cả file đã mất trên Drive (mặc định chỉ báo cáo)")
+    args = ap.parse_args()
+
+    uploader = GoogleDriveUploader()
+    uploader.load_config()
+    if not uploader.authenticate():
+        return
+    verifier = UploadVerifier(uploader)
+    try:
+        report = verifier.verify(args.base_dir, requeue=args.requeue, reupload_missing=args.reupload_missing)
+        if report.requeued:
+            uploader.start_upload_worker()
+            for thread in uploader.upload_threads:
+                thread.join()
+    finally:
+        verifier.close()
+
+if __name__ == "__main__":
+    main()